@@ -12,10 +12,10 @@ from calibre.gui2 import I  # type: ignore
 from calibre.utils.localization import _  # type: ignore
 
 from . import EbookTranslator
-from .lib.utils import uid, traceback_error
+from .lib.utils import traceback_error
 from .lib.config import get_config
 from .lib.encodings import encoding_list
-from .lib.cache import Paragraph, get_cache
+from .lib.cache import Paragraph, get_cache, get_cache_id
 from .lib.translation import get_engine_class, get_translator, get_translation
 from .lib.element import get_element_handler
 from .lib.conversion import extract_item, extra_formats
@@ -94,16 +94,18 @@ class PreparationWorker(QObject):
         encoding = ''
         if self.ebook.encoding.lower() != 'utf-8':
             encoding = self.ebook.encoding.lower()
-        cache_id = uid(
-            input_path + self.engine_class.name + self.ebook.target_lang
-            + merge_length + encoding)
+        cache_id = get_cache_id(
+            input_path, self.engine_class.name, self.ebook.target_lang,
+            merge_length, encoding)
         cache = get_cache(cache_id)
 
-        if cache.is_fresh() or not cache.is_persistence():
+        if cache.is_fresh() or cache.is_outdated() or \
+                not cache.is_persistence():
             self.progress_detail.emit(
                 'Start processing the ebook: %s' % self.ebook.title)
             cache.set_info('title', self.ebook.title)
             cache.set_info('engine_name', self.engine_class.name)
+            cache.set_info('source_lang', self.ebook.source_lang)
             cache.set_info('target_lang', self.ebook.target_lang)
             cache.set_info('merge_length', merge_length)
             cache.set_info('plugin_version', EbookTranslator.__version__)
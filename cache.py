@@ -9,7 +9,9 @@ from qt.core import (  # type: ignore
 from calibre.utils.localization import _  # type: ignore
 
 from .lib.utils import open_path
-from .lib.cache import default_cache_path, TranslationCache
+from .lib.cache import default_cache_path, TranslationCache, get_memory
+from .lib.exchange import import_cache, export_cache, import_memory
+from .lib.translation import get_engine_class
 from .lib.config import get_config
 from .components import Footer, AlertMessage
 
@@ -57,6 +59,8 @@ class CacheManager(QDialog):
         self.cache_reset.clicked.connect(self.reset)
         self.cache_reveal.clicked.connect(self.reveal)
         self.clear_button.clicked.connect(self.clear)
+        self.migrate_button.clicked.connect(self.migrate)
+        self.memory_button.clicked.connect(self.import_memory)
         self.delete_button.clicked.connect(self.cache_list.delete_cache)
 
         self.cache_count.emit()
@@ -89,10 +93,19 @@ class CacheManager(QDialog):
 
         self.clear_button = QPushButton(_('Clear All'))
         self.clear_button.setDisabled(True)
+        self.migrate_button = QPushButton(_('Compact'))
+        self.memory_button = QPushButton(_('Import to Memory'))
+        self.memory_button.setToolTip(_(
+            'Import the translations of a TMX or JSON Lines file into the '
+            'translation memory shared across books. The ones without an '
+            'engine or a language are taken as those of the current '
+            'engine.'))
         self.delete_button = QPushButton(_('Delete'))
         self.delete_button.setDisabled(True)
 
         layout.addWidget(self.clear_button)
+        layout.addWidget(self.migrate_button)
+        layout.addWidget(self.memory_button)
         layout.addStretch(1)
         layout.addWidget(self.delete_button)
 
@@ -110,7 +123,8 @@ class CacheManager(QDialog):
             'Are you sure to proceed?'))
         if action != 'yes':
             return
-        TranslationCache.move(self.default_path)
+        if not self.move_caches(self.default_path):
+            return
         self.cache_list.model().refresh()
         self.cache_path.setText(self.default_path)
         self.cache_reset.setDisabled(True)
@@ -131,20 +145,70 @@ class CacheManager(QDialog):
         if len([i for i in os.listdir(path) if not i.startswith('.')]) > 0:
             self.alert.pop(_('Please choose an empty folder.'))
             return
-        TranslationCache.move(path)
+        if not self.move_caches(path):
+            return
         self.cache_list.model().refresh()
         self.cache_path.setText(path)
         self.cache_reset.setDisabled(False)
         self.config.save(cache_path=path)
 
+    def move_caches(self, path):
+        try:
+            moved = TranslationCache.move(path)
+        except OSError as e:
+            self.alert.pop(str(e), 'warning')
+            return False
+        if not moved:
+            self.alert.pop(_(
+                'The caches can not be moved while they are in use by '
+                'running translation jobs.'), 'warning')
+        return moved
+
     def clear(self):
         action = self.alert.ask(
             _('Are you sure you want to clear all caches?'))
         if action != 'yes':
             return
-        TranslationCache.clean()
-        self.cache_list.model().clear()
+        try:
+            skipped = TranslationCache.clean()
+        except OSError as e:
+            skipped = []
+            self.alert.pop(str(e), 'warning')
+        self.cache_list.model().refresh()
+        self.cache_count.emit()
+        if len(skipped) > 0:
+            self.alert.pop(_(
+                '{} cache(s) in use by running translation jobs are not '
+                'deleted.').format(len(skipped)), 'warning')
+
+    def migrate(self):
+        count, before, after = TranslationCache.migrate_all()
+        if count < 1:
+            return self.alert.pop(_('All caches are up to date.'))
+        self.cache_list.model().refresh()
         self.cache_count.emit()
+        self.alert.pop(
+            _('{} cache(s) migrated: {}MB before, {}MB after.')
+            .format(count, before, after))
+
+    def import_memory(self):
+        path = QFileDialog.getOpenFileName(
+            filter='TMX (*.tmx);;JSON Lines (*.jsonl)')[0]
+        if not path:
+            return
+        engine_class = get_engine_class()
+        memory = get_memory()
+        try:
+            count = import_memory(
+                memory, path, engine_class.name,
+                engine_class.config.get('target_lang'))
+        except Exception as e:
+            return self.alert.pop(str(e), 'warning')
+        finally:
+            memory.close()
+        self.alert.pop(
+            _('{} translation(s) imported into the translation memory.')
+            .format(count))
 
     def reveal(self):
         cache_path = TranslationCache.cache_path
@@ -178,23 +242,76 @@ class CacheTableView(QTableView):
 
     def contextMenuEvent(self, event):
         menu = QMenu()
+        menu.addAction(_('Pin'), lambda: self.pin_cache(True))
+        menu.addAction(_('Unpin'), lambda: self.pin_cache(False))
+        if len(self.selectionModel().selectedRows()) == 1:
+            menu.addAction(_('Import Translations'), self.import_translations)
+            menu.addAction(_('Export Translations'), self.export_translations)
         menu.addAction(_('Delete'), self.delete_cache)
         menu.setMinimumSize(menu.sizeHint())
         menu.setMaximumSize(menu.sizeHint())
         menu.exec_(QCursor.pos())
 
+    def pin_cache(self, pinned):
+        """The pinned caches are never evicted when over the size limit."""
+        for row in self.selectionModel().selectedRows():
+            TranslationCache.pin(row.data(Qt.UserRole), pinned)
+        self.model().refresh()
+
+    def selected_cache(self):
+        row = self.selectionModel().selectedRows()[0]
+        return TranslationCache(os.path.splitext(row.data(Qt.UserRole))[0])
+
+    def import_translations(self):
+        path = QFileDialog.getOpenFileName(
+            filter='TMX (*.tmx);;JSON Lines (*.jsonl)')[0]
+        if not path:
+            return
+        cache = self.selected_cache()
+        try:
+            count = import_cache(cache, path)
+        except Exception as e:
+            return self.alert.pop(str(e), 'warning')
+        finally:
+            cache.close()
+        self.model().refresh()
+        self.alert.pop(_('{} paragraph(s) imported.').format(count))
+
+    def export_translations(self):
+        path = QFileDialog.getSaveFileName(
+            filter='TMX (*.tmx);;JSON Lines (*.jsonl)')[0]
+        if not path:
+            return
+        cache = self.selected_cache()
+        try:
+            export_cache(cache, path)
+        finally:
+            cache.close()
+
     def delete_cache(self):
         action = self.alert.ask(
             _('Are you sure you want to delete the selected cache(s)?'))
         if action != 'yes':
             return
+        skipped = 0
         for row in reversed(self.selectionModel().selectedRows()):
             filename = row.data(Qt.UserRole)
-            TranslationCache.remove(filename)
+            try:
+                removed = TranslationCache.remove(filename)
+            except OSError:
+                # E.g. the cache is opened by another process on Windows.
+                removed = False
+            if not removed:
+                skipped += 1
+                continue
             self.model().delete(row.row())
         self.clearSelection()
         if self.parent is not None:
             self.parent.cache_count.emit()
+        if skipped > 0:
+            self.alert.pop(_(
+                '{} cache(s) in use by running translation jobs are not '
+                'deleted.').format(skipped), 'warning')
 
 
 def update_cache(func):
@@ -208,7 +325,8 @@ def update_cache(func):
 class CacheTableModel(QAbstractTableModel):
     headers = [
         _('Title'), _('Engine'), _('Language'), _('Merge Length'),
-        _('Size (MB)'), _('Last Modification Time'), _('Filename'),
+        _('Size (MB)'), _('Translated (%)'), _('Last Used'),
+        _('Pinned'), _('Filename'),
     ]
 
     def __init__(self):
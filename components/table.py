@@ -237,11 +237,20 @@ class AdvancedTranslationTable(QTableWidget):
     def show_by_text(self, text, content_type):
         if not text:
             return
+        column = {'original_code': 'raw', 'translation_text': 'translation'}
+        # Look up the full-text index of the cache if available instead of
+        # matching the text of the rows one by one.
+        ids = self.parent.cache.search(
+            text, column.get(content_type, 'original'))
         paragraphs = []
         for row in range(self.rowCount()):
             if self.isRowHidden(row):
                 continue
             paragraph = self.paragraph(row)
+            if ids is not None:
+                if paragraph.id not in ids:
+                    paragraphs.append(paragraph)
+                continue
             if content_type == 'original_code':
                 content = paragraph.raw.lower()
             elif content_type == 'translation_text':
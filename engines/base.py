@@ -1,4 +1,5 @@
 import socket
+import asyncio
 import os.path
 from typing import Any
 
@@ -7,6 +8,7 @@ from mechanize import HTTPError
 from calibre.utils.localization import _, lang_as_iso639_1  # type: ignore
 
 from ..lib.utils import log, traceback_error, request, socks_proxy
+from ..lib.session import get_session
 from ..lib.exception import UnexpectedResult
 
 from .languages import lang_directionality
@@ -37,10 +39,18 @@ class Base:
     using_tip = None
 
     concurrency_limit: int = 0
+    adaptive_concurrency: bool = False
+    async_transport: bool = False
     request_interval: float = 0.0
     request_attempt: int = 3
     request_timeout: float = 10.0
+    requests_per_minute: int = 0
+    tokens_per_minute: int = 0
     max_error_count: int = 10
+    # The maximum number of texts and the maximum total characters of the
+    # texts to be sent in one request, for the API accepting an array.
+    batch_size: int = 1
+    batch_characters: int = 5000
 
     def __init__(self):
         self.source_lang: str
@@ -52,6 +62,7 @@ class Base:
         self.proxy_port: int | None = None
 
         self.merge_enabled = False
+        self.session = get_session(self.name)
         self.api_keys: list = self.config.get('api_keys', [])[:]
         self.bad_api_keys = []
         self.api_key = self.get_api_key()
@@ -59,6 +70,12 @@ class Base:
         concurrency_limit = self.config.get('concurrency_limit')
         if concurrency_limit is not None:
             self.concurrency_limit = int(concurrency_limit)
+        adaptive_concurrency = self.config.get('adaptive_concurrency')
+        if adaptive_concurrency is not None:
+            self.adaptive_concurrency = bool(adaptive_concurrency)
+        async_transport = self.config.get('async_transport')
+        if async_transport is not None:
+            self.async_transport = bool(async_transport)
         request_interval = self.config.get('request_interval')
         if request_interval is not None:
             self.request_interval = request_interval
@@ -68,9 +85,18 @@ class Base:
         request_timeout = self.config.get('request_timeout')
         if request_timeout is not None:
             self.request_timeout = request_timeout
+        requests_per_minute = self.config.get('requests_per_minute')
+        if requests_per_minute is not None:
+            self.requests_per_minute = int(requests_per_minute)
+        tokens_per_minute = self.config.get('tokens_per_minute')
+        if tokens_per_minute is not None:
+            self.tokens_per_minute = int(tokens_per_minute)
         max_error_count = self.config.get('max_error_count')
         if max_error_count is not None:
             self.max_error_count = max_error_count
+        batch_size = self.config.get('batch_size')
+        if batch_size is not None:
+            self.batch_size = max(1, min(int(batch_size), self.batch_size))
 
     @classmethod
     def load_lang_codes(cls, codes):
@@ -174,6 +200,12 @@ class Base:
     def set_concurrency_limit(self, limit):
         self.concurrency_limit = limit
 
+    def set_adaptive_concurrency(self, enable):
+        self.adaptive_concurrency = enable
+
+    def set_async_transport(self, enable):
+        self.async_transport = enable
+
     def set_request_attempt(self, limit):
         self.request_attempt = limit
 
@@ -183,6 +215,23 @@ class Base:
     def set_request_timeout(self, seconds):
         self.request_timeout = seconds
 
+    def set_rate_limit(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+    def set_batch_size(self, size):
+        self.batch_size = size
+
+    def support_batch(self) -> bool:
+        """Whether multiple texts can be translated within one request."""
+        return self.batch_size > 1 and not self.stream
+
+    def estimate_tokens(self, text) -> int:
+        """Estimate the quota cost of translating the text, which is the
+        character count for most of the translation services.
+        """
+        return len(text)
+
     def _get_source_code(self):
         return self.get_source_code(self.source_lang)
 
@@ -192,39 +241,103 @@ class Base:
     def _is_auto_lang(self):
         return self._get_source_code() == 'auto'
 
-    def translate(self, content):
+    def _request_params(self, body):
+        params = {
+            'url': self.get_endpoint(),
+            'data': body,
+            'headers': self.get_headers(),
+            'method': self.method,
+            'proxy_uri': None,
+            'timeout': int(self.request_timeout),
+            'raw_object': self.stream,
+        }
+        if self.proxy_type == 'http':
+            params['proxy_uri'] = self.proxy_uri
+        return params
+
+    def _is_socks_proxy(self):
+        return self.proxy_type == 'socks5' and self.proxy_host is not None \
+            and self.proxy_port is not None
+
+    def _raise_unexpected_result(self, error, response):
+        """Raise the error unless a valid API key can be swapped in, which
+        should be used to retry the translation.
+        """
+        # Combine the error messages for investigation.
+        error_message = traceback_error() + '\n\n' + str(error)
+        if not self.stream and isinstance(response, str):
+            error_message += '\n\n' + response
+        # Swap a valid API key if necessary.
+        if self.need_swap_api_key(error_message) and self.swap_api_key():
+            return
+        raise UnexpectedResult(
+            _('Can not parse returned response. Raw data: {}')
+            .format('\n\n' + error_message))
+
+    def _check_batch_result(self, contents, translations):
+        if len(translations) != len(contents):
+            raise UnexpectedResult(
+                _('Expected {} translations, but got {}.')
+                .format(len(contents), len(translations)))
+        return translations
+
+    def _translate(self, get_body, get_result, content):
         response = None
         try:
-            params = {
-                'url': self.get_endpoint(),
-                'data': self.get_body(content),
-                'headers': self.get_headers(),
-                'method': self.method,
-                'proxy_uri': None,
-                'timeout': int(self.request_timeout),
-                'raw_object': self.stream
-            }
-            if self.proxy_type == 'socks5' and self.proxy_host is not None \
-                    and self.proxy_port is not None:
+            params = self._request_params(get_body(content))
+            params['session'] = self.session
+            if self._is_socks_proxy():
                 with socks_proxy(self.proxy_host, self.proxy_port):
                     log.debug('Used socket: ', id(socket.socket))
                     response = request(**params)
             else:
-                if self.proxy_type == 'http':
-                    params['proxy_uri'] = self.proxy_uri
                 response = request(**params)
-            return self.get_result(response)
+            return get_result(response)
         except Exception as e:
-            # Combine the error messages for investigation.
-            error_message = traceback_error() + '\n\n' + str(e)
-            if not self.stream and isinstance(response, str):
-                error_message += '\n\n' + response
-            # Swap a valid API key if necessary.
-            if self.need_swap_api_key(error_message) and self.swap_api_key():
-                return self.translate(content)
-            raise UnexpectedResult(
-                _('Can not parse returned response. Raw data: {}')
-                .format('\n\n' + error_message))
+            self._raise_unexpected_result(e, response)
+            return self._translate(get_body, get_result, content)
+
+    async def _translate_async(self, get_body, get_result, content):
+        response = None
+        try:
+            body = await get_body(content)
+            # Building the headers may block, e.g. to fetch an access token.
+            params = await asyncio.get_running_loop().run_in_executor(
+                None, self._request_params, body)
+            response = await self.session.request_async(**params)
+            return await get_result(response)
+        except Exception as e:
+            self._raise_unexpected_result(e, response)
+            return await self._translate_async(get_body, get_result, content)
+
+    def translate(self, content):
+        return self._translate(self.get_body, self.get_result, content)
+
+    async def translate_async(self, content):
+        """Translate on the running event loop without occupying a thread.
+        The SOCKS5 proxy is only supported by the threaded transport.
+        """
+        if self._is_socks_proxy():
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.translate, content)
+        return await self._translate_async(
+            self.get_body_async, self.get_result_async, content)
+
+    def translate_batch(self, contents: list[str]) -> list[str]:
+        """Translate the texts within one request. The translations are
+        returned in the same order as the texts.
+        """
+        translations = self._translate(
+            self.get_batch_body, self.get_batch_result, contents)
+        return self._check_batch_result(contents, translations)
+
+    async def translate_batch_async(self, contents: list[str]) -> list[str]:
+        if self._is_socks_proxy():
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.translate_batch, contents)
+        translations = await self._translate_async(
+            self.get_batch_body_async, self.get_batch_result_async, contents)
+        return self._check_batch_result(contents, translations)
 
     def get_endpoint(self):
         return self.endpoint
@@ -238,6 +351,33 @@ class Base:
     def get_result(self, response):
         return response
 
+    async def get_body_async(self, text):
+        """Override it if building the body needs to await, e.g. fetching a
+        credential asynchronously. The body is built in an executor thread by
+        default, so that a blocking builder does not stall the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.get_body, text)
+
+    async def get_result_async(self, response):
+        return self.get_result(response)
+
+    def get_batch_body(self, texts: list[str]):
+        """Build the body for multiple texts, which must be implemented if
+        the batch size is greater than 1.
+        """
+        raise NotImplementedError()
+
+    def get_batch_result(self, response) -> list[str]:
+        raise NotImplementedError()
+
+    async def get_batch_body_async(self, texts):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.get_batch_body, texts)
+
+    async def get_batch_result_async(self, response):
+        return self.get_batch_result(response)
+
     def get_usage(self):
         return None
 
@@ -1,6 +1,7 @@
 import json
 import time
 import random
+from urllib.parse import urlencode
 
 from ..lib.utils import request
 
@@ -20,6 +21,8 @@ class DeeplTranslate(Base):
     # api_key_hint = 'xxx-xxx-xxx:fx'
     placeholder = ('<m id={} />', r'<m\s+id={}\s+/>')
     api_key_errors = ['403', '456']
+    # See: https://developers.deepl.com/docs/api-reference/translate
+    batch_size = 50
 
     def get_usage(self):
         # See: https://www.deepl.com/docs-api/general/get-usage/
@@ -52,6 +55,14 @@ class DeeplTranslate(Base):
     def get_result(self, response):
         return json.loads(response)['translations'][0]['text']
 
+    def get_batch_body(self, texts):
+        body = self.get_body(texts)
+        # Send each of the texts as a separate "text" parameter.
+        return urlencode(body, doseq=True)
+
+    def get_batch_result(self, response):
+        return [i['text'] for i in json.loads(response)['translations']]
+
 
 class DeeplProTranslate(DeeplTranslate):
     name = 'DeepL(Pro)'
@@ -71,6 +82,8 @@ class DeeplFreeTranslate(Base):
 
     concurrency_limit = 1
     request_interval = 1.0
+    batch_size = 20
+    batch_characters = 3000
 
     def _vars(self, text):
         # t.forEach((e => r += (e.match(/[i]/g) || []).length)),
@@ -99,6 +112,12 @@ class DeeplFreeTranslate(Base):
         }
 
     def get_body(self, text):
+        return self.get_batch_body([text])
+
+    def get_result(self, response):
+        return self.get_batch_result(response)[0]
+
+    def get_batch_body(self, texts):
         regional_variant = {}
         target_lang = self._get_target_code()
         if '-' in target_lang:
@@ -106,14 +125,14 @@ class DeeplFreeTranslate(Base):
             variant = '-'.join([portions[0].lower(), portions[1]])
             regional_variant['regionalVariant'] = variant
             target_lang = portions[0]
-        uid, ts = self._vars(text)
+        uid, ts = self._vars(''.join(texts))
 
         body = json.dumps({
             'jsonrpc': '2.0',
             'method': 'LMT_handle_texts',
             'params': {
                 'commonJobParams': regional_variant,
-                'texts': [{'text': text}],
+                'texts': [{'text': text} for text in texts],
                 'splitting': 'newlines',
                 'lang': {
                     'source_lang_user_selected': self._get_source_code(),
@@ -131,5 +150,5 @@ class DeeplFreeTranslate(Base):
             return body.replace('"method":"', '"method" : "')
         return body.replace('"method":"', '"method": "')
 
-    def get_result(self, response):
-        return json.loads(response)['result']['texts'][0]['text']
+    def get_batch_result(self, response):
+        return [i['text'] for i in json.loads(response)['result']['texts']]
@@ -15,6 +15,12 @@ class GenAI(Base, ABC):
     top_p: float
     top_k: int
 
+    def estimate_tokens(self, text) -> int:
+        """Roughly estimate the tokens of the prompt, the content and the
+        translation, at about four characters per token.
+        """
+        return (len(self.prompt) + len(text) * 2) // 4 + 1
+
     @abstractmethod
     def get_models(self) -> list[str]:
         """Automatically get the models for the engine."""
@@ -288,6 +288,8 @@ class GoogleAdvancedTranslate(GoogleTranslate):
     endpoint = 'https://translation.googleapis.com/v3/projects/{}'
     api_key_hint = 'PROJECT_ID'
     need_api_key = False
+    # See: https://cloud.google.com/translate/quotas
+    batch_size = 100
 
     def get_endpoint(self):
         if self.endpoint is not None:
@@ -302,18 +304,24 @@ class GoogleAdvancedTranslate(GoogleTranslate):
         }
 
     def get_body(self, text):
+        return self.get_batch_body([text])
+
+    def get_result(self, response):
+        return ''.join(self.get_batch_result(response))
+
+    def get_batch_body(self, texts):
         body = {
             'targetLanguageCode': self._get_target_code(),
-            'contents': [text],
+            'contents': texts,
             'mimeType': 'text/plain',
         }
         if not self._is_auto_lang():
             body.update(sourceLanguageCode=self._get_source_code())
         return json.dumps(body)
 
-    def get_result(self, response):
+    def get_batch_result(self, response):
         translations = json.loads(response)['translations']
-        return ''.join(i['translatedText'] for i in translations)
+        return [i['translatedText'] for i in translations]
 
 
 class GeminiTranslate(GenAI):
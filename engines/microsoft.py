@@ -23,6 +23,7 @@ class MicrosoftEdgeTranslate(Base):
     endpoint = 'https://edge.microsoft.com/translate/translatetext'
     need_api_key = False
     access_info = None
+    batch_size = 100
 
     def get_endpoint(self):
         query = {
@@ -39,10 +40,17 @@ class MicrosoftEdgeTranslate(Base):
         }
 
     def get_body(self, text):
-        return json.dumps([text])
+        return self.get_batch_body([text])
 
     def get_result(self, response):
-        return json.loads(response)[0]['translations'][0]['text']
+        return self.get_batch_result(response)[0]
+
+    def get_batch_body(self, texts):
+        return json.dumps(texts)
+
+    def get_batch_result(self, response):
+        return [item['translations'][0]['text']
+                for item in json.loads(response)]
 
 
 class AzureChatgptTranslate(ChatgptTranslate):
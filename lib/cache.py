@@ -1,17 +1,27 @@
 import os
 import re
 import json
+import zlib
 import shutil
 import sqlite3
 import sys
+import time
+import hashlib
+import functools
 import os.path
 import tempfile
+import threading
 from datetime import datetime
 from glob import glob
+from pathlib import Path
+from contextlib import contextmanager
 
 from calibre.utils.localization import _  # type: ignore
 
-from .utils import size_by_unit
+if sys.platform != 'win32':
+    import fcntl
+
+from .utils import log, size_by_unit, uid, fingerprint
 from .config import get_config
 
 
@@ -19,15 +29,22 @@ load_translations()  # type: ignore
 
 
 class Paragraph:
+    # A book may have hundreds of thousands of paragraphs, which do not need
+    # the dict for each of the instances.
+    __slots__ = (
+        'id', 'md5', '_raw', 'original', 'ignored', '_attributes', 'page',
+        'translation', 'engine_name', 'target_lang', 'row', 'is_cache',
+        'error', 'aligned', 'retry')
+
     def __init__(
             self, id, md5, raw, original, ignored=False, attributes=None,
             page=None, translation=None, engine_name=None, target_lang=None):
         self.id = id
         self.md5 = md5
-        self.raw = raw
+        self._raw = raw
         self.original = original
         self.ignored = ignored
-        self.attributes = attributes
+        self._attributes = attributes
         self.page = page
         self.translation = translation
         self.engine_name = engine_name
@@ -37,6 +54,30 @@ class Paragraph:
         self.is_cache = False
         self.error = None
         self.aligned = True
+        self.retry = 0
+
+    @property
+    def raw(self):
+        """The markup is kept compressed as it is stored in the cache until
+        it is needed, which is never during the conversion.
+        """
+        if isinstance(self._raw, bytes):
+            self._raw = decompress(self._raw)
+        return self._raw
+
+    @raw.setter
+    def raw(self, raw):
+        self._raw = raw
+
+    @property
+    def attributes(self):
+        if isinstance(self._attributes, bytes):
+            self._attributes = decompress(self._attributes)
+        return self._attributes
+
+    @attributes.setter
+    def attributes(self, attributes):
+        self._attributes = attributes
 
     def get_attributes(self) -> dict:
         if self.attributes:
@@ -68,6 +109,133 @@ class Paragraph:
         self.translation = single_saparator.join(processed_lines)
 
 
+def compress(text, size=128):
+    """Compress the text stored as a BLOB, which is distinguished from the
+    text kept as it is, if it is long enough to benefit from it.
+    """
+    if text is None or len(text) < size:
+        return text
+    data = zlib.compress(text.encode('utf-8'))
+    return data if len(data) < len(text) else text
+
+
+def decompress(value):
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode('utf-8')
+    return value
+
+
+@contextmanager
+def lock_file(path, timeout=30.0, stale=600.0):
+    """Hold an advisory lock shared by the processes, which is a file
+    created exclusively next to the path. The lock left by a crashed
+    process is taken over after it is stale.
+    """
+    lock_path = path + '.lock'
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            descriptor = os.open(
+                lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > stale:
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(
+                    'Timed out waiting for the lock: %s' % lock_path)
+            time.sleep(0.05)
+    try:
+        os.write(descriptor, str(os.getpid()).encode('utf-8'))
+        yield
+    finally:
+        os.close(descriptor)
+        os.remove(lock_path)
+
+
+def use_file(path):
+    """Mark the path in use as long as the returned file is open. Each of the
+    users holds a shared lock of the marker next to the path, which can not
+    be removed on Windows while it is open either.
+    """
+    marker = open(path + '.use', 'a')
+    if sys.platform != 'win32':
+        fcntl.flock(marker.fileno(), fcntl.LOCK_SH)
+    return marker
+
+
+def in_use(path):
+    """Check whether the path is marked in use by any process, and remove the
+    marker if not, e.g. left by a crashed process. It is called with the lock
+    of the path held, so that the path is not marked meanwhile.
+    """
+    marker_path = path + '.use'
+    try:
+        if sys.platform == 'win32':
+            os.remove(marker_path)
+            return False
+        with open(marker_path, 'r') as marker:
+            try:
+                fcntl.flock(marker.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            os.remove(marker_path)
+    except FileNotFoundError:
+        pass
+    except PermissionError:
+        return True
+    return False
+
+
+def summarize(cursor):
+    """Read the entry of the catalog from the cache."""
+    paragraphs, translated = cursor.execute(
+        'SELECT COUNT(*), COUNT(translation) FROM cache '
+        'WHERE NOT ignored').fetchone()
+    info = dict(cursor.execute(
+        "SELECT key, value FROM info WHERE key IN "
+        "('title', 'engine_name', 'target_lang', 'merge_length')"))
+    return dict(
+        title=info.get('title'), engine_name=info.get('engine_name'),
+        target_lang=info.get('target_lang'),
+        merge_length=int(info.get('merge_length') or 0),
+        paragraphs=paragraphs, translated=translated)
+
+
+def summarize_file(file_path):
+    """Read the entry of the catalog from the cache file through a read-only
+    connection, or return None if it is not a valid cache.
+    """
+    try:
+        size = os.path.getsize(file_path)
+        if os.path.exists(file_path + '-wal'):
+            size += os.path.getsize(file_path + '-wal')
+        connection = sqlite3.connect(
+            '%s?mode=ro' % Path(os.path.abspath(file_path)).as_uri(),
+            uri=True, timeout=30)
+        try:
+            return dict(summarize(connection.cursor()), size=size)
+        finally:
+            connection.close()
+    except (OSError, sqlite3.Error):
+        return None
+
+
+def synchronized(method):
+    """Serialize the access to the connection shared by the threads, e.g.
+    the thread processing the translations and the GUI thread.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 def default_cache_path():
     if sys.platform == 'win32':
         # Use LOCALAPPDATA for Windows to avoid temp directory changes
@@ -108,44 +276,110 @@ def custom_cache_path():
 
 
 class TranslationCache:
-    fresh = True
     dir_path = custom_cache_path()
     cache_path = os.path.join(dir_path, 'cache')
     temp_path = os.path.join(dir_path, 'temp')
+    # The version of the cache table stored in the user_version of the file,
+    # which is 0 for the legacy layout without types.
+    schema_version = 2
+    # Seconds to wait for the other processes writing to the same cache.
+    busy_timeout = 30.0
 
-    def __init__(self, identity, persistence=True):
+    def __init__(self, identity, persistence=True, marked=False):
         """:persistence: We use two types of cache, one is used temporarily for
         communication, and another one is used to cache translations, which
         avoids the need for retranslation.
+        :marked: Mark the cache in use until it is closed, e.g. by a job, so
+        that it is not removed by the other processes meanwhile.
         """
         self.identity = identity
         self.persistence = persistence
         self.file_path = self._path(identity)
-        # An interruption may occur, resulting in the cache size being less
-        # than 50,000 bytes. Therefore, we need to resave it again.
-        if os.path.exists(self.file_path) and self.size() > 50000:
-            self.fresh = False
         self.cache_only = False
+        self.marker = None
+        if marked:
+            with lock_file(self.file_path):
+                self.marker = use_file(self.file_path)
+        self.lock = threading.RLock()
+        # Take the write lock of the file at the start of the transactions,
+        # which waits for the other writers instead of failing on upgrading
+        # a read transaction to write.
         self.connection = sqlite3.connect(
-            self.file_path, check_same_thread=False)
+            self.file_path, timeout=self.busy_timeout,
+            isolation_level='IMMEDIATE', check_same_thread=False)
+        # Used by the triggers to index the compressed raw.
+        self.connection.create_function(
+            'decompress', 1, decompress, deterministic=True)
         self.cursor = self.connection.cursor()
-        self.cursor.execute(
-            'CREATE TABLE IF NOT EXISTS cache('
-            'id UNIQUE, md5 UNIQUE, raw, original, ignored, '
-            'attributes DEFAULT NULL, page DEFAULT NULL,'
-            'translation DEFAULT NULL, engine_name DEFAULT NULL, '
-            'target_lang DEFAULT NULL)')
+        self.set_journal_mode(self.cursor)
+        if not self.cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND "
+                "name='cache'").fetchone():
+            self._create_table()
         self.cursor.execute(
             'CREATE TABLE IF NOT EXISTS info(key UNIQUE, value)')
+        self.connection.commit()
+        # The paragraphs are saved within one transaction, so the cache is
+        # either empty or complete.
+        self.fresh = self.cursor.execute(
+            'SELECT 1 FROM cache LIMIT 1').fetchone() is None
+
+    def _create_table(self):
+        # The id is the alias of the rowid, which needs no extra index. The
+        # raw and attributes are compressed if they are long enough.
+        self.cursor.execute(
+            'CREATE TABLE cache('
+            'id INTEGER PRIMARY KEY, md5 TEXT UNIQUE, raw BLOB, '
+            'original TEXT, ignored INTEGER, attributes BLOB DEFAULT NULL, '
+            'page TEXT DEFAULT NULL, translation TEXT DEFAULT NULL, '
+            'engine_name TEXT DEFAULT NULL, target_lang TEXT DEFAULT NULL)')
+        self.cursor.execute('PRAGMA user_version=%d' % self.schema_version)
+
+    @classmethod
+    def set_journal_mode(cls, cursor):
+        """With the write-ahead log, a commit only appends to the log and the
+        sync is deferred to checkpoints, and readers are not blocked. But it
+        relies on the shared memory of the processes on the same host, which
+        network shares and synced folders do not provide, so the rollback
+        journal is kept for a custom cache path, or if the switch fails.
+        """
+        if os.path.realpath(cls.dir_path) != \
+                os.path.realpath(default_cache_path()):
+            cursor.execute('PRAGMA journal_mode=DELETE')
+            return False
+        mode = cursor.execute('PRAGMA journal_mode=WAL').fetchone()
+        if mode is None or mode[0].lower() != 'wal':
+            return False
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        return True
+
+    @classmethod
+    def names_in_use(cls):
+        """Return the names of the caches in use by the jobs."""
+        names = []
+        for file_path in glob(os.path.join(cls.cache_path, '*.db')):
+            with lock_file(file_path):
+                if in_use(file_path):
+                    names.append(os.path.basename(file_path))
+        return names
 
     @classmethod
     def move(cls, dest):
-        for dir_path in glob(os.path.join(cls.dir_path, '*')):
-            if os.path.exists(dir_path):
-                shutil.move(dir_path, dest)
+        """Move all of the caches to the destination, unless any of them is
+        in use. Return True if they are moved.
+        """
+        if len(cls.names_in_use()) > 0:
+            return False
+        lock_path = os.path.join(cls.dir_path, 'move')
+        with lock_file(lock_path):
+            for dir_path in glob(os.path.join(cls.dir_path, '*')):
+                if dir_path != lock_path + '.lock' and \
+                        os.path.exists(dir_path):
+                    shutil.move(dir_path, dest)
         cls.dir_path = dest
         cls.cache_path = os.path.join(dest, 'cache')
         cls.temp_path = os.path.join(dest, 'temp')
+        return True
 
     @classmethod
     def count(cls):
@@ -154,34 +388,205 @@ class TranslationCache:
             total += os.path.getsize(file_path)
         return size_by_unit(total, 'MB')
 
+    @staticmethod
+    def _remove_path(file_path):
+        """Remove the cache file unless it is in use, and return True if it
+        is removed.
+        """
+        with lock_file(file_path):
+            if in_use(file_path):
+                return False
+            # Remove the write-ahead log files first, so an interruption does
+            # not leave them behind without the cache.
+            for path in (file_path + '-wal', file_path + '-shm', file_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        return True
+
+    @classmethod
+    def _remove_file(cls, filename):
+        return cls._remove_path(os.path.join(cls.cache_path, filename))
+
     @classmethod
     def remove(cls, filename):
-        file_path = os.path.join(cls.cache_path, filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        """Remove the cache unless it is in use by a job, and return True if
+        it is removed.
+        """
+        if not cls._remove_file(filename):
+            return False
+        catalog = cls.get_catalog()
+        catalog.delete(filename)
+        catalog.close()
+        return True
 
     @classmethod
     def clean(cls):
+        """Remove all of the caches except the ones in use by the jobs, and
+        return the names of those.
+        """
+        skipped = []
+        catalog = cls.get_catalog()
         for filename in os.listdir(cls.cache_path):
-            cls.remove(filename)
+            if filename.endswith('.db'):
+                if cls._remove_file(filename):
+                    catalog.delete(filename)
+                else:
+                    skipped.append(filename)
+        catalog.close()
+        return skipped
+
+    @classmethod
+    def get_catalog(cls):
+        return CacheCatalog(os.path.join(cls.dir_path, 'catalog.db'))
+
+    @classmethod
+    def sync_catalog(cls, catalog):
+        """Rebuild the entries of the catalog from the cache files on the
+        disk, which are missing or have been removed outside of the plugin.
+        """
+        if not os.path.exists(cls.cache_path):
+            return
+        filenames = set(os.listdir(cls.cache_path))
+        names = set(catalog.names())
+        for name in names.difference(filenames):
+            catalog.delete(name)
+        for name in filenames.difference(names):
+            file_path = os.path.join(cls.cache_path, name)
+            if name.endswith('.db'):
+                # Read the cache as is, without switching its journal mode or
+                # migrating it, which is left to the job using it.
+                summary = summarize_file(file_path) or {}
+                # The best guess of when the cache was used.
+                catalog.update(
+                    name, last_used=os.path.getmtime(file_path), **summary)
+            elif name.endswith(('.db-wal', '.db-shm')) and \
+                    name.rsplit('-', 1)[0] not in filenames:
+                # Left by the removal of the cache being interrupted.
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    pass
+
+    @classmethod
+    def adopt(cls, source, identity):
+        """Rename the cache of the same source, i.e. the ebook at the same
+        path, to the new identity if there is not a cache of it yet. That is
+        the cache keyed by the path in the previous versions, or the cache
+        of the ebook before it was edited. The adopted cache is outdated
+        until it is synced with the new extraction.
+        """
+        file_path = os.path.join(cls.cache_path, '%s.db' % identity)
+        name = os.path.basename(file_path)
+        catalog = cls.get_catalog()
+        adopted = None
+        if not os.path.exists(file_path):
+            for source_name in ['%s.db' % source] + catalog.find(source):
+                if os.path.exists(os.path.join(cls.cache_path, source_name)):
+                    adopted = source_name
+                    break
+        if adopted is not None:
+            source_path = os.path.join(cls.cache_path, adopted)
+            with lock_file(source_path):
+                # The cache in use by another job is left as it is.
+                if in_use(source_path):
+                    adopted = None
+                else:
+                    for suffix in ('', '-wal', '-shm'):
+                        if os.path.exists(source_path + suffix):
+                            os.rename(
+                                source_path + suffix, file_path + suffix)
+        if adopted is not None:
+            catalog.rename(adopted, name)
+        catalog.update(name, source=source)
+        catalog.close()
+        if adopted is None:
+            return False
+        cache = cls(identity)
+        cache.set_info('outdated', True)
+        cache.close()
+        return True
+
+    @classmethod
+    def pin(cls, filename, pinned=True):
+        catalog = cls.get_catalog()
+        catalog.update(filename, pinned=pinned)
+        catalog.close()
+
+    @classmethod
+    def evict(cls, size_limit, keep=()):
+        """Remove the least recently used caches until their total size in
+        bytes is within the limit. The pinned caches and the ones in keep
+        are never removed.
+        """
+        catalog = cls.get_catalog()
+        cls.sync_catalog(catalog)
+        total = catalog.total_size()
+        evicted = []
+        for name, size, last_used in catalog.least_recently_used():
+            if total <= size_limit:
+                break
+            if name in keep:
+                continue
+            try:
+                if not cls._remove_file(name):
+                    continue
+            except OSError:
+                # The cache may be opened by the Cache Manager on Windows.
+                continue
+            catalog.delete(name)
+            total -= size or 0
+            evicted.append(name)
+            log.info(
+                'Evicted the cache %s (%sMB) last used at %s.' % (
+                    name, size_by_unit(size or 0, 'MB'),
+                    datetime.fromtimestamp(last_used or 0)
+                    .strftime('%Y-%m-%d %H:%M:%S')))
+        catalog.close()
+        return evicted
 
     @classmethod
     def get_list(cls):
+        """Read the list of caches from the catalog without opening any of
+        the cache files.
+        """
+        catalog = cls.get_catalog()
+        cls.sync_catalog(catalog)
         names = []
-        for file_path in glob(os.path.join(cls.cache_path, '*.db')):
-            name = os.path.basename(file_path)
-            cache = cls(os.path.splitext(name)[0])
-            title = cache.get_info('title') or '[%s]' % _('Unknown')
-            engine = cache.get_info('engine_name')
-            lang = cache.get_info('target_lang')
-            merge = int(cache.get_info('merge_length') or 0)
-            size = size_by_unit(os.path.getsize(file_path), 'MB')
-            time = datetime.fromtimestamp(os.path.getmtime(file_path)) \
+        for name, title, engine, lang, merge, size, paragraphs, translated, \
+                last_used, pinned, source in catalog.all():
+            title = title or '[%s]' % _('Unknown')
+            ratio = round(translated / paragraphs * 100, 2) \
+                if paragraphs else 0.0
+            time = datetime.fromtimestamp(last_used or 0) \
                 .strftime('%Y-%m-%d %H:%M:%S')
-            names.append((title, engine, lang, merge, size, time, name))
-            cache.close()
+            pinned = _('Yes') if pinned else ''
+            names.append((
+                title, engine, lang, merge, size_by_unit(size or 0, 'MB'),
+                ratio, time, pinned, name))
+        catalog.close()
         return names
 
+    @classmethod
+    def migrate_all(cls):
+        """Migrate all of the caches in the legacy layout, and return the
+        number of them with the total size before and after the migration.
+        """
+        count = before = after = 0
+        busy = cls.names_in_use()
+        for file_path in glob(os.path.join(cls.cache_path, '*.db')):
+            # Leave the caches in use by the jobs to be migrated by them.
+            if os.path.basename(file_path) in busy:
+                continue
+            name = os.path.splitext(os.path.basename(file_path))[0]
+            cache = cls(name)
+            size = cache.size()
+            if cache.migrate(vacuum=True):
+                count += 1
+                before += size
+                after += cache.size()
+            cache.close()
+        return count, size_by_unit(before, 'MB'), size_by_unit(after, 'MB')
+
     def _path(self, name):
         if not os.path.exists(self.dir_path):
             os.mkdir(self.dir_path)
@@ -193,11 +598,86 @@ class TranslationCache:
         return os.path.join(cache_dir, '%s.db' % name)
 
     def size(self):
-        return os.path.getsize(self.file_path)
+        size = os.path.getsize(self.file_path)
+        if os.path.exists(self.file_path + '-wal'):
+            size += os.path.getsize(self.file_path + '-wal')
+        return size
+
+    def get_version(self):
+        return self.cursor.execute('PRAGMA user_version').fetchone()[0]
+
+    def _has_table(self, name):
+        return self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+            (name,)).fetchone() is not None
+
+    def _need_migration(self):
+        # The legacy table is left by an interrupted migration of the
+        # previous versions, whose rows have not been copied yet.
+        return self.get_version() < self.schema_version or \
+            self._has_table('cache_legacy')
+
+    @synchronized
+    def migrate(self, vacuum=False):
+        """Convert the cache table of the legacy layout to the current
+        schema within one transaction, so that an interrupted migration
+        leaves the cache as it was. Reclaim the space of the file afterwards
+        if vacuum is True, which rewrites the whole file.
+        """
+        if not self._need_migration():
+            return False
+        self.connection.commit()
+        # The sqlite3 module does not begin a transaction before the DDL
+        # statements, so the transaction is controlled explicitly.
+        isolation_level = self.connection.isolation_level
+        self.connection.isolation_level = None
+        try:
+            self.cursor.execute('BEGIN IMMEDIATE')
+            # Another job may have migrated the cache in the meantime.
+            if not self._need_migration():
+                self.cursor.execute('COMMIT')
+                return False
+            if self.get_version() < self.schema_version:
+                self.cursor.execute('ALTER TABLE cache RENAME TO cache_legacy')
+                self._create_table()
+            self.cursor.executemany(
+                'INSERT INTO cache VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8, '
+                '?9, ?10) ON CONFLICT DO NOTHING', (
+                    self._encode(row) for row in self.connection.execute(
+                        'SELECT * FROM cache_legacy')))
+            self.cursor.execute('DROP TABLE cache_legacy')
+            self.cursor.execute('COMMIT')
+        except BaseException:
+            if self.connection.in_transaction:
+                self.cursor.execute('ROLLBACK')
+            raise
+        finally:
+            self.connection.isolation_level = isolation_level
+        self.fresh = self.cursor.execute(
+            'SELECT 1 FROM cache LIMIT 1').fetchone() is None
+        if vacuum:
+            self.cursor.execute('VACUUM')
+            self.cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return True
+
+    def _encode(self, row):
+        row = list(row)
+        row[2], row[5] = compress(row[2]), compress(row[5])
+        return row
+
+    def _decode(self, row):
+        if row is None:
+            return None
+        row = list(row)
+        row[2], row[5] = decompress(row[2]), decompress(row[5])
+        return row
 
     def is_fresh(self):
         return self.fresh
 
+    def is_outdated(self):
+        return self.get_info('outdated') is not None
+
     def get_identity(self):
         return self.identity
 
@@ -207,6 +687,11 @@ class TranslationCache:
     def set_cache_only(self, cache_only):
         self.cache_only = cache_only
 
+    @synchronized
+    def commit(self):
+        self.connection.commit()
+
+    @synchronized
     def set_info(self, key, value):
         self.cursor.execute(
             'INSERT INTO info VALUES (?1, ?2) '
@@ -214,33 +699,83 @@ class TranslationCache:
             (key, value))
         self.connection.commit()
 
+    @synchronized
     def get_info(self, key):
         resource = self.cursor.execute(
             'SELECT value FROM info WHERE key=?', (key,))
         result = resource.fetchone()
         return result[0] if result else None
 
+    @synchronized
     def del_info(self, key):
         self.cursor.execute(
             'DELETE FROM info WHERE key=?', (key,))
         self.connection.commit()
 
+    @synchronized
     def save(self, original_group):
         if self.is_fresh():
             for original_unit in original_group:
                 self.add(*original_unit)
             self.connection.commit()
+        elif self.is_outdated():
+            self.sync(original_group)
+            self.del_info('outdated')
+
+    @synchronized
+    def sync(self, original_group):
+        """Replace the cached paragraphs with the new extraction, and carry
+        the translations over to the paragraphs with the same original text
+        wherever they have been moved, so only the new or changed paragraphs
+        need to be translated. Return the number of them.
+        """
+        rows = self.cursor.execute(
+            'SELECT md5, original, ignored, translation, engine_name, '
+            'target_lang FROM cache ORDER BY id').fetchall()
+        if [row[0] for row in rows] == [unit[1] for unit in original_group]:
+            return 0
+        previous = {}
+        for md5, original, *values in rows:
+            if values[0] or values[1]:
+                previous.setdefault(original, values)
+        count, items = 0, []
+        for unit in original_group:
+            id, md5, raw, original, ignored, attributes, page = \
+                tuple(unit) + (False, None, None)[len(unit) - 4:]
+            translation = engine_name = target_lang = None
+            if original in previous:
+                was_ignored, translation, engine_name, target_lang = \
+                    previous[original]
+                ignored = ignored or was_ignored
+            elif not ignored:
+                count += 1
+            items.append((
+                id, md5, compress(raw), original, ignored,
+                compress(attributes), page, translation, engine_name,
+                target_lang))
+        self.cursor.execute('DELETE FROM cache')
+        self.cursor.executemany(
+            'INSERT INTO cache VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9, '
+            '?10) ON CONFLICT DO NOTHING', items)
+        self.commit()
+        log.info(
+            'Synced the cache with the ebook: %s of %s paragraphs to '
+            'translate.' % (count, len(items)))
+        return count
 
+    @synchronized
     def all(self):
         resource = self.cursor.execute('SELECT * FROM cache WHERE NOT ignored')
-        return resource.fetchall()
+        return [self._decode(row) for row in resource.fetchall()]
 
+    @synchronized
     def get(self, ids):
         placeholders = ', '.join(['?'] * len(ids))
         resource = self.cursor.execute(
             'SELECT * FROM cache WHERE id IN (%s) ' % placeholders, tuple(ids))
-        return resource.fetchall()
+        return [self._decode(row) for row in resource.fetchall()]
 
+    @synchronized
     def first(self, **kwargs):
         if kwargs:
             data = ' AND '.join(['%s=?' % column for column in kwargs])
@@ -248,17 +783,20 @@ class TranslationCache:
                 'SELECT * FROM cache WHERE %s' % data, tuple(kwargs.values()))
         else:
             resource = self.cursor.execute('SELECT * FROM cache LIMIT 1')
-        return resource.fetchone()
+        return self._decode(resource.fetchone())
 
+    @synchronized
     def add(self, id, md5, raw, original, ignored=False, attributes=None,
             page=None):
         self.cursor.execute(
             'INSERT INTO cache VALUES ('
             '?1, ?2, ?3, ?4, ?5, ?6, ?7, NULL, NULL, NULL'
             ') ON CONFLICT DO NOTHING',
-            (id, md5, raw, original, ignored, attributes, page))
+            (id, md5, compress(raw), original, ignored, compress(attributes),
+             page))
         # self.connection.commit()
 
+    @synchronized
     def update(self, ids, **kwargs):
         ids = ids if isinstance(ids, list) else [ids]
         data = ', '.join(['%s=?' % column for column in kwargs.keys()])
@@ -271,25 +809,53 @@ class TranslationCache:
     def ignore(self, ids):
         self.update(ids, ignored=True)
 
+    @synchronized
     def delete(self, ids):
         placeholders = ', '.join(['?'] * len(ids))
         self.cursor.execute(
             'DELETE FROM cache WHERE id IN (%s)' % placeholders, tuple(ids))
         self.connection.commit()
 
+    def touch(self):
+        """Record the time the cache is used, by which the least recently
+        used caches are evicted first.
+        """
+        catalog = self.get_catalog()
+        catalog.update(
+            os.path.basename(self.file_path), last_used=time.time())
+        catalog.close()
+
+    @synchronized
+    def update_catalog(self):
+        catalog = self.get_catalog()
+        catalog.update(
+            os.path.basename(self.file_path), **summarize(self.cursor),
+            size=self.size())
+        catalog.close()
+
+    @synchronized
     def close(self):
-        self.cursor.close()
         self.connection.commit()
+        if self.persistence:
+            self.update_catalog()
+        self.cursor.close()
         self.connection.close()
+        if self.marker is not None:
+            self.marker.close()
+            self.marker = None
+            # Remove the marker unless the cache is used by another job.
+            with lock_file(self.file_path):
+                in_use(self.file_path)
 
     def destroy(self):
         self.close()
-        if os.path.exists(self.file_path):
-            os.remove(self.file_path)
+        self._remove_path(self.file_path)
 
     def done(self):
         if not self.persistence:
             self.destroy()
+            return
+        self.close()
 
     def paragraph(self, id=None):
         return Paragraph(*self.first(id=id))
@@ -297,14 +863,30 @@ class TranslationCache:
     def get_paragraphs(self, ids):
         return [Paragraph(*item) for item in self.get(ids)]
 
+    def iter_paragraphs(self, size=1000):
+        """Yield the paragraphs read from the cache in pages, whose raw and
+        attributes are decompressed only when they are used.
+        """
+        sql = 'SELECT * FROM cache WHERE NOT ignored'
+        if self.cache_only:
+            sql += " AND translation IS NOT NULL AND translation != ''"
+        # Use a separate cursor not to be reset by the writes meanwhile.
+        cursor = self.connection.cursor()
+        try:
+            with self.lock:
+                cursor.execute(sql)
+            while True:
+                with self.lock:
+                    rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield Paragraph(*row)
+        finally:
+            cursor.close()
+
     def all_paragraphs(self):
-        paragraphs = []
-        for item in self.all():
-            paragraph = Paragraph(*item)
-            if self.cache_only and not paragraph.translation:
-                continue
-            paragraphs.append(paragraph)
-        return paragraphs
+        return list(self.iter_paragraphs())
 
     def update_paragraph(self, paragraph):
         self.update(
@@ -312,6 +894,119 @@ class TranslationCache:
             engine_name=paragraph.engine_name,
             target_lang=paragraph.target_lang)
 
+    @synchronized
+    def update_paragraphs(self, paragraphs):
+        """Save the translations of the paragraphs within one transaction,
+        which is committed right away not to hold the write lock of the file
+        until the next group of translations arrives.
+        """
+        self.cursor.executemany(
+            'UPDATE cache SET translation=?, engine_name=?, target_lang=? '
+            'WHERE id=?', [
+                (paragraph.translation, paragraph.engine_name,
+                 paragraph.target_lang, paragraph.id)
+                for paragraph in paragraphs])
+        self.connection.commit()
+
+    @synchronized
+    def has_index(self):
+        return self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND "
+            "name='search'").fetchone() is not None
+
+    @synchronized
+    def create_index(self):
+        """Build the full-text index of the paragraphs, which is kept in sync
+        with the cache table by the triggers afterwards. The index stores no
+        content but the trigrams, which match any substring of at least
+        three characters regardless of case. Return False if the FTS5 or its
+        trigram tokenizer is not supported by the SQLite.
+        """
+        if self.has_index():
+            return True
+        self.commit()
+        self.cursor.execute('BEGIN IMMEDIATE')
+        try:
+            self.cursor.execute(
+                'CREATE VIRTUAL TABLE search USING fts5('
+                "original, translation, raw, content='', tokenize='trigram')")
+        except sqlite3.OperationalError:
+            self.connection.rollback()
+            return False
+        # The contentless index needs the old values to remove the entries.
+        insert = (
+            'INSERT INTO search(rowid, original, translation, raw) VALUES ('
+            'new.id, new.original, new.translation, decompress(new.raw));')
+        delete = (
+            "INSERT INTO search(search, rowid, original, translation, raw) "
+            "VALUES ('delete', old.id, old.original, old.translation, "
+            "decompress(old.raw));")
+        self.cursor.execute(
+            'CREATE TRIGGER search_insert AFTER INSERT ON cache BEGIN %s END'
+            % insert)
+        self.cursor.execute(
+            'CREATE TRIGGER search_delete AFTER DELETE ON cache BEGIN %s END'
+            % delete)
+        self.cursor.execute(
+            'CREATE TRIGGER search_update AFTER UPDATE OF original, '
+            'translation, raw ON cache BEGIN %s %s END' % (delete, insert))
+        self.cursor.execute(
+            'INSERT INTO search(rowid, original, translation, raw) '
+            'SELECT id, original, translation, decompress(raw) FROM cache')
+        self.connection.commit()
+        return True
+
+    @synchronized
+    def search(self, text, column='original'):
+        """Return the ids of the paragraphs of which the column, i.e. the
+        original, translation or raw, contains the text regardless of case.
+        Return None if the index is not available or the text is too short
+        to be looked up from the trigrams.
+        """
+        if column not in ('original', 'translation', 'raw'):
+            raise ValueError('Unknown column: %s' % column)
+        if len(text) < 3 or not self.create_index():
+            return None
+        query = '%s : "%s"' % (column, text.replace('"', '""'))
+        return set(row[0] for row in self.cursor.execute(
+            'SELECT rowid FROM search WHERE search MATCH ?', (query,)))
+
+    @synchronized
+    def import_translations(self, segments, size=1000):
+        """Save the translations of the segments to the paragraphs with the
+        same md5, or otherwise with the same original text, in batches.
+        Return the number of the paragraphs translated.
+        """
+        ids, originals = {}, {}
+        for id, md5, original in self.cursor.execute(
+                'SELECT id, md5, original FROM cache'):
+            ids[md5] = id
+            originals.setdefault(original, []).append(id)
+        engine_name = self.get_info('engine_name')
+        target_lang = self.get_info('target_lang')
+        count, items = 0, []
+        for segment in segments:
+            if segment.get('md5') in ids:
+                matches = [ids[segment['md5']]]
+            else:
+                matches = originals.get(segment.get('original'), [])
+            for id in matches:
+                items.append((
+                    segment['translation'],
+                    segment.get('engine_name') or engine_name,
+                    segment.get('target_lang') or target_lang, id))
+            if len(items) >= size:
+                count += self._update_translations(items)
+                items = []
+        return count + self._update_translations(items)
+
+    def _update_translations(self, items):
+        self.cursor.executemany(
+            'UPDATE cache SET translation=?, engine_name=?, target_lang=? '
+            'WHERE id=?', items)
+        self.connection.commit()
+        return len(items)
+
     def delete_paragraphs(self, paragraphs):
         self.delete([paragraph.id for paragraph in paragraphs])
 
@@ -319,6 +1014,224 @@ class TranslationCache:
         self.ignore([paragraph.id for paragraph in paragraphs])
 
 
-def get_cache(uid):
+class CacheCatalog:
+    """The summary of the persistent caches, which is updated as they are
+    closed, so listing them does not need to open every cache file.
+    """
+    columns = (
+        'name', 'title', 'engine_name', 'target_lang', 'merge_length',
+        'size', 'paragraphs', 'translated', 'last_used', 'pinned', 'source')
+
+    def __init__(self, file_path):
+        self.connection = sqlite3.connect(file_path, timeout=30)
+        TranslationCache.set_journal_mode(self.connection)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS catalog('
+            'name TEXT PRIMARY KEY, title TEXT, engine_name TEXT, '
+            'target_lang TEXT, merge_length INTEGER, size INTEGER, '
+            'paragraphs INTEGER, translated INTEGER, last_used REAL, '
+            'pinned INTEGER DEFAULT 0, source TEXT)')
+        self.connection.commit()
+
+    def update(self, name, **data):
+        columns = ['name'] + list(data.keys())
+        self.connection.execute(
+            'INSERT INTO catalog (%s) VALUES (%s) ON CONFLICT (name) '
+            'DO UPDATE SET %s' % (
+                ', '.join(columns), ', '.join(['?'] * len(columns)),
+                ', '.join('%s=excluded.%s' % (column, column)
+                          for column in data)),
+            (name, *data.values()))
+        self.connection.commit()
+
+    def names(self):
+        return [row[0] for row in self.connection.execute(
+            'SELECT name FROM catalog')]
+
+    def all(self):
+        return self.connection.execute(
+            'SELECT %s FROM catalog ORDER BY last_used DESC'
+            % ', '.join(self.columns)).fetchall()
+
+    def total_size(self):
+        return self.connection.execute(
+            'SELECT TOTAL(size) FROM catalog').fetchone()[0]
+
+    def least_recently_used(self):
+        return self.connection.execute(
+            'SELECT name, size, last_used FROM catalog WHERE NOT pinned '
+            'ORDER BY last_used').fetchall()
+
+    def find(self, source):
+        return [row[0] for row in self.connection.execute(
+            'SELECT name FROM catalog WHERE source=? ORDER BY last_used DESC',
+            (source,))]
+
+    def rename(self, name, new_name):
+        self.connection.execute(
+            'DELETE FROM catalog WHERE name=?', (new_name,))
+        self.connection.execute(
+            'UPDATE catalog SET name=? WHERE name=?', (new_name, name))
+        self.connection.commit()
+
+    def delete(self, name):
+        self.connection.execute('DELETE FROM catalog WHERE name=?', (name,))
+        self.connection.commit()
+
+    def clear(self):
+        self.connection.execute('DELETE FROM catalog')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+class TranslationMemory:
+    """Translations shared by all of the books, which are looked up by the
+    digest of the normalized original text, the engine and the target
+    language, so the same text does not need to be paid for twice.
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            file_path, timeout=TranslationCache.busy_timeout,
+            check_same_thread=False)
+        self.cursor = self.connection.cursor()
+        # The memory is shared by the jobs running in other processes, whose
+        # lookups are not blocked by the writers with the write-ahead log.
+        TranslationCache.set_journal_mode(self.cursor)
+        # The primary key is the index of the lookup, without a rowid table.
+        self.cursor.execute(
+            'CREATE TABLE IF NOT EXISTS memory('
+            'digest BLOB, engine_name TEXT, target_lang TEXT, translation, '
+            'PRIMARY KEY (digest, engine_name, target_lang)) WITHOUT ROWID')
+        self.connection.commit()
+        self.lookups = 0
+        self.hits = 0
+
+    @staticmethod
+    def normalize(text):
+        """Ignore the differences of the whitespace within lines and around
+        the text, but keep the line breaks used to align merged paragraphs.
+        """
+        text = re.sub(r'[^\S\n]+', ' ', text)
+        return re.sub(r' ?\n ?', '\n', text).strip()
+
+    def digest(self, text):
+        return hashlib.sha1(self.normalize(text).encode('utf-8')).digest()
+
+    def get(self, original, engine_name, target_lang):
+        with self.lock:
+            self.lookups += 1
+            resource = self.cursor.execute(
+                'SELECT translation FROM memory WHERE digest=? AND '
+                'engine_name=? AND target_lang=?',
+                (self.digest(original), engine_name, target_lang))
+            result = resource.fetchone()
+            if result is None:
+                return None
+            self.hits += 1
+            return result[0]
+
+    def add(self, original, engine_name, target_lang, translation):
+        self._add_translations([
+            (self.digest(original), engine_name, target_lang, translation)])
+
+    def add_paragraphs(self, paragraphs):
+        """Add the translations of the paragraphs within one transaction, so
+        the write lock is held only briefly.
+        """
+        return self._add_translations([
+            (self.digest(paragraph.original), paragraph.engine_name,
+             paragraph.target_lang, paragraph.translation)
+            for paragraph in paragraphs if paragraph.translation])
+
+    def import_translations(self, segments, engine_name=None,
+                            target_lang=None, size=50000):
+        """Add the translations of the segments in batches, and return the
+        number of them. The engine name and the target language of the
+        segments take precedence, and the segments still missing either of
+        them are skipped. The digests are random, so large batches sorted by
+        them touch far fewer pages of the index for each commit.
+        """
+        count, items = 0, []
+        for segment in segments:
+            segment_engine = segment.get('engine_name') or engine_name
+            segment_lang = segment.get('target_lang') or target_lang
+            if not segment_engine or not segment_lang:
+                continue
+            items.append((
+                self.digest(segment['original']), segment_engine,
+                segment_lang, segment['translation']))
+            if len(items) >= size:
+                count += self._add_translations(items)
+                items = []
+        return count + self._add_translations(items)
+
+    def _add_translations(self, items):
+        if len(items) < 1:
+            return 0
+        items.sort()
+        with self.lock:
+            self.cursor.executemany(
+                'INSERT INTO memory VALUES (?1, ?2, ?3, ?4) '
+                'ON CONFLICT (digest, engine_name, target_lang) '
+                'DO UPDATE SET translation=excluded.translation', items)
+            self.connection.commit()
+        return len(items)
+
+    def hit_rate(self):
+        if self.lookups < 1:
+            return 0.0
+        return round(self.hits / self.lookups * 100, 2)
+
+    def close(self):
+        self.cursor.close()
+        self.connection.close()
+
+
+def get_cache_id(input_path, engine_name, target_lang, merge_length,
+                 encoding=''):
+    """Identify the cache by the content of the ebook instead of its path,
+    so the cache survives moving the library or importing the ebook again.
+    The cache of the ebook at the same path is adopted if it is edited.
+    """
+    options = engine_name + target_lang + merge_length + encoding
+    identity = uid(fingerprint(input_path) + options)
+    TranslationCache.adopt(uid(input_path + options), identity)
+    return identity
+
+
+def get_cache(identity):
     config = get_config()
-    return TranslationCache(uid, config.get('cache_enabled') or False)
+    cache = TranslationCache(
+        identity, config.get('cache_enabled') or False, marked=True)
+    # Only the jobs count as the use of the cache for the eviction, not the
+    # Cache Manager reading or compacting it.
+    if cache.is_persistence():
+        cache.touch()
+    # Migrate the cache created by the previous versions of the plugin. The
+    # space is reclaimed by compacting the caches from the Cache Manager.
+    cache.migrate()
+    return cache
+
+
+def evict_caches(keep=()):
+    """Evict the caches over the size limit. It is meant to run after the
+    conversion, when the extraction is no longer held up by it, and the
+    failures are only logged.
+    """
+    size_limit = get_config().get('cache_size_limit') or 0
+    if size_limit < 1:
+        return None
+    try:
+        return TranslationCache.evict(size_limit * 1000 ** 2, keep)
+    except (OSError, sqlite3.Error) as e:
+        log.warning('Failed to evict the caches: %s' % e)
+        return None
+
+
+def get_memory():
+    return TranslationMemory(
+        os.path.join(TranslationCache.dir_path, 'memory.db'))
@@ -22,6 +22,8 @@ defaults: dict[str, Any] = {
     'proxy_type': 'http',
     'proxy_setting': {},
     'cache_enabled': True,
+    'memory_enabled': True,
+    'cache_size_limit': 0,
     'cache_path': None,
     'log_translation': True,
     'show_notification': True,
@@ -44,6 +46,7 @@ defaults: dict[str, Any] = {
     'glossary_path': None,
     'merge_enabled': False,
     'merge_length': 1800,
+    'parallel_extraction': False,
     'ebook_metadata': {},
     'search_paths': [],
 }
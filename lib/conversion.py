@@ -18,8 +18,8 @@ from calibre.ebooks.metadata.meta import (  # type: ignore
 from .. import EbookTranslator
 
 from .config import get_config
-from .utils import log, sep, uid, open_path, open_file
-from .cache import get_cache
+from .utils import log, sep, open_path, open_file
+from .cache import get_cache, get_cache_id, evict_caches
 from .element import (
     get_element_handler, get_srt_elements, get_toc_elements, get_page_elements,
     get_metadata_elements, get_pgn_elements)
@@ -66,7 +66,8 @@ def convert_book(
         elements.extend(get_metadata_elements(oeb.metadata))
         # The number of elements may vary with format conversion.
         elements.extend(get_toc_elements(oeb.toc.nodes, []))
-        elements.extend(get_page_elements(oeb.manifest.items))
+        elements.extend(
+            get_page_elements(oeb.manifest.items, element_handler))
         original_group = element_handler.prepare_original(elements)
         cache.save(original_group)
 
@@ -206,12 +207,13 @@ def convert_item(
     _encoding = ''
     if encoding.lower() != 'utf-8':
         _encoding = encoding.lower()
-    cache_id = uid(
-        input_path + translator.name + target_lang + merge_length + _encoding)
+    cache_id = get_cache_id(
+        input_path, translator.name, target_lang, merge_length, _encoding)
     cache = get_cache(cache_id)
     cache.set_cache_only(cache_only)
     cache.set_info('title', ebook_title)
     cache.set_info('engine_name', translator.name)
+    cache.set_info('source_lang', source_lang)
     cache.set_info('target_lang', target_lang)
     cache.set_info('merge_length', merge_length)
     cache.set_info('plugin_version', EbookTranslator.__version__)
@@ -220,7 +222,7 @@ def convert_item(
     translation = get_translation(
         translator, lambda text, error=False: log.info(text))
     translation.set_batch(is_batch)
-    translation.set_callback(cache.update_paragraph)
+    translation.set_bulk_callback(cache.update_paragraphs)
 
     debug_info = '{0}\n| Diagnosis Information\n{0}'.format(sep())
     debug_info += '\n| Calibre Version: %s\n' % __version__
@@ -232,18 +234,29 @@ def convert_item(
     debug_info += '| Cache Enabled: %s\n' % cache.is_persistence()
     debug_info += '| Merging Length: %s\n' % element_handler.merge_length
     debug_info += '| Concurrent requests: %s\n' % translator.concurrency_limit
+    debug_info += '| Adaptive Concurrency: %s\n' \
+        % translator.adaptive_concurrency
+    debug_info += '| Asynchronous Requests: %s\n' % translator.async_transport
     debug_info += '| Request Interval: %s\n' % translator.request_interval
     debug_info += '| Request Attempt: %s\n' % translator.request_attempt
     debug_info += '| Request Timeout: %s\n' % translator.request_timeout
+    debug_info += '| Requests Per Minute: %s\n' \
+        % translator.requests_per_minute
+    debug_info += '| Tokens Per Minute: %s\n' % translator.tokens_per_minute
+    debug_info += '| Batch Size: %s\n' % translator.batch_size
     debug_info += '| Input Path: %s\n' % input_path
     debug_info += '| Output Path: %s' % output_path
 
     handler: dict[str, Callable] | None = extra_formats.get(format)
     convertor = convert_book if handler is None else handler['convertor']
-    convertor(
-        input_path, output_path, translation, element_handler, cache,
-        debug_info, encoding, notification)
-    cache.done()
+    try:
+        convertor(
+            input_path, output_path, translation, element_handler, cache,
+            debug_info, encoding, notification)
+    finally:
+        cache.done()
+        if cache.is_persistence():
+            evict_caches([os.path.basename(cache.file_path)])
 
 
 class ConversionWorker:
@@ -1,7 +1,13 @@
+import os
 import re
+import sys
 import json
 import copy
+import threading
+import multiprocessing
 from typing import Any
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 from lxml import etree  # type: ignore
 
@@ -217,26 +223,103 @@ class PageElement(Element):
         element.tail = None
         parent.remove(element)
 
+    def _is_within(self, element, elements):
+        """Check if any ancestor of the element inside this element is one of
+        the elements.
+        """
+        for ancestor in element.iterancestors():
+            if ancestor is self.element:
+                break
+            if ancestor in elements:
+                return True
+        return False
+
+    def _add_ancestors(self, elements, ancestors):
+        for element in elements:
+            for ancestor in element.iterancestors():
+                if ancestor is self.element or ancestor in ancestors:
+                    break
+                ancestors.add(ancestor)
+        return ancestors
+
+    def _get_reserved_string(self, element, dirty):
+        """Serialize the reserved element without the noises inside, which is
+        the same as get_string() but leaves the element untouched.
+        """
+        # Copy the reserved element only if it contains any noise.
+        if element in dirty:
+            element = copy.deepcopy(element)
+            for noise in element.xpath(self.remove_pattern, namespaces=ns):
+                self._safe_remove(noise)
+            return get_string(element, True)
+        markup = etree.tostring(
+            element, encoding='utf-8', with_tail=False).decode('utf-8')
+        # Prevent auto-closing empty elements as get_string() does.
+        if markup.endswith('/>'):
+            name = re.match(r'<([^\s/>]+)', markup).group(1)
+            markup = '%s></%s>' % (markup[:-2], name)
+        return re.sub(r'\sxmlns="[^"]+"', '', trim(markup))
+
+    def _collect_text(self, parent, dirty, noises, replacements, texts):
+        for child in parent:
+            if child in replacements:
+                texts.append(replacements[child])
+            elif child in noises:
+                pass
+            elif child in dirty:
+                texts.append(child.text or '')
+                self._collect_text(
+                    child, dirty, noises, replacements, texts)
+            # Skip the text of the comments and processing instructions.
+            elif isinstance(child.tag, str):
+                texts.extend(child.itertext())
+            texts.append(child.tail or '')
+
     def get_content(self):
-        element_copy = self._element_copy()
+        """Return the text of the element without the noises, in which the
+        reserved elements are replaced with placeholders. The element is
+        walked read-only instead of being copied and modified.
+        """
+        noises = set()
         if self.remove_pattern is not None:
-            for noise in element_copy.xpath(
-                    self.remove_pattern, namespaces=ns):
-                self._safe_remove(noise)
+            noises.update(
+                self.element.xpath(self.remove_pattern, namespaces=ns))
         elements = []
         if self.reserve_pattern is not None:
-            elements = element_copy.xpath(self.reserve_pattern, namespaces=ns)
-        for eid, element in enumerate(elements):
+            elements = self.element.xpath(self.reserve_pattern, namespaces=ns)
+        if not noises and not elements:
+            return trim(''.join(self.element.itertext()))
+
+        # The ancestors of the noises and reserved elements, which need to be
+        # walked into instead of getting the text as a whole.
+        dirty = self._add_ancestors(noises, set())
+        eid, targets, replacements = 0, set(), {}
+        for element in elements:
+            # The elements inside the noises have been removed with them.
+            if noises and (
+                    element in noises or self._is_within(element, noises)):
+                continue
             replacement = self.placeholder[0].format(format(eid, '05'))
+            eid += 1
             if get_name(element) in ('sub', 'sup'):
                 parent = element.getparent()
-                if parent is not None and get_name(parent) == 'a' and \
-                        parent.text is None and element.tail is None and \
-                        len(parent.getchildren()) == 1:
-                    elements[eid] = element = parent
-            self.reserve_elements.append(get_string(element, True))
-            self._safe_remove(element, replacement)
-        return trim(''.join(element_copy.itertext()))
+                if parent is not self.element and \
+                        get_name(parent) == 'a' and parent not in targets \
+                        and parent.text is None and element.tail is None \
+                        and len(parent) == 1:
+                    element = parent
+            self.reserve_elements.append(
+                self._get_reserved_string(element, dirty))
+            # The elements inside the reserved elements have been replaced
+            # along with them.
+            if not self._is_within(element, targets):
+                replacements[element] = replacement
+            targets.add(element)
+
+        self._add_ancestors(replacements, dirty)
+        texts = [self.element.text or '']
+        self._collect_text(self.element, dirty, noises, replacements, texts)
+        return trim(''.join(texts))
 
     def _polish_translation(self, translation):
         translation = translation.replace('\n', '<br/>')
@@ -492,6 +575,26 @@ class PageElement(Element):
         return table
 
 
+class PreparedPageElement(PageElement):
+    """The page element of which the raw markup and the content have been
+    prepared by a worker process from the serialized page.
+    """
+    def __init__(
+            self, element, page_id, ignored, raw, content, reserve_elements):
+        PageElement.__init__(self, element, page_id, ignored)
+        self.raw = raw
+        self.content = content
+        self.reserved = reserve_elements
+
+    def get_raw(self):
+        return self.raw
+
+    def get_content(self):
+        # Collect the reserved elements as the original method does.
+        self.reserve_elements.extend(self.reserved)
+        return self.content
+
+
 class Extraction:
     # List the necessary non-inline-level elements according to the HTML spec:
     # https://html.spec.whatwg.org/multipage/rendering.html#non-replaced-elements
@@ -501,6 +604,11 @@ class Extraction:
         'aside', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hgroup', 'nav',
         'section', 'dd', 'dl', 'dt', 'menu', 'ol', 'ul', 'table', 'caption',
         'colgroup', 'col', 'thead', 'tbody', 'tfoot', 'tr', 'td', 'th')
+    non_inline_tags = frozenset(
+        '{%s}%s' % (ns['x'], tag) for tag in non_inline_elements)
+    # The minimum number of pages to be processed in parallel, below which
+    # starting the processes costs more than it saves.
+    parallel_threshold = 64
 
     def __init__(
             self, pages, priority_rules, rule_mode, filter_scope, filter_rules,
@@ -515,6 +623,9 @@ class Extraction:
         self.priority_patterns = []
         self.filter_patterns = []
         self.ignore_patterns = []
+        # The patterns compiled into one expression to match the elements.
+        self.priority_matcher = None
+        self.ignore_matcher = None
 
         self.load_priority_patterns()
         self.load_filter_patterns()
@@ -525,6 +636,7 @@ class Extraction:
             'p', 'pre', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote']
         self.priority_patterns = css_to_xpath(
             default_selectors + self.priority_rules)
+        self.priority_matcher = self.compile_patterns(self.priority_patterns)
 
     def load_filter_patterns(self):
         default_filter_rules = (
@@ -544,6 +656,18 @@ class Extraction:
         default_selectors = ['pre', 'code']
         self.ignore_patterns = css_to_xpath(
             default_selectors + self.ignore_rules)
+        self.ignore_matcher = self.compile_patterns(self.ignore_patterns)
+
+    @staticmethod
+    def compile_patterns(patterns):
+        """Compile the patterns into one XPath expression evaluated to a
+        boolean, which is faster than evaluating the patterns one by one.
+        """
+        if not patterns:
+            return None
+        return etree.XPath(
+            ' or '.join('(%s)' % pattern for pattern in patterns),
+            namespaces=ns)
 
     def get_sorted_pages(self):
         pages = []
@@ -561,27 +685,87 @@ class Extraction:
             elements.extend(self.extract_elements(page.id, body, []))
         return filter(self.filter_content, elements)
 
+    def get_rules(self):
+        return (
+            self.priority_rules, self.rule_mode, self.filter_scope,
+            self.filter_rules, self.ignore_rules)
+
+    def get_prepared_elements(self, handler, processes=None):
+        """Extract the elements and prepare their originals with the handler
+        in the worker processes, which are sharded by pages. The elements are
+        returned in the same order as get_elements(), or None if the pages
+        are too few, the processes are not available or the process has
+        other threads running.
+        """
+        processes = processes or os.cpu_count() or 1
+        pages = self.get_sorted_pages()
+        # Forking is unsafe on macOS, and spawning cannot import the plugin.
+        if processes < 2 or len(pages) < self.parallel_threshold or \
+                sys.platform == 'darwin' or \
+                'fork' not in multiprocessing.get_all_start_methods():
+            return None
+        # The child forked while another thread holds a lock, e.g. the one
+        # of the SQLite or the logging, would deadlock on acquiring it.
+        if threading.active_count() > 1:
+            log.debug('Extract the pages serially with threads running.')
+            return None
+        bodies = [page.data.find('./x:body', namespaces=ns) for page in pages]
+        tasks = [
+            (page.id, etree.tostring(body))
+            for page, body in zip(pages, bodies)]
+        elements = []
+        try:
+            with ProcessPoolExecutor(
+                    processes, multiprocessing.get_context('fork'),
+                    initializer=init_worker,
+                    initargs=(self.get_rules(), handler)) as executor:
+                results = executor.map(
+                    prepare_page, tasks,
+                    chunksize=max(1, len(tasks) // (processes * 4)))
+                for page, body, records in zip(pages, bodies, results):
+                    # Locate the elements in the document order of the body,
+                    # which is the same as the one parsed by the worker.
+                    nodes = list(body.iter())
+                    for position, ignored, raw, content, reserved in records:
+                        elements.append(PreparedPageElement(
+                            nodes[position], page.id, ignored, raw, content,
+                            reserved))
+        except (OSError, BrokenProcessPool) as error:
+            log.warn('Failed to extract the pages in parallel: %s' % error)
+            return None
+        return elements
+
     def is_priority(self, element: etree._Element):
-        for pattern in self.priority_patterns:
-            if element.xpath(pattern, namespaces=ns):
-                return True
-        return False
+        if self.priority_matcher is None:
+            return False
+        return self.priority_matcher(element)
 
     def is_inline_only(self, element: etree._Element):
         """The purpose of this method is to ensure that if the element contains
         only inline-level elements, it is regarded as a whole paragraph; there
         is no need to further separate its children.
         """
-        for tag in self.non_inline_elements:
-            if element.find(f'./x:{tag}', namespaces=ns) is not None:
+        for child in element.iterchildren(etree.Element):
+            if child.tag in self.non_inline_tags:
                 return False
         return True
 
-    def need_ignore(self, element):
-        for pattern in self.ignore_patterns:
-            if element.xpath(pattern, namespaces=ns):
+    def has_inline_content(self, element: etree._Element):
+        """Check the children in one pass whether the element contains only
+        inline-level elements or any text between its children.
+        """
+        inline_only = True
+        for child in element.iterchildren(etree.Element):
+            if child.tail is not None and trim(child.tail) != '':
                 return True
-        return False
+            if child.tag in self.non_inline_tags:
+                inline_only = False
+        return inline_only
+
+    def need_ignore(self, element):
+        if self.ignore_matcher is None:
+            return False
+        return self.ignore_matcher(element)
 
     def extract_elements(self, page_id, root, elements=[]):
         """If the root matches the pattern, return an empty list; otherwise,
@@ -593,27 +777,17 @@ class Extraction:
             if self.need_ignore(element):
                 elements.append(PageElement(element, page_id, True))
                 continue
-            element_has_content = False
-            if self.is_priority(element) or self.is_inline_only(element) or (
-                    element.text is not None and trim(element.text) != ''):
-                element_has_content = True
-            else:
-                children = element.findall('./*')
-                if children and self.is_priority(element):
-                    element_has_content = True
-                else:
-                    for child in children:
-                        if child.tail is not None and trim(child.tail) != '':
-                            element_has_content = True
-                            break
+            element_has_content = self.is_priority(element) or (
+                element.text is not None and trim(element.text) != '') or \
+                self.has_inline_content(element)
+            # Neither the element nor the root needs to be ignored as they
+            # have been checked already.
             if element_has_content:
-                elements.append(PageElement(
-                    element, page_id, self.need_ignore(element)))
+                elements.append(PageElement(element, page_id))
             else:
                 self.extract_elements(page_id, element, elements)
         # Return root if all children have no content
-        return elements if elements else [
-            PageElement(root, page_id, self.need_ignore(root))]
+        return elements if elements else [PageElement(root, page_id)]
 
     def filter_content(self, element):
         # Ignore the element contains empty content
@@ -688,19 +862,22 @@ class ElementHandler:
             'var', 'canvas', 'svg', 'script', 'style', 'math')
         self.reserve_pattern = create_xpath(default_rules + tuple(rules))
 
+    def prepare_element(self, element):
+        element.set_placeholder(self.placeholder)
+        element.set_position(self.position)
+        element.set_target_direction(self.target_direction)
+        element.set_translation_lang(self.translation_lang)
+        element.set_original_color(self.original_color)
+        element.set_translation_color(self.translation_color)
+        if self.column_gap is not None:
+            element.set_column_gap(self.column_gap)
+        element.set_remove_pattern(self.remove_pattern)
+        element.set_reserve_pattern(self.reserve_pattern)
+
     def prepare_original(self, elements):
         count = 0
         for oid, element in enumerate(elements):
-            element.set_placeholder(self.placeholder)
-            element.set_position(self.position)
-            element.set_target_direction(self.target_direction)
-            element.set_translation_lang(self.translation_lang)
-            element.set_original_color(self.original_color)
-            element.set_translation_color(self.translation_color)
-            if self.column_gap is not None:
-                element.set_column_gap(self.column_gap)
-            element.set_remove_pattern(self.remove_pattern)
-            element.set_reserve_pattern(self.reserve_pattern)
+            self.prepare_element(element)
             raw = element.get_raw()
             content = element.get_content()
             # Make sure the element does not contain empty content because it
@@ -747,16 +924,7 @@ class ElementHandlerMerge(ElementHandler):
             self.elements[eid] = element
             if element.ignored:
                 continue
-            element.set_placeholder(self.placeholder)
-            element.set_position(self.position)
-            element.set_target_direction(self.target_direction)
-            element.set_translation_lang(self.translation_lang)
-            element.set_original_color(self.original_color)
-            element.set_translation_color(self.translation_color)
-            if self.column_gap is not None:
-                element.set_column_gap(self.column_gap)
-            element.set_remove_pattern(self.remove_pattern)
-            element.set_reserve_pattern(self.reserve_pattern)
+            self.prepare_element(element)
             code = element.get_raw()
             content = element.get_content()
             content += self.separator
@@ -866,7 +1034,41 @@ def get_toc_elements(nodes, elements=[]):
     return elements
 
 
-def get_page_elements(pages):
+# The extraction and the element handler of the worker process.
+worker_state: tuple = ()
+
+
+def init_worker(rules, handler):
+    global worker_state
+    worker_state = (Extraction([], *rules), handler)
+
+
+def prepare_page(task):
+    """Extract the elements from the serialized page body in the worker
+    process and prepare their originals. Return the position of each element
+    in the document order of the body along with the prepared values.
+    """
+    extraction, handler = worker_state
+    page_id, markup = task
+    body = etree.fromstring(markup)
+    positions = {node: position for position, node in enumerate(body.iter())}
+    records = []
+    for element in filter(
+            extraction.filter_content,
+            extraction.extract_elements(page_id, body, [])):
+        handler.prepare_element(element)
+        raw = element.get_raw()
+        content = element.get_content()
+        records.append((
+            positions[element.element], element.ignored, raw, content,
+            element.reserve_elements))
+    return records
+
+
+def get_page_elements(pages, handler=None):
+    """:handler: The element handler to prepare the originals of the elements
+    in parallel if it is enabled and the book is large enough.
+    """
     config = get_config()
     priority_rules = config.get('priority_rules')
     rule_mode = config.get('rule_mode')
@@ -876,6 +1078,10 @@ def get_page_elements(pages):
     extraction = Extraction(
         pages, priority_rules, rule_mode, filter_scope, filter_rules,
         ignore_rules)
+    if handler is not None and config.get('parallel_extraction'):
+        elements = extraction.get_prepared_elements(handler)
+        if elements is not None:
+            return elements
     return extraction.get_elements()
 
 
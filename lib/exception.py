@@ -2,6 +2,13 @@ class UnexpectedResult(Exception):
     pass
 
 
+class HTTPRequestError(Exception):
+    def __init__(self, message, status=None, headers=None):
+        Exception.__init__(self, message)
+        self.status = status
+        self.headers = headers
+
+
 class ConversionFailed(Exception):
     pass
 
@@ -18,6 +25,13 @@ class TranslationCanceled(Exception):
     pass
 
 
+class TranslationRetry(Exception):
+    """Ask the handler to retry the translation after a delay in seconds."""
+    def __init__(self, message, delay=0.0):
+        Exception.__init__(self, message)
+        self.delay = delay
+
+
 class BadApiKeyFormat(TranslationCanceled):
     pass
 
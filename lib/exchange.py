@@ -0,0 +1,207 @@
+import json
+import os.path
+
+from lxml import etree  # type: ignore
+
+from .. import EbookTranslator
+
+from .translation import get_engine_class
+
+
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+# The inline elements holding the native codes instead of the text.
+INLINE_CODES = ('bpt', 'ept', 'it', 'ph', 'ut')
+
+
+def get_lang_code(engine_name, lang, source=False):
+    """Get the code of the language named by the plugin, which is mostly a
+    BCP 47 tag used by the engine, or None if it is unknown.
+    """
+    if not lang:
+        return None
+    engine_class = get_engine_class(engine_name)
+    try:
+        if source:
+            code = engine_class.get_source_code(lang)
+            return None if code == 'auto' else code
+        return engine_class.get_target_code(lang)
+    except (KeyError, TypeError):
+        return None
+
+
+def match_lang(variants, code):
+    """Find the variant in the language of the code, or in the same primary
+    language, e.g. "zh-CN" for "zh".
+    """
+    if not code:
+        return None
+    code = code.lower()
+    for variant in variants:
+        if (variant[0] or '').lower() == code:
+            return variant
+    primary = code.split('-')[0]
+    for variant in variants:
+        if (variant[0] or '').lower().split('-')[0] == primary:
+            return variant
+    return None
+
+
+def get_seg_text(element):
+    """Get the text of the segment without the native codes of the inline
+    elements, e.g. "<b>" of <bpt>, but with the text of <hi>.
+    """
+    text = element.text or ''
+    for child in element:
+        if child.tag not in INLINE_CODES:
+            text += get_seg_text(child)
+        text += child.tail or ''
+    return text
+
+
+def iter_tmx(path, target_code=None):
+    """Yield the segments of the TMX file one by one, which are removed from
+    the tree once read to keep the memory flat on huge files. The variant in
+    the language of the target code is taken as the translation, otherwise
+    the first one other than the source.
+    """
+    source_lang = None
+    for event, element in etree.iterparse(
+            path, events=('end',), tag=('header', 'tu'),
+            resolve_entities=False, huge_tree=True):
+        if element.tag == 'header':
+            source_lang = element.get('srclang')
+            continue
+        segment, variants = {}, []
+        for child in element:
+            if child.tag == 'tuv':
+                seg = child.find('seg')
+                text = '' if seg is None else get_seg_text(seg)
+                variants.append((child.get(XML_LANG), text))
+            elif child.tag == 'prop' and child.get('type') == 'x-md5':
+                segment['md5'] = child.text
+        element.clear(keep_tail=True)
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+        if len(variants) < 2:
+            continue
+        # The first variant is the source if the language is not specified.
+        source = variants[0]
+        if source_lang and source_lang != '*all*':
+            source = match_lang(variants, source_lang) or source
+        others = [variant for variant in variants if variant is not source]
+        target = match_lang(others, target_code) or others[0]
+        # The language codes of the file are not those named by the plugin,
+        # so the segments take the engine and the language of the importer.
+        segment.update(original=source[1], translation=target[1])
+        yield segment
+
+
+def iter_jsonl(path):
+    """Yield the segments of the JSONL file, skipping the malformed lines
+    and the ones without an original text or a translation, as the TMX
+    translation units without two variants are skipped.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                segment = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(segment, dict) and \
+                    isinstance(segment.get('original'), str) and \
+                    isinstance(segment.get('translation'), str):
+                yield segment
+
+
+def is_tmx(path):
+    return os.path.splitext(path)[1].lower() == '.tmx'
+
+
+def read_segments(path, target_code=None):
+    if is_tmx(path):
+        return iter_tmx(path, target_code)
+    return iter_jsonl(path)
+
+
+def write_tmx(path, segments, source_lang=None):
+    """Write the segments to the TMX file incrementally. The languages are
+    the codes, and the ones unknown are left undetermined.
+    """
+    with etree.xmlfile(path, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element('tmx', version='1.4'):
+            xf.write(etree.Element('header', {
+                'creationtool': EbookTranslator.name,
+                'creationtoolversion': EbookTranslator.__version__,
+                'segtype': 'paragraph', 'o-tmf': 'sqlite',
+                'adminlang': 'en', 'srclang': source_lang or '*all*',
+                'datatype': 'plaintext'}))
+            with xf.element('body'):
+                for segment in segments:
+                    tu = etree.Element('tu')
+                    if segment.get('md5'):
+                        prop = etree.SubElement(tu, 'prop', type='x-md5')
+                        prop.text = segment['md5']
+                    for lang, text in (
+                            (source_lang or 'und', segment['original']),
+                            (segment.get('target_lang') or 'und',
+                             segment['translation'])):
+                        tuv = etree.SubElement(tu, 'tuv', {XML_LANG: lang})
+                        etree.SubElement(tuv, 'seg').text = text
+                    xf.write(tu)
+
+
+def write_jsonl(path, segments):
+    with open(path, 'w', encoding='utf-8') as file:
+        for segment in segments:
+            file.write(json.dumps(segment, ensure_ascii=False) + '\n')
+
+
+def export_cache(cache, path):
+    """Export the translated paragraphs of the cache to a TMX or JSONL file
+    by the extension of the path. The TMX file has the language codes of
+    the engines instead of the language names.
+    """
+    segments = (
+        {'md5': paragraph.md5, 'original': paragraph.original,
+         'translation': paragraph.translation,
+         'engine_name': paragraph.engine_name,
+         'target_lang': paragraph.target_lang}
+        for paragraph in cache.iter_paragraphs() if paragraph.translation)
+    if not is_tmx(path):
+        return write_jsonl(path, segments)
+    engine_name = cache.get_info('engine_name')
+    codes: dict[tuple, str | None] = {}
+
+    def with_code(segment):
+        key = (segment['engine_name'] or engine_name, segment['target_lang'])
+        if key not in codes:
+            codes[key] = get_lang_code(*key)
+        return dict(segment, target_lang=codes[key])
+    write_tmx(
+        path, map(with_code, segments),
+        get_lang_code(engine_name, cache.get_info('source_lang'), True))
+
+
+def import_cache(cache, path):
+    """Import the translations from a TMX or JSONL file into the cache,
+    matched by the md5 or the original text of the paragraphs, and return
+    the number of the paragraphs translated.
+    """
+    target_code = get_lang_code(
+        cache.get_info('engine_name'), cache.get_info('target_lang'))
+    return cache.import_translations(read_segments(path, target_code))
+
+
+def import_memory(memory, path, engine_name=None, target_lang=None):
+    """Import the translations into the translation memory, which are looked
+    up with the engine name and the target language. The given ones apply
+    to the segments without their own, e.g. all of those from a TMX file.
+    Return the number of the translations imported.
+    """
+    return memory.import_translations(
+        read_segments(path, get_lang_code(engine_name, target_lang)),
+        engine_name, target_lang)
@@ -1,14 +1,152 @@
 import sys
+import time
 import asyncio
+import threading
+import collections
 import concurrent.futures
 
 from .utils import log, traceback_error
-from .exception import TranslationCanceled
+from .exception import TranslationCanceled, TranslationRetry
+
+
+class TokenBucket:
+    """A token bucket refilled at a fixed rate per minute. Reservations may
+    drive the balance negative, so that concurrent callers queue up fairly
+    instead of racing for the next refill.
+    """
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, cost=1.0):
+        """Take the cost from the bucket and return the seconds to wait."""
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # A single request larger than the bucket would wait forever.
+        self.tokens -= min(float(cost), self.capacity)
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class RateLimiter:
+    """Limit the requests per minute and the tokens (or characters) per
+    minute of all the workers sharing this instance.
+    """
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.lock = threading.Lock()
+        self.request_bucket = None
+        self.token_bucket = None
+        if requests_per_minute > 0:
+            self.request_bucket = TokenBucket(requests_per_minute)
+        if tokens_per_minute > 0:
+            self.token_bucket = TokenBucket(tokens_per_minute)
+
+    def is_enabled(self):
+        return self.request_bucket is not None \
+            or self.token_bucket is not None
+
+    def reserve(self, tokens=0):
+        delay = 0.0
+        with self.lock:
+            if self.request_bucket is not None:
+                delay = max(delay, self.request_bucket.reserve(1))
+            if self.token_bucket is not None and tokens > 0:
+                delay = max(delay, self.token_bucket.reserve(tokens))
+        return delay
+
+    def wait(self, tokens=0):
+        """Block the calling thread until the request is allowed."""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class AdaptiveConcurrency:
+    """Adjust the number of in-flight requests with AIMD: grow the limit
+    while the latency stays flat, and cut it in half on overload signals,
+    e.g. HTTP 429/503 or timeouts. The limit never exceeds the configured
+    maximum. The baseline latency is the lowest of the recent samples, so
+    that a single fast response does not pin it forever.
+    """
+    overload_errors = (
+        'HTTP Error 429', 'HTTP Error 503', 'Too Many Requests',
+        'timed out', 'TimeoutError')
+
+    def __init__(self, max_limit, initial_limit=2, latency_tolerance=2.0,
+                 latency_window=20):
+        self.max_limit = max(1, max_limit)
+        self.window = float(min(initial_limit, self.max_limit))
+        self.latency_tolerance = latency_tolerance
+
+        self.in_flight = 0
+        self.slow_start = True
+        self.latencies: collections.deque[float] = collections.deque(
+            maxlen=max(1, latency_window))
+        self.condition = asyncio.Condition()
+
+    @property
+    def limit(self):
+        return max(1, int(self.window))
+
+    @property
+    def base_latency(self):
+        return min(self.latencies) if self.latencies else None
+
+    def is_overload(self, error):
+        return any(signal in error for signal in self.overload_errors)
+
+    def adjust(self, latency, error=None):
+        """Return True if the current limit was changed."""
+        limit = self.limit
+        if error is not None:
+            if not self.is_overload(error):
+                return False
+            self.slow_start = False
+            self.window = max(1.0, self.window / 2)
+        else:
+            self.latencies.append(latency)
+            if latency > self.base_latency * self.latency_tolerance:
+                # Latency is rising; stop growing before the service queues.
+                self.slow_start = False
+                return False
+            # Grow exponentially until the first overload, then linearly.
+            self.window += 1.0 if self.slow_start else 1.0 / self.window
+            self.window = min(float(self.max_limit), self.window)
+        return self.limit != limit
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(
+                lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self, latency=None, error=None):
+        async with self.condition:
+            self.in_flight -= 1
+            if latency is not None and self.adjust(latency, error):
+                log.info('Adaptive concurrency limit: %s' % self.limit)
+            self.condition.notify_all()
+
+
+def unpack(item):
+    """Return the paragraphs of the item, which is either a paragraph or a
+    list of paragraphs translated within one request.
+    """
+    return item if isinstance(item, list) else [item]
 
 
 class Handler:
+    # The finished paragraphs are processed in groups, flushed when the group
+    # is full or the interval in seconds has elapsed.
+    process_size = 100
+    process_interval = 0.5
+
     def __init__(self, paragraphs, concurrency_limit, translate_paragraph,
-                 process_translation, request_interval):
+                 process_translations, request_interval, adaptive=False):
         self.queue = asyncio.Queue()
         self.done_queue = asyncio.Queue()
 
@@ -17,47 +155,150 @@ class Handler:
 
         self.concurrency_limit = concurrency_limit or self.queue.qsize()
         self.translate_paragraph = translate_paragraph
-        self.process_translation = process_translation
+        self.process_translations = process_translations
         self.request_interval = request_interval
+        self.adaptive = adaptive
+        self.concurrency = None
+        self.retries: set[asyncio.TimerHandle] = set()
+        self.executor = None
+
+    async def _translate(self, paragraph):
+        """Await the coroutine function directly on the event loop, or run
+        the blocking function in the default executor.
+        """
+        if asyncio.iscoroutinefunction(self.translate_paragraph):
+            return await self.translate_paragraph(paragraph)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.translate_paragraph, paragraph)
+
+    async def translate(self, paragraph):
+        """Translate the paragraph within the adaptive concurrency limit, if
+        it is enabled.
+        """
+        if self.concurrency is None:
+            return await self._translate(paragraph)
+        # Cached paragraphs do not tell anything about the service. The
+        # latency is normalized per character to compare paragraphs of
+        # different sizes.
+        size = sum(
+            len(p.original) for p in unpack(paragraph) if not p.is_cache)
+        await self.concurrency.acquire()
+        start_time = time.monotonic()
+        latency, error = None, None
+        try:
+            await self._translate(paragraph)
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            if size > 0:
+                latency = (time.monotonic() - start_time) / size
+            await self.concurrency.release(latency, error)
+
+    def schedule_retry(self, paragraph, delay):
+        """Put the paragraph back to the queue after the delay, so the worker
+        can take the next paragraph right away. The paragraph stays
+        unfinished meanwhile to keep the queue from being joined.
+        """
+        def retry():
+            self.retries.discard(handle)
+            self.queue.put_nowait(paragraph)
+            self.queue.task_done()
+        handle = asyncio.get_running_loop().call_later(delay, retry)
+        self.retries.add(handle)
+
+    def split_batch(self, paragraphs):
+        """Put the paragraphs of a failed batch back to the queue one by
+        one, so that a single bad paragraph does not fail the others.
+        """
+        for paragraph in paragraphs:
+            paragraph.retry = 0
+            self.queue.put_nowait(paragraph)
+        self.queue.task_done()
 
     async def translation_worker(self):
         while True:
-            paragraph = await self.queue.get()
+            item = await self.queue.get()
+            paragraphs = unpack(item)
             try:
-                await asyncio.get_running_loop().run_in_executor(
-                    None, self.translate_paragraph, paragraph)
-                paragraph.error = None
-                if self.queue.qsize() > 0 and not paragraph.is_cache:
+                await self.translate(item)
+                for paragraph in paragraphs:
+                    paragraph.error = None
+                if self.queue.qsize() > 0 and \
+                        not all(p.is_cache for p in paragraphs):
                     await asyncio.sleep(self.request_interval)
-                self.done_queue.put_nowait(paragraph)
+                for paragraph in paragraphs:
+                    self.done_queue.put_nowait(paragraph)
                 self.queue.task_done()
+            except TranslationRetry as e:
+                self.schedule_retry(item, e.delay)
             except TranslationCanceled:
                 await self.cancel_tasks()
                 break
             except Exception:
-                paragraph.error = traceback_error()
-                self.done_queue.put_nowait(paragraph)
+                if len(paragraphs) > 1:
+                    self.split_batch(paragraphs)
+                    continue
+                paragraphs[0].error = traceback_error()
+                self.done_queue.put_nowait(paragraphs[0])
                 self.queue.task_done()
 
+    async def get_finished_paragraphs(self):
+        """Wait for the first finished paragraph, then gather the following
+        ones until the group is full or the interval has elapsed.
+        """
+        loop = asyncio.get_running_loop()
+        paragraphs = [await self.done_queue.get()]
+        deadline = loop.time() + self.process_interval
+        while len(paragraphs) < self.process_size:
+            if not self.done_queue.empty():
+                paragraphs.append(self.done_queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                paragraphs.append(
+                    await asyncio.wait_for(self.done_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return paragraphs
+
     async def processing_worker(self):
+        """The only consumer of the finished paragraphs, which processes
+        them in groups on a long-lived thread.
+        """
         while True:
-            paragraph = await self.done_queue.get()
-            with concurrent.futures.ThreadPoolExecutor() as pool:
+            paragraphs = await self.get_finished_paragraphs()
+            try:
                 await asyncio.get_running_loop().run_in_executor(
-                    pool, self.process_translation, paragraph)
-            self.done_queue.task_done()
+                    self.executor, self.process_translations, paragraphs)
+            except Exception:
+                log.error(traceback_error())
+            finally:
+                for _ in paragraphs:
+                    self.done_queue.task_done()
 
     async def cancel_tasks(self):
         self.queue.task_done()
+        for handle in self.retries:
+            handle.cancel()
+            self.queue.task_done()
+        self.retries.clear()
+        # The finished paragraphs are still processed to keep the results.
         while not self.queue.empty():
             await self.queue.get()
             self.queue.task_done()
-        while not self.done_queue.empty():
-            await self.done_queue.get()
-            self.done_queue.task_done()
 
     async def create_tasks(self):
         tasks = []
+        # Keep the processing in order on a single thread.
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        if self.adaptive:
+            self.concurrency = AdaptiveConcurrency(self.concurrency_limit)
+            log.info(
+                'Adaptive concurrency limit: %s (max: %s)'
+                % (self.concurrency.limit, self.concurrency_limit))
         for _ in range(self.concurrency_limit):
             tasks.append(asyncio.create_task(self.translation_worker()))
         tasks.append(asyncio.create_task(self.processing_worker()))
@@ -74,6 +315,7 @@ class Handler:
             await asyncio.gather(*tasks)
         except asyncio.CancelledError:
             pass
+        self.executor.shutdown()
 
     def handle(self):
         if sys.platform == 'win32':
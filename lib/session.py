@@ -0,0 +1,610 @@
+import io
+import ssl
+import sys
+import zlib
+import base64
+import socket
+import asyncio
+import threading
+import http.client
+from urllib.parse import urlsplit, urlencode, unquote
+
+from calibre import get_proxies  # type: ignore
+
+from .utils import log
+from .exception import HTTPRequestError
+
+
+def decode_content(content: bytes, encoding: str | None) -> bytes:
+    encoding = (encoding or '').lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompress(content, 16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(content)
+        except zlib.error:
+            return zlib.decompress(content, -zlib.MAX_WBITS)
+    return content
+
+
+def get_proxy_headers(proxy_uri: str | None) -> dict:
+    """Authenticate with the credentials in the proxy URI, as urllib does."""
+    if proxy_uri is None:
+        return {}
+    proxy = urlsplit(proxy_uri)
+    if proxy.username is None:
+        return {}
+    credentials = '%s:%s' % (
+        unquote(proxy.username), unquote(proxy.password or ''))
+    return {'Proxy-Authorization': 'Basic %s' % base64.b64encode(
+        credentials.encode('utf-8')).decode('ascii')}
+
+
+class BufferedResponse(io.BytesIO):
+    """A fully received response that can be read like a stream. Reading past
+    the end raises an error instead of returning empty lines forever.
+    """
+    def __init__(self, content=b'', status=200, headers=None):
+        io.BytesIO.__init__(self, content)
+        self.status = status
+        self.headers = headers
+
+    def readline(self, size=-1):
+        line = io.BytesIO.readline(self, size)
+        if line == b'' and size != 0:
+            raise EOFError('Unexpected end of the response stream.')
+        return line
+
+
+class HTTPSConnection(http.client.HTTPSConnection):
+    """Resume the TLS session negotiated by the previous connection to the
+    same host, so reconnecting does not cost a full handshake.
+    """
+    def __init__(self, *args, pool=None, **kwargs):
+        http.client.HTTPSConnection.__init__(self, *args, **kwargs)
+        self.pool = pool
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host or self.host
+        session = None if self.pool is None else self.pool.tls_session
+        try:
+            self.sock = self._context.wrap_socket(
+                self.sock, server_hostname=server_hostname, session=session)
+        except ssl.SSLError:
+            if session is None:
+                raise
+            # The server refused the cached session, negotiate a new one.
+            self.sock.close()
+            http.client.HTTPConnection.connect(self)
+            self.sock = self._context.wrap_socket(
+                self.sock, server_hostname=server_hostname)
+        if self.pool is not None:
+            self.pool.save_tls_session(self.sock)
+
+
+class ConnectionPool:
+    """Keep-alive connections to a single host. A connection is handed out
+    again only after the response of its previous request was fully read.
+    """
+    max_size = 16
+
+    def __init__(self, scheme, host, port, proxy_uri=None, context=None):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.proxy_uri = proxy_uri
+        self.proxy_headers = get_proxy_headers(proxy_uri)
+        self.context = context
+
+        self.lock = threading.Lock()
+        self.connections: list = []
+        self.tls_session = None
+
+        self.requests = 0
+        self.reused = 0
+        self.handshakes = 0
+        self.resumed = 0
+
+    def save_tls_session(self, sock):
+        with self.lock:
+            self.handshakes += 1
+            if sock.session_reused:
+                self.resumed += 1
+            self.tls_session = sock.session
+
+    def _new_connection(self, timeout):
+        host, port = self.host, self.port
+        if self.proxy_uri is not None:
+            proxy = urlsplit(self.proxy_uri)
+            host, port = proxy.hostname, proxy.port
+        if self.scheme == 'https':
+            connection = HTTPSConnection(
+                host, port, timeout=timeout, context=self.context, pool=self)
+        else:
+            connection = http.client.HTTPConnection(
+                host, port, timeout=timeout)
+        if self.proxy_uri is not None and self.scheme == 'https':
+            connection.set_tunnel(
+                self.host, self.port, headers=self.proxy_headers)
+        return connection
+
+    def acquire(self, timeout):
+        with self.lock:
+            self.requests += 1
+            for item in list(self.connections):
+                connection, response = item
+                if response is not None and not response.isclosed():
+                    continue
+                self.connections.remove(item)
+                # The socket is closed by http.client if the server asked to
+                # close the connection, which can not be reused.
+                if connection.sock is None:
+                    connection.close()
+                    continue
+                self.reused += 1
+                connection.timeout = timeout
+                connection.sock.settimeout(timeout)
+                return connection, True
+        return self._new_connection(timeout), False
+
+    def release(self, connection, response=None):
+        with self.lock:
+            self.connections.append((connection, response))
+            # Drop the oldest connections, which may belong to abandoned
+            # streaming responses that are never read to the end.
+            while len(self.connections) > self.max_size:
+                self.connections.pop(0)[0].close()
+
+    def discard(self, connection):
+        connection.close()
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = self.reused = self.handshakes = self.resumed = 0
+
+    def close(self):
+        with self.lock:
+            for connection, _ in self.connections:
+                connection.close()
+            del self.connections[:]
+
+
+async def read_head(reader):
+    line = await reader.readline()
+    if not line:
+        raise http.client.RemoteDisconnected(
+            'Remote end closed connection without response')
+    parts = line.decode('iso-8859-1').rstrip('\r\n').split(' ', 2)
+    if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+        raise http.client.BadStatusLine(line)
+    lines = []
+    while True:
+        header = await reader.readline()
+        if header in (b'\r\n', b'\n', b''):
+            break
+        lines.append(header)
+    headers = http.client.parse_headers(io.BytesIO(b''.join(lines) + b'\r\n'))
+    reason = parts[2] if len(parts) > 2 else ''
+    return parts[0], int(parts[1]), reason, headers
+
+
+async def read_body(reader, headers, method, status):
+    """Return the body and whether the connection can be kept alive."""
+    if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+        return b'', True
+    if 'chunked' in (headers.get('Transfer-Encoding') or '').lower():
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0].strip(), 16)
+            if size == 0:
+                # Skip the trailer section.
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        return b''.join(chunks), True
+    length = headers.get('Content-Length')
+    if length is not None:
+        return await reader.readexactly(int(length)), True
+    return await reader.read(), False
+
+
+class AsyncConnectionPool:
+    """Keep-alive stream connections to a single host, bound to the event
+    loop which created them.
+    """
+    max_size = 64
+
+    def __init__(self, scheme, host, port, proxy_uri=None, context=None):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.proxy_uri = proxy_uri
+        self.proxy_headers = get_proxy_headers(proxy_uri)
+        self.context = context
+
+        self.loop = asyncio.get_running_loop()
+        self.connections: list = []
+
+        self.requests = 0
+        self.reused = 0
+        self.handshakes = 0
+        self.resumed = 0
+
+    async def _open(self):
+        context = self.context if self.scheme == 'https' else None
+        if self.proxy_uri is None:
+            if context is not None:
+                self.handshakes += 1
+            return await asyncio.open_connection(
+                self.host, self.port, ssl=context,
+                server_hostname=self.host if context else None)
+        proxy = urlsplit(self.proxy_uri)
+        reader, writer = await asyncio.open_connection(
+            proxy.hostname, proxy.port or 80)
+        if context is not None:
+            address = '%s:%s' % (self.host, self.port)
+            lines = ['CONNECT %s HTTP/1.1' % address, 'Host: %s' % address]
+            lines.extend(
+                '%s: %s' % item for item in self.proxy_headers.items())
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('ascii'))
+            _, status, reason, _ = await read_head(reader)
+            if status != 200:
+                writer.close()
+                raise ConnectionError(
+                    'Tunnel connection failed: %s %s' % (status, reason))
+            await writer.start_tls(context, server_hostname=self.host)
+            self.handshakes += 1
+        return reader, writer
+
+    async def acquire(self):
+        self.requests += 1
+        while self.connections:
+            reader, writer = self.connections.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                self.reused += 1
+                return reader, writer, True
+            writer.close()
+        reader, writer = await self._open()
+        return reader, writer, False
+
+    def reset_stats(self):
+        self.requests = self.reused = self.handshakes = self.resumed = 0
+
+    def release(self, reader, writer):
+        if writer.is_closing() or len(self.connections) >= self.max_size:
+            writer.close()
+            return
+        self.connections.append((reader, writer))
+
+    def close(self):
+        for _, writer in self.connections:
+            writer.close()
+        del self.connections[:]
+
+
+class Session:
+    """Per-engine HTTP session that shares one connection pool per host
+    among all the workers of a translation job.
+    """
+    redirect_codes = (301, 302, 303, 307, 308)
+    max_redirects = 5
+
+    def __init__(self, name=None):
+        self.name = name
+        self.lock = threading.Lock()
+        self.pools: dict[tuple, ConnectionPool] = {}
+        self.async_pools: dict[tuple, AsyncConnectionPool] = {}
+        self.context = self._create_ssl_context()
+        self._env_proxies: dict | None = None
+
+    def _create_ssl_context(self):
+        try:
+            context = ssl.create_default_context()
+            context.check_hostname = True
+            context.verify_mode = ssl.CERT_REQUIRED
+        except Exception:
+            context = ssl._create_unverified_context(cert_reqs=ssl.CERT_NONE)
+        return context
+
+    def _get_proxy_uri(self, scheme, proxy_uri=None):
+        """Use the given proxy, otherwise read it from the environment once
+        for the whole session.
+        """
+        if proxy_uri is not None:
+            return proxy_uri
+        if self._env_proxies is None:
+            proxies = {}
+            http = get_proxies(False).get('http')
+            if http is not None:
+                proxies.update(http=http, https=http)
+            https = get_proxies(False).get('https')
+            if https is not None:
+                proxies.update(https=https)
+            self._env_proxies = proxies
+        uri = self._env_proxies.get(scheme)
+        if uri is not None and '://' not in uri:
+            uri = f'http://{uri}'
+        return uri
+
+    def get_pool(self, scheme, host, port, proxy_uri=None):
+        # Connections opened through a patched SOCKS socket can not be shared
+        # with the direct ones.
+        key = (scheme, host, port, proxy_uri, id(socket.socket))
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(
+                    scheme, host, port, proxy_uri, self.context)
+                self.pools[key] = pool
+            return pool
+
+    def get_async_pool(self, scheme, host, port, proxy_uri=None):
+        # Forget the pools of the event loops that were closed.
+        for key, pool in list(self.async_pools.items()):
+            if pool.loop.is_closed():
+                del self.async_pools[key]
+        key = (scheme, host, port, proxy_uri, id(asyncio.get_running_loop()))
+        pool = self.async_pools.get(key)
+        if pool is None:
+            pool = AsyncConnectionPool(
+                scheme, host, port, proxy_uri, self.context)
+            self.async_pools[key] = pool
+        return pool
+
+    def _resolve(self, url, proxy_uri=None):
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == 'https' else 80)
+        proxy = self._get_proxy_uri(scheme, proxy_uri)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+        if proxy is not None and scheme == 'http':
+            target = url
+        return scheme, parts.hostname, port, proxy, target, parts.netloc
+
+    def _redirect(self, url, location):
+        if '://' in location:
+            return location
+        parts = urlsplit(url)
+        return '%s://%s%s' % (parts.scheme, parts.netloc, location)
+
+    def _prepare(self, url, data, headers, method):
+        headers = dict(headers or {})
+        for name in list(headers):
+            # Only ask for the encodings that can be decoded.
+            if name.lower() == 'accept-encoding':
+                headers[name] = 'gzip, deflate'
+
+        if isinstance(data, dict):
+            data = urlencode(data)
+            if method.upper() == 'GET':
+                url += ('&' if '?' in url else '?') + data
+                data = None
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if data is not None and 'content-type' not in map(str.lower, headers):
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        return url, data, headers
+
+    def _send(self, pool, method, target, data, headers, timeout):
+        if pool.scheme == 'http':
+            headers = {**headers, **pool.proxy_headers}
+        connection, reused = pool.acquire(timeout)
+        try:
+            connection.request(method, target, body=data, headers=headers)
+            return connection, connection.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionError,
+                http.client.CannotSendRequest, http.client.BadStatusLine):
+            pool.discard(connection)
+            # The server may have closed an idle keep-alive connection.
+            if not reused:
+                raise
+        except Exception:
+            pool.discard(connection)
+            raise
+        connection = pool._new_connection(timeout)
+        try:
+            connection.request(method, target, body=data, headers=headers)
+            return connection, connection.getresponse()
+        except Exception:
+            pool.discard(connection)
+            raise
+
+    def request(
+            self, url, data=None, headers={}, method='GET', timeout=30,
+            proxy_uri=None, raw_object=False):
+        url, data, headers = self._prepare(url, data, headers, method)
+        for _ in range(self.max_redirects + 1):
+            scheme, host, port, proxy, target, _ = self._resolve(
+                url, proxy_uri)
+            pool = self.get_pool(scheme, host, port, proxy)
+            connection, response = self._send(
+                pool, method, target, data, headers, timeout)
+            location = response.getheader('Location')
+            if response.status in self.redirect_codes and location:
+                response.read()
+                pool.release(connection, response)
+                url = self._redirect(url, location)
+                if response.status == 303:
+                    method, data = 'GET', None
+                continue
+            encoding = response.getheader('Content-Encoding')
+            if response.status >= 400:
+                body = decode_content(response.read(), encoding)
+                pool.release(connection, response)
+                raise HTTPRequestError(
+                    'HTTP Error %s: %s\n\n%s' % (
+                        response.status, response.reason,
+                        body.decode('utf-8', 'replace')),
+                    response.status, response.headers)
+            if raw_object and encoding in (None, 'identity'):
+                # The connection is reusable once the stream is exhausted.
+                pool.release(connection, response)
+                return response
+            content = decode_content(response.read(), encoding)
+            pool.release(connection, response)
+            if raw_object:
+                return BufferedResponse(
+                    content, response.status, response.headers)
+            return content.decode('utf-8').strip()
+        raise Exception('Too many redirects: %s' % url)
+
+    async def _send_async(self, pool, method, target, data, headers, host):
+        if pool.scheme == 'http':
+            headers = {**headers, **pool.proxy_headers}
+        lines = ['%s %s HTTP/1.1' % (method, target)]
+        names = [name.lower() for name in headers]
+        if 'host' not in names:
+            lines.append('Host: %s' % host)
+        if 'accept-encoding' not in names:
+            lines.append('Accept-Encoding: identity')
+        if data is not None:
+            lines.append('Content-Length: %d' % len(data))
+        lines.extend('%s: %s' % item for item in headers.items())
+        message = ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8')
+        message += data or b''
+
+        reader, writer, reused = await pool.acquire()
+        try:
+            writer.write(message)
+            await writer.drain()
+            version, status, reason, response_headers = await read_head(
+                reader)
+        except (http.client.RemoteDisconnected, ConnectionError,
+                asyncio.IncompleteReadError):
+            writer.close()
+            # The server may have closed an idle keep-alive connection.
+            if not reused:
+                raise
+            reader, writer = await pool._open()
+            writer.write(message)
+            await writer.drain()
+            version, status, reason, response_headers = await read_head(
+                reader)
+        except BaseException:
+            writer.close()
+            raise
+        try:
+            content, keep_alive = await read_body(
+                reader, response_headers, method, status)
+        except BaseException:
+            writer.close()
+            raise
+        connection = (response_headers.get('Connection') or '').lower()
+        if keep_alive and version == 'HTTP/1.1' and connection != 'close':
+            pool.release(reader, writer)
+        else:
+            writer.close()
+        content = decode_content(
+            content, response_headers.get('Content-Encoding'))
+        return status, reason, response_headers, content
+
+    async def _request_async(
+            self, url, data, headers, method, proxy_uri, raw_object):
+        for _ in range(self.max_redirects + 1):
+            scheme, host, port, proxy, target, netloc = self._resolve(
+                url, proxy_uri)
+            pool = self.get_async_pool(scheme, host, port, proxy)
+            status, reason, response_headers, content = \
+                await self._send_async(
+                    pool, method, target, data, headers, netloc)
+            location = response_headers.get('Location')
+            if status in self.redirect_codes and location:
+                url = self._redirect(url, location)
+                if status == 303:
+                    method, data = 'GET', None
+                continue
+            if status >= 400:
+                raise HTTPRequestError(
+                    'HTTP Error %s: %s\n\n%s' % (
+                        status, reason, content.decode('utf-8', 'replace')),
+                    status, response_headers)
+            if raw_object:
+                return BufferedResponse(content, status, response_headers)
+            return content.decode('utf-8').strip()
+        raise Exception('Too many redirects: %s' % url)
+
+    async def request_async(
+            self, url, data=None, headers={}, method='GET', timeout=30,
+            proxy_uri=None, raw_object=False):
+        """Send the request on the running event loop. Streaming responses
+        are received completely before being returned.
+        """
+        scheme, _, _, proxy, _, _ = self._resolve(url, proxy_uri)
+        if proxy is not None and scheme == 'https' \
+                and sys.version_info < (3, 11):
+            # StreamWriter.start_tls, which the tunnel needs, is only
+            # available since Python 3.11.
+            def request():
+                response = self.request(
+                    url, data, headers, method, timeout, proxy_uri,
+                    raw_object)
+                if raw_object and not isinstance(response, BufferedResponse):
+                    response = BufferedResponse(
+                        response.read(), response.status, response.headers)
+                return response
+            return await asyncio.get_running_loop().run_in_executor(
+                None, request)
+        url, data, headers = self._prepare(url, data, headers, method)
+        return await asyncio.wait_for(
+            self._request_async(
+                url, data, headers, method, proxy_uri, raw_object),
+            timeout)
+
+    def stats(self):
+        requests = reused = handshakes = resumed = 0
+        with self.lock:
+            pools = list(self.pools.values())
+        pools += list(self.async_pools.values())
+        for pool in pools:
+            requests += pool.requests
+            reused += pool.reused
+            handshakes += pool.handshakes
+            resumed += pool.resumed
+        return {
+            'hosts': len(pools),
+            'requests': requests,
+            'reused': reused,
+            'reuse_ratio': round(reused / requests, 2) if requests else 0.0,
+            'handshakes': handshakes,
+            'resumed': resumed,
+            'handshakes_avoided': reused + resumed,
+        }
+
+    def reset_stats(self):
+        """Count the statistics of a new job from zero."""
+        with self.lock:
+            pools = list(self.pools.values())
+        pools += list(self.async_pools.values())
+        for pool in pools:
+            pool.reset_stats()
+
+    def close(self):
+        with self.lock:
+            pools = list(self.pools.values())
+            self.pools.clear()
+        pools += list(self.async_pools.values())
+        self.async_pools.clear()
+        for pool in pools:
+            pool.close()
+
+
+_sessions: dict[str | None, Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(name=None):
+    """Return the process-wide session of the engine, so that the pooled
+    connections are reused for the whole job.
+    """
+    with _sessions_lock:
+        session = _sessions.get(name)
+        if session is None:
+            log.debug('Create HTTP session: ', name)
+            session = Session(name)
+            _sessions[name] = session
+        return session
@@ -1,6 +1,9 @@
 import re
 import time
 import json
+import random
+import asyncio
+import sqlite3
 from types import GeneratorType
 
 from calibre.utils.localization import _  # type: ignore
@@ -10,19 +13,53 @@ from ..engines import GoogleFreeTranslateNew
 from ..engines.base import Base
 from ..engines.custom import CustomTranslate
 
-from .utils import log, sep, trim, dummy, traceback_error
+from .utils import log, sep, trim, dummy, traceback_error, retry_after
+from .cache import get_memory
 from .config import get_config
-from .exception import TranslationFailed, TranslationCanceled
-from .handler import Handler
+from .exception import (
+    TranslationFailed, TranslationCanceled, TranslationRetry)
+from .handler import Handler, RateLimiter
 
 
 load_translations()  # type: ignore
 
 
+def trie_pattern(words):
+    """Build a regular expression matching any of the words, which is
+    nested by common prefixes like a trie. The text is scanned once however
+    many words there are, and the longest word wins at each position.
+    """
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = None
+
+    def build(node):
+        is_end = '' in node
+        branches = [
+            re.escape(char) + build(child)
+            for char, child in node.items() if char != '']
+        if len(branches) < 1:
+            return ''
+        pattern = branches[0] if len(branches) == 1 \
+            else '(?:%s)' % '|'.join(branches)
+        if is_end:
+            # Greedy, so the longer word is tried first.
+            pattern = '(?:%s)?' % pattern
+        return pattern
+
+    return build(trie)
+
+
 class Glossary:
     def __init__(self, placeholder):
         self.placeholder = placeholder
         self.glossary = []
+        self.replacements = {}
+        self.replace_pattern = None
+        self.restore_pattern = None
 
     def load_from_file(self, path):
         content = None
@@ -38,19 +75,46 @@ class Glossary:
             group = group.split('\n')
             self.glossary.append(
                 (group[0], group[0] if len(group) < 2 else group[1]))
+        self.compile()
 
-    def replace(self, content):
+    def compile(self):
+        """Compile the glossary once for the whole job, so that both of the
+        replacement and the restoration take a single pass on the content.
+        """
+        replacements = {}
         for wid, words in enumerate(self.glossary):
-            replacement = self.placeholder[0].format(format(wid, '06'))
-            content = content.replace(words[0], replacement)
-        return content
+            # The first one takes effect if a word occurs more than once.
+            if words[0] and words[0] not in replacements:
+                replacements[words[0]] = self.placeholder[0].format(
+                    format(wid, '06'))
+        self.replacements = replacements
+        self.replace_pattern = None
+        if len(replacements) > 0:
+            self.replace_pattern = re.compile(trie_pattern(replacements))
+        self.restore_pattern = re.compile(
+            self.placeholder[1].format(r'(?P<wid>\d{6})'))
+
+    def replace(self, content):
+        if self.restore_pattern is None:
+            self.compile()
+        if self.replace_pattern is None:
+            return content
+        return self.replace_pattern.sub(
+            lambda match: self.replacements[match[0]], content)
+
+    def _restore_word(self, match):
+        wid = int(match['wid'])
+        if wid < len(self.glossary):
+            return self.glossary[wid][1]
+        return match[0]
 
     def restore(self, content):
-        for wid, words in enumerate(self.glossary):
-            pattern = self.placeholder[1].format(format(wid, '06'))
-            # Eliminate the impact of backslashes on substitution.
-            content = re.sub(pattern, lambda _: words[1], content)
-        return content
+        if len(self.glossary) < 1:
+            return content
+        if self.restore_pattern is None:
+            self.compile()
+        # The function also eliminates the impact of backslashes.
+        return self.restore_pattern.sub(self._restore_word, content)
 
 
 class ProgressBar:
@@ -72,21 +136,28 @@ class ProgressBar:
 
 
 class Translation:
+    retry_interval = 5.0
+    max_retry_interval = 120.0
+
     def __init__(self, translator, glossary):
         self.translator = translator
         self.glossary = glossary
 
         self.fresh = False
         self.batch = False
+        self.memory = None
         self.progress = dummy
         self.log = dummy
         self.streaming = dummy
         self.callback = dummy
+        self.bulk_callback = dummy
         self.cancel_request = dummy
 
         self.total = 0
+        self.duplicates = {}
         self.progress_bar = ProgressBar()
         self.abort_count = 0
+        self.rate_limiter = RateLimiter()
 
     def set_fresh(self, fresh):
         self.fresh = fresh
@@ -94,6 +165,9 @@ class Translation:
     def set_batch(self, batch):
         self.batch = batch
 
+    def set_memory(self, memory):
+        self.memory = memory
+
     def set_progress(self, progress):
         self.progress = progress
 
@@ -106,6 +180,12 @@ class Translation:
     def set_callback(self, callback):
         self.callback = callback
 
+    def set_bulk_callback(self, callback):
+        """Set the callback receiving the processed paragraphs in groups,
+        e.g. to save them within one transaction.
+        """
+        self.bulk_callback = callback
+
     def set_cancel_request(self, cancel_request):
         self.cancel_request = cancel_request
 
@@ -114,54 +194,155 @@ class Translation:
         return self.translator.max_error_count > 0 and \
             self.abort_count >= self.translator.max_error_count
 
-    def translate_text(self, row, text, retry=0, interval=0):
+    def get_retry_interval(self, retry, error):
+        """Honour the delay requested by the service on HTTP 429/503 if any,
+        up to the maximum retry interval, otherwise back off exponentially
+        with jitter.
+        """
+        while error is not None:
+            status = getattr(error, 'status', None) or \
+                getattr(error, 'code', None)
+            if status in (429, 503):
+                interval = retry_after(getattr(error, 'headers', None))
+                if interval is not None:
+                    return round(min(self.max_retry_interval, interval), 1)
+            error = error.__cause__ or error.__context__
+        interval = min(
+            self.max_retry_interval, self.retry_interval * 2 ** (retry - 1))
+        return round(random.uniform(interval / 2, interval), 1)
+
+    def _raise_failure(self, row, text, retry, error):
+        """Decide how to proceed with the failed request. It must be called
+        while handling the error.
+        """
+        if self.cancel_request() or self.need_stop():
+            raise TranslationCanceled(_('Translation canceled.'))
+        self.abort_count += 1
+        message = _('Failed to retrieve data from translate engine API.')
+        if retry >= self.translator.request_attempt:
+            raise TranslationFailed('{}\n{}'.format(message, str(error)))
+        retry += 1
+        interval = self.get_retry_interval(retry, error)
+        # Logging any errors that occur during translation.
+        logged_text = text[:200] + '...' if len(text) > 200 else text
+        error_messages = [
+            sep(), _('Original: {}').format(logged_text), sep('┈'),
+            _('Status: Failed {} times / Will be retried in {} seconds')
+            .format(retry, interval), sep('┈'), _('Error: {}')
+            .format(traceback_error())]
+        if row >= 0:
+            error_messages.insert(1, _('Row: {}').format(row))
+        self.log('\n'.join(error_messages), True)
+        if self.translator.match_error(str(error)):
+            raise TranslationCanceled(_('Translation canceled.'))
+        raise TranslationRetry(str(error), interval)
+
+    def translate_text(self, row, text, retry=0):
         """Translation engine service error code documentation:
         * https://cloud.google.com/apis/design/errors
         * https://www.deepl.com/docs-api/api-access/error-handling/
         * https://platform.openai.com/docs/guides/error-codes/api-errors
         * https://ai.youdao.com/DOCSIRMA/html/trans/api/wbfy/index.html
         * https://api.fanyi.baidu.com/doc/21
+
+        Failed requests are not retried here; TranslationRetry is raised to
+        let the handler reschedule the paragraph without holding a worker.
         """
         if self.cancel_request():
             raise TranslationCanceled(_('Translation canceled.'))
+        if self.rate_limiter.is_enabled():
+            self.rate_limiter.wait(self.translator.estimate_tokens(text))
         try:
             translation = self.translator.translate(text)
             self.abort_count = 0
             return translation
         except Exception as e:
-            if self.cancel_request() or self.need_stop():
-                raise TranslationCanceled(_('Translation canceled.'))
-            self.abort_count += 1
-            message = _('Failed to retrieve data from translate engine API.')
-            if retry >= self.translator.request_attempt:
-                raise TranslationFailed('{}\n{}'.format(message, str(e)))
-            retry += 1
-            interval += 5
-            # Logging any errors that occur during translation.
-            logged_text = text[:200] + '...' if len(text) > 200 else text
-            error_messages = [
-                sep(), _('Original: {}').format(logged_text), sep('┈'),
-                _('Status: Failed {} times / Sleeping for {} seconds')
-                .format(retry, interval), sep('┈'), _('Error: {}')
-                .format(traceback_error())]
-            if row >= 0:
-                error_messages.insert(1, _('Row: {}').format(row))
-            self.log('\n'.join(error_messages), True)
-            if self.translator.match_error(str(e)):
-                raise TranslationCanceled(_('Translation canceled.'))
-            time.sleep(interval)
-            return self.translate_text(row, text, retry, interval)
+            self._raise_failure(row, text, retry, e)
 
-    def translate_paragraph(self, paragraph):
+    async def translate_text_async(self, row, text, retry=0):
+        if self.cancel_request():
+            raise TranslationCanceled(_('Translation canceled.'))
+        if self.rate_limiter.is_enabled():
+            await asyncio.sleep(self.rate_limiter.reserve(
+                self.translator.estimate_tokens(text)))
+        try:
+            translation = await self.translator.translate_async(text)
+            self.abort_count = 0
+            return translation
+        except Exception as e:
+            self._raise_failure(row, text, retry, e)
+
+    def translate_texts(self, row, texts, retry=0):
+        """Translate the texts within one request, which is only for the
+        engine supporting batch.
+        """
+        if self.cancel_request():
+            raise TranslationCanceled(_('Translation canceled.'))
+        if self.rate_limiter.is_enabled():
+            self.rate_limiter.wait(
+                sum(map(self.translator.estimate_tokens, texts)))
+        try:
+            translations = self.translator.translate_batch(texts)
+            self.abort_count = 0
+            return translations
+        except Exception as e:
+            self._raise_failure(row, '\n'.join(texts), retry, e)
+
+    async def translate_texts_async(self, row, texts, retry=0):
+        if self.cancel_request():
+            raise TranslationCanceled(_('Translation canceled.'))
+        if self.rate_limiter.is_enabled():
+            await asyncio.sleep(self.rate_limiter.reserve(
+                sum(map(self.translator.estimate_tokens, texts))))
+        try:
+            translations = await self.translator.translate_batch_async(texts)
+            self.abort_count = 0
+            return translations
+        except Exception as e:
+            self._raise_failure(row, '\n'.join(texts), retry, e)
+
+    def get_memory_translation(self, paragraph):
+        """The translation memory is optional, so its failures, e.g. being
+        locked by another job, are logged instead of failing the paragraph.
+        """
+        try:
+            return self.memory.get(
+                paragraph.original, self.translator.name,
+                self.translator.get_target_lang())
+        except sqlite3.Error as e:
+            self.log(_('Failed to look up translation memory: {}')
+                     .format(e), True)
+            return None
+
+    def update_memory(self, paragraphs):
+        try:
+            self.memory.add_paragraphs(
+                paragraph for paragraph in paragraphs
+                if paragraph.error is None and not paragraph.is_cache)
+        except sqlite3.Error as e:
+            self.log(_('Failed to update translation memory: {}')
+                     .format(e), True)
+
+    def _prepare_paragraph(self, paragraph):
+        """Return the text to translate, or None if the cache can be used."""
         if self.cancel_request():
             raise TranslationCanceled(_('Translation canceled.'))
         if paragraph.translation and not self.fresh:
             paragraph.is_cache = True
-            return
+            return None
+        if self.memory is not None and not self.fresh:
+            translation = self.get_memory_translation(paragraph)
+            if translation is not None:
+                paragraph.translation = translation
+                paragraph.engine_name = self.translator.name
+                paragraph.target_lang = self.translator.get_target_lang()
+                paragraph.is_cache = True
+                return None
         self.streaming('')
         self.streaming(_('Translating...'))
-        text = self.glossary.replace(paragraph.original)
-        translation = self.translate_text(paragraph.row, text)
+        return self.glossary.replace(paragraph.original)
+
+    def _complete_paragraph(self, paragraph, translation):
         # Process streaming text
         if isinstance(translation, GeneratorType):
             if self.total == 1:
@@ -187,33 +368,199 @@ class Translation:
         paragraph.target_lang = self.translator.get_target_lang()
         paragraph.is_cache = False
 
-    def process_translation(self, paragraph):
-        self.progress(
-            self.progress_bar.length, _('Translating: {}/{}').format(
-                self.progress_bar.count, self.progress_bar.total))
+    def _prepare_paragraphs(self, paragraphs):
+        """Return the paragraphs not using the cache and their texts."""
+        pending, texts = [], []
+        for paragraph in paragraphs:
+            text = self._prepare_paragraph(paragraph)
+            if text is not None:
+                pending.append(paragraph)
+                texts.append(text)
+        return pending, texts
+
+    def _complete_paragraphs(self, paragraphs, translations):
+        for paragraph, translation in zip(paragraphs, translations):
+            self._complete_paragraph(paragraph, translation)
+
+    def translate_paragraphs(self, paragraphs):
+        pending, texts = self._prepare_paragraphs(paragraphs)
+        if len(pending) < 1:
+            return
+        retry = max(paragraph.retry for paragraph in pending)
+        try:
+            translations = self.translate_texts(pending[0].row, texts, retry)
+        except TranslationRetry:
+            for paragraph in pending:
+                paragraph.retry = retry + 1
+            raise
+        self._complete_paragraphs(pending, translations)
+
+    async def translate_paragraphs_async(self, paragraphs):
+        pending, texts = self._prepare_paragraphs(paragraphs)
+        if len(pending) < 1:
+            return
+        retry = max(paragraph.retry for paragraph in pending)
+        try:
+            translations = await self.translate_texts_async(
+                pending[0].row, texts, retry)
+        except TranslationRetry:
+            for paragraph in pending:
+                paragraph.retry = retry + 1
+            raise
+        self._complete_paragraphs(pending, translations)
 
+    def translate_paragraph(self, paragraph):
+        # A list of paragraphs is packed by the batching.
+        if isinstance(paragraph, list):
+            return self.translate_paragraphs(paragraph)
+        text = self._prepare_paragraph(paragraph)
+        if text is None:
+            return
+        try:
+            translation = self.translate_text(
+                paragraph.row, text, paragraph.retry)
+        except TranslationRetry:
+            paragraph.retry += 1
+            raise
+        self._complete_paragraph(paragraph, translation)
+
+    async def translate_paragraph_async(self, paragraph):
+        if isinstance(paragraph, list):
+            return await self.translate_paragraphs_async(paragraph)
+        text = self._prepare_paragraph(paragraph)
+        if text is None:
+            return
+        try:
+            translation = await self.translate_text_async(
+                paragraph.row, text, paragraph.retry)
+        except TranslationRetry:
+            paragraph.retry += 1
+            raise
+        self._complete_paragraph(paragraph, translation)
+
+    def _process_paragraph(self, paragraph, processed, messages):
+        count = self.progress_bar.count
         self.streaming(paragraph)
         self.callback(paragraph)
+        processed.append(paragraph)
 
         row = paragraph.row
         original = paragraph.original.strip()
         if paragraph.error is None:
-            self.log(sep())
+            messages.append(sep())
             if row >= 0:
-                self.log(_('Row: {}').format(row))
-            self.log(_('Original: {}').format(original))
-            self.log(sep('┈'))
+                messages.append(_('Row: {}').format(row))
+            messages.append(_('Original: {}').format(original))
+            messages.append(sep('┈'))
             message = _('Translation: {}')
             if paragraph.is_cache:
                 message = _('Translation (Cached): {}')
-            self.log(message.format(paragraph.translation.strip()))
+            messages.append(message.format(paragraph.translation.strip()))
+
+        # Share the result with the paragraphs of the same original text.
+        for duplicate in self.duplicates.pop(paragraph, []):
+            duplicate.translation = paragraph.translation
+            duplicate.engine_name = paragraph.engine_name
+            duplicate.target_lang = paragraph.target_lang
+            duplicate.is_cache = paragraph.is_cache
+            duplicate.error = paragraph.error
+            count = self._process_paragraph(duplicate, processed, messages)
+        return count
+
+    def process_translations(self, paragraphs):
+        """Process the translated paragraphs in a group, reporting the
+        progress and the log once for all of them.
+        """
+        processed, messages = [], []
+        count = 0
+        for paragraph in paragraphs:
+            count = self._process_paragraph(paragraph, processed, messages)
+        self.progress(
+            self.progress_bar.length, _('Translating: {}/{}').format(
+                count, self.progress_bar.total))
+        self.bulk_callback(processed)
+        if self.memory is not None:
+            self.update_memory(processed)
+        if len(messages) > 0:
+            self.log('\n'.join(messages))
+
+    def process_translation(self, paragraph):
+        self.process_translations([paragraph])
+
+    def merge_duplicates(self, paragraphs):
+        """Keep only the first one of the paragraphs to be translated with
+        the same original text, e.g. repeated headings, scene breaks. The
+        others are kept aside to share its translation.
+        """
+        self.duplicates = {}
+        originals = {}
+        for paragraph in paragraphs:
+            if paragraph.translation and not self.fresh:
+                yield paragraph
+                continue
+            first = originals.get(paragraph.original)
+            if first is None:
+                originals[paragraph.original] = paragraph
+                yield paragraph
+                continue
+            self.duplicates.setdefault(first, []).append(paragraph)
+
+    def create_batches(self, paragraphs):
+        """Pack the paragraphs to be translated into lists within the item
+        and character limits of the engine, so that the short paragraphs
+        (e.g. headings, captions) take far fewer requests. The paragraphs
+        using the cache are left as they are.
+        """
+        size = self.translator.batch_size
+        characters = self.translator.batch_characters
+        batch, length = [], 0
+        for paragraph in paragraphs:
+            if paragraph.translation and not self.fresh:
+                yield paragraph
+                continue
+            if len(batch) > 0 and (len(batch) >= size or (
+                    length + len(paragraph.original) > characters)):
+                yield batch if len(batch) > 1 else batch[0]
+                batch, length = [], 0
+            batch.append(paragraph)
+            length += len(paragraph.original)
+        if len(batch) > 0:
+            yield batch if len(batch) > 1 else batch[0]
+
+    def log_memory_stats(self):
+        if self.memory is None or self.memory.lookups < 1:
+            return
+        self.log(_(
+            'Translation memory: {} hits in {} lookups, hit rate {}%').format(
+                self.memory.hits, self.memory.lookups,
+                self.memory.hit_rate()))
+
+    def log_session_stats(self):
+        stats = self.translator.session.stats()
+        if stats['requests'] < 1:
+            return
+        self.log(_(
+            'Connection pool: {} requests, reuse ratio {}, {} handshakes '
+            'avoided').format(
+                stats['requests'], stats['reuse_ratio'],
+                stats['handshakes_avoided']))
 
     def handle(self, paragraphs=[]):
         start_time = time.time()
         char_count = 0
-        for paragraph in paragraphs:
-            self.total += 1
-            char_count += len(paragraph.original)
+        # The session outlives the job, report only the requests of this one.
+        self.translator.session.reset_stats()
+
+        def count(paragraphs):
+            nonlocal char_count
+            for paragraph in paragraphs:
+                self.total += 1
+                char_count += len(paragraph.original)
+                yield paragraph
+
+        # Count the paragraphs and merge the duplicates in one pass, which
+        # accepts the paragraphs streamed from the cache.
+        items = list(self.merge_duplicates(count(paragraphs)))
 
         self.log(sep())
         self.log(_('Start to translate ebook content'))
@@ -224,18 +571,42 @@ class Translation:
         if self.total < 1:
             raise Exception(_('There is no content need to translate.'))
         self.progress_bar.load(self.total)
+        # All the workers share the quota of the translation service.
+        self.rate_limiter = RateLimiter(
+            self.translator.requests_per_minute,
+            self.translator.tokens_per_minute)
+
+        # Keep the threaded transport to stream a single translation live.
+        translate_paragraph = self.translate_paragraph
+        if self.translator.async_transport and self.total > 1:
+            translate_paragraph = self.translate_paragraph_async
+
+        duplicate_count = self.total - len(items)
+        if duplicate_count > 0:
+            self.log(_('Duplicate count: {}').format(duplicate_count))
+        if self.translator.support_batch():
+            items = list(self.create_batches(items))
+            self.log(_('Request count: {}').format(len(items)))
 
         handler = Handler(
-            paragraphs, self.translator.concurrency_limit,
-            self.translate_paragraph, self.process_translation,
-            self.translator.request_interval)
-        handler.handle()
+            items, self.translator.concurrency_limit,
+            translate_paragraph, self.process_translations,
+            self.translator.request_interval,
+            self.translator.adaptive_concurrency)
+        try:
+            handler.handle()
+        finally:
+            # Keep the translations of a failed or canceled job as well.
+            if self.memory is not None:
+                self.memory.close()
 
         self.log(sep())
         if self.batch and self.need_stop():
             raise Exception(_('Translation failed.'))
         consuming = round((time.time() - start_time) / 60, 2)
         self.log(_('Time consuming: {} minutes').format(consuming))
+        self.log_session_stats()
+        self.log_memory_stats()
         self.log(_('Translation completed.'))
         self.progress(1, _('Translation completed.'))
 
@@ -284,6 +655,8 @@ def get_translation(translator, log=None):
     if config.get('glossary_enabled'):
         glossary.load_from_file(config.get('glossary_path'))
     translation = Translation(translator, glossary)
+    if config.get('cache_enabled') and config.get('memory_enabled'):
+        translation.set_memory(get_memory())
     if get_config().get('log_translation'):
         translation.set_logging(log)
     return translation
@@ -3,12 +3,14 @@ import os
 import sys
 import ssl
 import socket
+import time
 import hashlib
 import traceback
 from types import ModuleType
 from typing import Generator
 from subprocess import Popen
 from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
 
 from mechanize import Browser, Request, HTTPError  # type: ignore
 from mechanize._response import response_seek_wrapper as Response  # type: ignore
@@ -19,6 +21,8 @@ from calibre.utils.logging import Log  # type: ignore
 from ..vendor import socks
 from ..vendor.cssselect import GenericTranslator, SelectorError
 
+from .exception import HTTPRequestError
+
 
 ns = {'x': 'http://www.w3.org/1999/xhtml'}
 is_test = 'unittest' in sys.modules
@@ -69,16 +73,38 @@ def uid(*args):
     return md5.hexdigest()
 
 
+def fingerprint(path, block_size=65536, blocks=16):
+    """Identify the file by its size and the content of evenly sampled
+    blocks, which does not need to read the whole of a large file.
+    """
+    size = os.path.getsize(path)
+    md5 = hashlib.md5(str(size).encode('utf-8'))
+    with open(path, 'rb') as file:
+        if size <= block_size * blocks:
+            md5.update(file.read())
+        else:
+            step = (size - block_size) // (blocks - 1)
+            for index in range(blocks):
+                file.seek(index * step)
+                md5.update(file.read(block_size))
+    return md5.hexdigest()
+
+
+whitespace_pattern = re.compile(r'\s+')
+# The \t, \n and \r are excluded, which are white spaces combined already.
+control_pattern = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\xa0\xad]')
+
+
 def trim(text):
-    # Replace \xa0 with whitespace to be compatible with Python 2.x.
-    text = re.sub(u'\u00a0|\u3000', ' ', text)
-    # Remove the \x07 from the translation generated by some engine.
-    text = re.sub(u'\u200b|\ufeff', '', text)
-    # Combine multiple white spaces into a single space.
-    text = re.sub(r'\s+', ' ', text)
+    # Remove the \x07 from the translation generated by some engine, before
+    # combining the white spaces around it.
+    if '\u200b' in text or '\ufeff' in text:
+        text = text.replace('\u200b', '').replace('\ufeff', '')
+    # Combine multiple white spaces into a single space, including the \xa0
+    # and \u3000.
+    text = whitespace_pattern.sub(' ', text)
     # Remove all potential non-printable characters.
-    text = re.sub(r'(?![\n\r\t])[\x00-\x1f\x7f-\xa0\xad]', '', text)
-    return text.strip()
+    return control_pattern.sub('', text).strip()
 
 
 def chunk(items, length=0):
@@ -153,9 +179,58 @@ def traceback_error():
     return traceback.format_exc(chain=False).strip()
 
 
+def parse_duration(value: str) -> float | None:
+    """Parse a delay like "20", "1.5", "20ms", "6m0s", an epoch timestamp or
+    an HTTP date into the seconds from now.
+    """
+    value = value.strip()
+    try:
+        seconds = float(value)
+        # Treat large numbers as epoch timestamps (x-ratelimit-reset).
+        return seconds - time.time() if seconds > 1e9 else seconds
+    except ValueError:
+        pass
+    units = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if parts and ''.join(number + unit for number, unit in parts) == value:
+        return sum(float(number) * units[unit] for number, unit in parts)
+    try:
+        return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def retry_after(headers) -> float | None:
+    """Get the seconds to wait before retrying from the response headers,
+    e.g. Retry-After or the rate limit reset headers.
+    """
+    if headers is None:
+        return None
+    value = headers.get('retry-after-ms')
+    if value is not None and value.strip().isdigit():
+        return int(value) / 1000
+    delays = []
+    for name in ('retry-after', 'x-ratelimit-reset',
+                 'x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens'):
+        value = headers.get(name)
+        if value is not None:
+            delay = parse_duration(value)
+            if delay is not None:
+                delays.append(max(0.0, delay))
+        # Retry-After takes precedence over the rate limit headers.
+        if name == 'retry-after' and delays:
+            break
+    return max(delays) if delays else None
+
+
 def request(
         url, data=None, headers={}, method='GET', timeout=30, proxy_uri=None,
-        raw_object=False) -> Response | str | None:
+        raw_object=False, session=None) -> Response | str | None:
+    # Reuse the keep-alive connections of the engine session if available.
+    if session is not None:
+        return session.request(
+            url, data, headers=headers, method=method, timeout=timeout,
+            proxy_uri=proxy_uri, raw_object=raw_object)
     br = Browser()
     br.set_handle_robots(False)
 
@@ -194,7 +269,9 @@ def request(
             return response
         return response.read().decode('utf-8').strip()
     except HTTPError as e:
-        raise Exception(traceback_error() + '\n\n' + e.read().decode('utf-8'))
+        raise HTTPRequestError(
+            traceback_error() + '\n\n' + e.read().decode('utf-8'),
+            e.code, getattr(e, 'hdrs', None))
 
 
 @contextmanager
@@ -260,6 +260,22 @@ class TranslationSetting(QDialog):
         merge_enabled.clicked.connect(
             lambda checked: self.config.update(merge_enabled=checked))
 
+        # Parallel Extraction
+        parallel_group = QGroupBox(
+            '%s %s' % (_('Parallel Extraction'), _('(Beta)')))
+        parallel_layout = QHBoxLayout(parallel_group)
+        parallel_extraction = QCheckBox(_('Enable'))
+        parallel_layout.addWidget(parallel_extraction)
+        parallel_layout.addWidget(QLabel(_(
+            'Extract the content of large ebooks with multiple processes.')))
+        parallel_layout.addStretch(1)
+        layout.addWidget(parallel_group)
+
+        parallel_extraction.setChecked(
+            self.config.get('parallel_extraction'))
+        parallel_extraction.clicked.connect(
+            lambda checked: self.config.update(parallel_extraction=checked))
+
         # Network Proxy
         proxy_group = QGroupBox(_('Network Proxy'))
         proxy_layout = QHBoxLayout()
@@ -338,8 +354,22 @@ class TranslationSetting(QDialog):
         cache_group = QGroupBox(_('Cache'))
         cache_layout = QHBoxLayout(cache_group)
         cache_enabled = QCheckBox(_('Enable'))
+        memory_enabled = QCheckBox(_('Share across books'))
+        memory_enabled.setToolTip(_(
+            'Reuse the translations of the same text from other ebooks '
+            'translated with the same engine and target language.'))
+        cache_size_limit = QSpinBox()
+        cache_size_limit.setRange(0, 999999)
+        cache_size_limit.setSuffix(' MB')
+        cache_size_limit.setSpecialValueText(_('Unlimited'))
+        cache_size_limit.setToolTip(_(
+            'Remove the least recently used caches when their total size '
+            'exceeds the limit, except the pinned ones.'))
         cache_manage = QLabel(_('Manage'))
         cache_layout.addWidget(cache_enabled)
+        cache_layout.addWidget(memory_enabled)
+        cache_layout.addWidget(QLabel(_('Size limit')))
+        cache_layout.addWidget(cache_size_limit)
         cache_layout.addStretch(1)
         cache_layout.addWidget(cache_manage)
         misc_layout.addWidget(cache_group, 1)
@@ -353,6 +383,14 @@ class TranslationSetting(QDialog):
         cache_enabled.setChecked(self.config.get('cache_enabled'))
         cache_enabled.toggled.connect(
             lambda checked: self.config.update(cache_enabled=checked))
+        memory_enabled.setChecked(self.config.get('memory_enabled'))
+        memory_enabled.setEnabled(cache_enabled.isChecked())
+        memory_enabled.toggled.connect(
+            lambda checked: self.config.update(memory_enabled=checked))
+        cache_enabled.toggled.connect(memory_enabled.setEnabled)
+        cache_size_limit.setValue(self.config.get('cache_size_limit'))
+        cache_size_limit.valueChanged.connect(
+            lambda value: self.config.update(cache_size_limit=value))
 
         # Job Log
         log_group = QGroupBox(_('Job Log'))
@@ -459,6 +497,11 @@ class TranslationSetting(QDialog):
         request_group = QGroupBox(_('HTTP Request'))
         concurrency_limit = QSpinBox()
         concurrency_limit.setRange(0, 999999)
+        adaptive_concurrency = QCheckBox(_('Adaptive'))
+        adaptive_concurrency.setToolTip(_(
+            'Adjust the number of concurrent requests automatically within '
+            'the concurrency limit, according to the latency and rate '
+            'limit errors.'))
         request_interval = QDoubleSpinBox()
         request_interval.setRange(0, 999999)
         request_interval.setDecimals(1)
@@ -467,11 +510,35 @@ class TranslationSetting(QDialog):
         request_timeout = QDoubleSpinBox()
         request_timeout.setRange(0, 999999)
         request_timeout.setDecimals(1)
+        requests_per_minute = QSpinBox()
+        requests_per_minute.setRange(0, 999999)
+        requests_per_minute.setToolTip(_('0 means unlimited.'))
+        tokens_per_minute = QSpinBox()
+        tokens_per_minute.setRange(0, 99999999)
+        tokens_per_minute.setToolTip(_(
+            '0 means unlimited. Count characters for the translation '
+            'services charged by characters.'))
+        async_transport = QCheckBox(_('Enable'))
+        async_transport.setToolTip(_(
+            'Send concurrent requests from a single thread, which supports '
+            'a much higher concurrency limit. SOCKS5 proxies still use '
+            'threads.'))
+        batch_size = QSpinBox()
+        batch_size.setToolTip(_(
+            'The maximum number of paragraphs to be translated within one '
+            'request. Only some of the engines support it.'))
         request_layout = QFormLayout(request_group)
-        request_layout.addRow(_('Concurrency limit'), concurrency_limit)
+        concurrency_layout = QHBoxLayout()
+        concurrency_layout.addWidget(concurrency_limit, 1)
+        concurrency_layout.addWidget(adaptive_concurrency)
+        request_layout.addRow(_('Concurrency limit'), concurrency_layout)
         request_layout.addRow(_('Interval (seconds)'), request_interval)
         request_layout.addRow(_('Attempt times'), request_attempt)
         request_layout.addRow(_('Timeout (seconds)'), request_timeout)
+        request_layout.addRow(_('Requests per minute'), requests_per_minute)
+        request_layout.addRow(_('Tokens per minute'), tokens_per_minute)
+        request_layout.addRow(_('Asynchronous requests'), async_transport)
+        request_layout.addRow(_('Batch size'), batch_size)
         layout.addWidget(request_group)
 
         # Abort Translation
@@ -492,6 +559,9 @@ class TranslationSetting(QDialog):
         self.disable_wheel_event(request_attempt)
         self.disable_wheel_event(request_interval)
         self.disable_wheel_event(request_timeout)
+        self.disable_wheel_event(requests_per_minute)
+        self.disable_wheel_event(tokens_per_minute)
+        self.disable_wheel_event(batch_size)
 
         # GenAI Setting
         genai_group = QGroupBox(_('Fine-tuning'))
@@ -732,6 +802,14 @@ class TranslationSetting(QDialog):
             if value is None:
                 value = self.current_engine.concurrency_limit
             concurrency_limit.setValue(value)
+            value = config.get('adaptive_concurrency')
+            if value is None:
+                value = self.current_engine.adaptive_concurrency
+            adaptive_concurrency.setChecked(value)
+            value = config.get('async_transport')
+            if value is None:
+                value = self.current_engine.async_transport
+            async_transport.setChecked(value)
             value = config.get('request_interval')
             if value is None:
                 value = self.current_engine.request_interval
@@ -744,18 +822,43 @@ class TranslationSetting(QDialog):
             if value is None:
                 value = self.current_engine.request_timeout
             request_timeout.setValue(float(value))
+            value = config.get('requests_per_minute')
+            if value is None:
+                value = self.current_engine.requests_per_minute
+            requests_per_minute.setValue(value)
+            value = config.get('tokens_per_minute')
+            if value is None:
+                value = self.current_engine.tokens_per_minute
+            tokens_per_minute.setValue(value)
+            # The batch size can not exceed the limit of the engine.
+            batch_size.setRange(1, self.current_engine.batch_size)
+            batch_size.setEnabled(self.current_engine.batch_size > 1)
+            value = config.get('batch_size')
+            if value is None:
+                value = self.current_engine.batch_size
+            batch_size.setValue(value)
             value = config.get('max_error_count')
             if value is None:
                 value = self.current_engine.max_error_count
             max_error_count.setValue(value)
             concurrency_limit.valueChanged.connect(
                 lambda value: config.update(concurrency_limit=value))
+            adaptive_concurrency.toggled.connect(
+                lambda checked: config.update(adaptive_concurrency=checked))
+            async_transport.toggled.connect(
+                lambda checked: config.update(async_transport=checked))
             request_interval.valueChanged.connect(
                 lambda value: config.update(request_interval=round(value, 1)))
             request_attempt.valueChanged.connect(
                 lambda value: config.update(request_attempt=value))
             request_timeout.valueChanged.connect(
                 lambda value: config.update(request_timeout=round(value, 1)))
+            requests_per_minute.valueChanged.connect(
+                lambda value: config.update(requests_per_minute=value))
+            tokens_per_minute.valueChanged.connect(
+                lambda value: config.update(tokens_per_minute=value))
+            batch_size.valueChanged.connect(
+                lambda value: config.update(batch_size=value))
             max_error_count.valueChanged.connect(
                 lambda value: config.update(max_error_count=value))
             # Show GenAI preferences
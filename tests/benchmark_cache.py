@@ -0,0 +1,106 @@
+"""Benchmark the writes of the translation cache for a book of 20,000
+paragraphs, which is not a part of the test suite. Run it with:
+
+    calibre-debug test.py benchmark_cache.py
+"""
+
+import os
+import time
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from ..lib.cache import TranslationCache
+
+
+class BenchmarkTranslationCache(unittest.TestCase):
+    paragraph_count = 20000
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.count = 0
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_cache(self):
+        self.count += 1
+        file_path = os.path.join(self.temp_dir.name, '%s.db' % self.count)
+        with patch.object(TranslationCache, '_path', return_value=file_path):
+            cache = TranslationCache('benchmark', False)
+        cache.save([
+            (pid, 'md5_%s' % pid, 'raw', 'original %s' % pid)
+            for pid in range(self.paragraph_count)])
+        paragraphs = cache.all_paragraphs()
+        for paragraph in paragraphs:
+            paragraph.translation = 'translation %s' % paragraph.id
+            paragraph.engine_name = 'Google'
+            paragraph.target_lang = 'Chinese'
+        return cache, paragraphs
+
+    def measure(self, cache, write):
+        start_time = time.perf_counter()
+        write()
+        cache.close()
+        return time.perf_counter() - start_time
+
+    def test_writes(self):
+        # The previous behaviour: rollback journal, a commit for each row.
+        cache, paragraphs = self.create_cache()
+        cache.cursor.execute('PRAGMA journal_mode=DELETE')
+        cache.cursor.execute('PRAGMA synchronous=FULL')
+        previous = self.measure(cache, lambda: [
+            cache.update_paragraph(paragraph) for paragraph in paragraphs])
+
+        cache, paragraphs = self.create_cache()
+        wal = self.measure(cache, lambda: [
+            cache.update_paragraph(paragraph) for paragraph in paragraphs])
+
+        cache, paragraphs = self.create_cache()
+        bulk = self.measure(cache, lambda: [
+            cache.update_paragraphs(paragraphs[i:i + 100])
+            for i in range(0, len(paragraphs), 100)])
+
+        print('\n%-40s %10s' % ('%s paragraphs' % self.paragraph_count, 's'))
+        for name, seconds in (
+                ('rollback journal, commit per row', previous),
+                ('WAL, commit per row', wal),
+                ('WAL, commit per 100 rows', bulk)):
+            print('%-40s %10.3f' % (name, seconds))
+
+    def test_search(self):
+        file_path = os.path.join(self.temp_dir.name, 'search.db')
+        with patch.object(TranslationCache, '_path', return_value=file_path):
+            cache = TranslationCache('benchmark', False)
+        text = 'The quick brown fox jumps over the lazy dog %s. ' * 8
+        cache.save([
+            (pid, 'md5_%s' % pid, '<p class="c%s">%s</p>' % (
+                pid, text % ((pid,) * 8)), text % ((pid,) * 8))
+            for pid in range(self.paragraph_count)])
+        paragraphs = cache.all_paragraphs()
+        keywords = ['lazy dog 1', 'lazy dog 12', 'lazy dog 123',
+                    'class="c1234"']
+
+        # The previous behaviour: match the rows one by one for each key.
+        start_time = time.perf_counter()
+        for keyword in keywords:
+            [paragraph.id for paragraph in paragraphs
+             if keyword.lower() in paragraph.raw.lower()]
+        scan = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        cache.create_index()
+        index = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        for keyword in keywords:
+            cache.search(keyword, 'raw')
+        search = time.perf_counter() - start_time
+        cache.close()
+
+        print('\n%-40s %10s' % ('%s paragraphs' % self.paragraph_count, 's'))
+        for name, seconds in (
+                ('scan the raw, %s keys' % len(keywords), scan),
+                ('build the index', index),
+                ('look up the index, %s keys' % len(keywords), search)):
+            print('%-40s %10.3f' % (name, seconds))
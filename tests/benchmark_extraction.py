@@ -0,0 +1,233 @@
+"""Benchmark the extraction of the elements from synthetic books, which is
+not a part of the test suite. Run it with:
+
+    calibre-debug test.py benchmark_extraction.py
+"""
+
+import os
+import time
+import unittest
+from types import SimpleNamespace
+
+from lxml import etree  # type: ignore
+
+from ..lib.utils import ns, trim, create_xpath
+from ..lib.element import (
+    Extraction, PageElement, ElementHandler, get_name, get_string)
+from ..engines.base import Base
+
+
+class PreviousExtraction(Extraction):
+    """The previous implementation, which evaluates the patterns one by one
+    and scans the children of the elements repeatedly.
+    """
+    def is_priority(self, element):
+        for pattern in self.priority_patterns:
+            if element.xpath(pattern, namespaces=ns):
+                return True
+        return False
+
+    def is_inline_only(self, element):
+        for tag in self.non_inline_elements:
+            if element.find(f'./x:{tag}', namespaces=ns) is not None:
+                return False
+        return True
+
+    def need_ignore(self, element):
+        for pattern in self.ignore_patterns:
+            if element.xpath(pattern, namespaces=ns):
+                return True
+        return False
+
+    def extract_elements(self, page_id, root, elements=[]):
+        if self.need_ignore(root):
+            return []
+        for element in root.findall('./*'):
+            if self.need_ignore(element):
+                elements.append(PageElement(element, page_id, True))
+                continue
+            element_has_content = False
+            if self.is_priority(element) or self.is_inline_only(element) or (
+                    element.text is not None and trim(element.text) != ''):
+                element_has_content = True
+            else:
+                children = element.findall('./*')
+                if children and self.is_priority(element):
+                    element_has_content = True
+                else:
+                    for child in children:
+                        if child.tail is not None and trim(child.tail) != '':
+                            element_has_content = True
+                            break
+            if element_has_content:
+                elements.append(PageElement(
+                    element, page_id, self.need_ignore(element)))
+            else:
+                self.extract_elements(page_id, element, elements)
+        return elements if elements else [
+            PageElement(root, page_id, self.need_ignore(root))]
+
+
+class PreviousPageElement(PageElement):
+    """The previous implementation, which copies the element to remove the
+    noises and replace the reserved elements.
+    """
+    def get_content(self):
+        element_copy = self._element_copy()
+        if self.remove_pattern is not None:
+            for noise in element_copy.xpath(
+                    self.remove_pattern, namespaces=ns):
+                self._safe_remove(noise)
+        elements = []
+        if self.reserve_pattern is not None:
+            elements = element_copy.xpath(self.reserve_pattern, namespaces=ns)
+        for eid, element in enumerate(elements):
+            replacement = self.placeholder[0].format(format(eid, '05'))
+            if get_name(element) in ('sub', 'sup'):
+                parent = element.getparent()
+                if parent is not None and get_name(parent) == 'a' and \
+                        parent.text is None and element.tail is None and \
+                        len(parent.getchildren()) == 1:
+                    elements[eid] = element = parent
+            self.reserve_elements.append(get_string(element, True))
+            self._safe_remove(element, replacement)
+        return trim(''.join(element_copy.itertext()))
+
+
+def create_page(number):
+    sections = ''.join(
+        '<div class="section"><h2>Section %(n)s</h2>'
+        '<div class="content"><p>Paragraph <b>%(n)s</b> one.</p>'
+        '<p class="note">Paragraph %(n)s two.</p>'
+        '<div><span>Inline</span> text</div></div>'
+        '<pre>code %(n)s</pre><table><tr><td>cell</td></tr></table>'
+        '</div>' % {'n': n} for n in range(10))
+    markup = (
+        '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>Page'
+        '</title></head><body><div class="chapter">%s</div></body></html>'
+        % sections)
+    return SimpleNamespace(
+        id='page%s' % number, href='page%s.xhtml' % number,
+        data=etree.XML(markup))
+
+
+def create_chapter(number):
+    paragraphs = ''.join(
+        '<p>Chapter %s, paragraph %s: the <i>quick</i> brown fox jumps over '
+        'the lazy dog.<br/>It runs<sup>1</sup> away.</p>' % (number, n)
+        for n in range(60))
+    markup = (
+        '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>Chapter'
+        '</title></head><body><h1>Chapter %s</h1>%s</body></html>'
+        % (number, paragraphs))
+    return SimpleNamespace(
+        id='chapter%s' % number, href='chapter%s.xhtml' % number,
+        data=etree.XML(markup))
+
+
+class BenchmarkExtraction(unittest.TestCase):
+    page_count = 2000
+
+    def setUp(self):
+        self.pages = [create_page(number) for number in range(self.page_count)]
+        self.arguments = (
+            ['.note', 'div.content > div'], 'normal', 'text', [],
+            ['table', '.ignored'])
+
+    def measure(self, extraction_class):
+        extraction = extraction_class(self.pages, *self.arguments)
+        start_time = time.perf_counter()
+        elements = list(extraction.get_elements())
+        return time.perf_counter() - start_time, elements
+
+    def test_extraction(self):
+        previous, previous_elements = self.measure(PreviousExtraction)
+        current, elements = self.measure(Extraction)
+        self.assertEqual(
+            [(e.element, e.ignored) for e in previous_elements],
+            [(e.element, e.ignored) for e in elements])
+
+        print('\n%-40s %10s' % ('%s pages' % self.page_count, 's'))
+        for name, seconds in (
+                ('patterns one by one', previous),
+                ('compiled patterns, one pass', current)):
+            print('%-40s %10.3f' % (name, seconds))
+
+    def test_parallel(self):
+        chapters = [create_chapter(number) for number in range(1500)]
+        extraction = Extraction(chapters, *self.arguments)
+
+        def create_handler():
+            handler = ElementHandler(Base.placeholder, Base.separator, 'below')
+            handler.load_remove_rules()
+            handler.load_reserve_rules()
+            return handler
+
+        start_time = time.perf_counter()
+        serial = create_handler().prepare_original(
+            list(extraction.get_elements()))
+        timings = [('serial', time.perf_counter() - start_time)]
+
+        for processes in (2, 4, 8):
+            start_time = time.perf_counter()
+            elements = extraction.get_prepared_elements(
+                create_handler(), processes)
+            originals = create_handler().prepare_original(elements)
+            timings.append((
+                '%s processes' % processes,
+                time.perf_counter() - start_time))
+            self.assertEqual(serial, originals)
+
+        print('\n%-40s %10s' % (
+            '1,500 chapters, %s CPUs' % os.cpu_count(), 's'))
+        for name, seconds in timings:
+            print('%-40s %10.3f' % (name, seconds))
+
+    def measure_content(self, element_class, roots):
+        """Get the content of the elements twice, for the preparation and the
+        write-back, in a child process to measure its peak memory.
+        """
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            start_time = time.perf_counter()
+            for _ in range(2):
+                for root in roots:
+                    element = element_class(root, 'test')
+                    element.set_placeholder(Base.placeholder)
+                    element.set_remove_pattern(create_xpath(('rt', 'rp')))
+                    element.set_reserve_pattern(
+                        create_xpath(('img', 'br', 'sup', 'code')))
+                    element.get_content()
+            os.write(write, str(time.perf_counter() - start_time).encode())
+            os._exit(0)
+        os.close(write)
+        seconds = float(os.read(read, 64) or 0)
+        os.close(read)
+        usage = os.wait4(pid, 0)[2]
+        return seconds, usage.ru_maxrss / 1024
+
+    def test_get_content(self):
+        table = etree.XML(
+            '<table xmlns="http://www.w3.org/1999/xhtml">%s</table>' % ''.join(
+                '<tr><td>Cell %s%s</td><td>b c <ruby>d<rt>D</rt></ruby></td>'
+                '</tr>' % (n, '<img src="a.jpg"/>' if n % 10 == 0 else '')
+                for n in range(20000)))
+        chapter = etree.XML(
+            '<div xmlns="http://www.w3.org/1999/xhtml">%s</div>' % ''.join(
+                '<p>Paragraph %s%s with <b>bold</b> and <i>italic</i> text.'
+                '</p>' % (n, '<sup>1</sup>' if n % 10 == 0 else '')
+                for n in range(20000)))
+        results = [('baseline', *self.measure_content(PageElement, []))]
+        for name, element_class in (
+                ('deepcopy', PreviousPageElement),
+                ('read-only', PageElement)):
+            results.append((
+                name, *self.measure_content(element_class, [table, chapter])))
+
+        print('\n%-30s %10s %10s' % (
+            'table and chapter, 20,000 rows', 's', 'peak +MB'))
+        for name, seconds, memory in results:
+            print('%-30s %10.3f %10.1f' % (
+                name, seconds, memory - results[0][2]))
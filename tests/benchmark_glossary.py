@@ -0,0 +1,89 @@
+"""Benchmark the glossary with the growing number of words, which is not a
+part of the test suite. Run it with:
+
+    calibre-debug test.py benchmark_glossary.py
+"""
+
+import re
+import time
+import random
+import unittest
+
+from ..lib.translation import Glossary
+from ..engines.base import Base
+
+
+def replace_one_by_one(glossary, content):
+    """The previous implementation, which scans the content for each word."""
+    for wid, words in enumerate(glossary.glossary):
+        replacement = glossary.placeholder[0].format(format(wid, '06'))
+        content = content.replace(words[0], replacement)
+    return content
+
+
+def restore_one_by_one(glossary, content):
+    for wid, words in enumerate(glossary.glossary):
+        pattern = glossary.placeholder[1].format(format(wid, '06'))
+        content = re.sub(pattern, lambda _: words[1], content)
+    return content
+
+
+def random_word(minimum=3, maximum=10):
+    return ''.join(
+        random.choice('abcdefghijklmnopqrstuvwxyz')
+        for _ in range(random.randint(minimum, maximum)))
+
+
+class BenchmarkGlossary(unittest.TestCase):
+    paragraph_count = 200
+    word_count = 80
+
+    def setUp(self):
+        random.seed(0)
+
+    def create_glossary(self, size):
+        glossary = Glossary(Base.placeholder)
+        words = set()
+        while len(words) < size:
+            words.add('%s %s' % (random_word(), random_word()))
+        glossary.glossary = [(word, word.upper()) for word in words]
+        return glossary
+
+    def create_paragraphs(self, glossary):
+        paragraphs = []
+        for _ in range(self.paragraph_count):
+            words = []
+            for _ in range(self.word_count):
+                if random.random() < 0.05:
+                    words.append(random.choice(glossary.glossary)[0])
+                else:
+                    words.append(random_word())
+            paragraphs.append(' '.join(words))
+        return paragraphs
+
+    def measure(self, replace, restore, paragraphs):
+        start_time = time.perf_counter()
+        for paragraph in paragraphs:
+            restore(replace(paragraph))
+        return time.perf_counter() - start_time
+
+    def test_scaling(self):
+        print('\n%8s %12s %12s %12s' % (
+            'words', 'compile (s)', 'compiled (s)', 'one by one (s)'))
+        for size in (10, 100, 1000, 5000, 20000):
+            glossary = self.create_glossary(size)
+            paragraphs = self.create_paragraphs(glossary)
+            start_time = time.perf_counter()
+            glossary.compile()
+            compiling = time.perf_counter() - start_time
+            compiled = self.measure(
+                glossary.replace, glossary.restore, paragraphs)
+            # The previous implementation takes too long for large glossary.
+            one_by_one = '-'
+            if size <= 1000:
+                one_by_one = '%.4f' % self.measure(
+                    lambda content: replace_one_by_one(glossary, content),
+                    lambda content: restore_one_by_one(glossary, content),
+                    paragraphs)
+            print('%8d %12.4f %12.4f %12s' % (
+                size, compiling, compiled, one_by_one))
@@ -1,6 +1,35 @@
+import os
+import time
+import sqlite3
+import tempfile
 import unittest
+import multiprocessing
+from unittest.mock import patch, Mock
 
-from ...lib.cache import Paragraph
+from ...lib.cache import (
+    Paragraph, TranslationCache, TranslationMemory, CacheCatalog, compress,
+    decompress, evict_caches, get_cache, get_cache_id, lock_file)
+from ...lib.utils import uid
+
+
+module_name = 'calibre_plugins.ebook_translator.lib.cache'
+
+
+def use_cache(file_path, used, done):
+    with patch.object(TranslationCache, '_path', return_value=file_path):
+        cache = TranslationCache('test', marked=True)
+    used.set()
+    done.wait(30)
+    cache.close()
+
+
+def write_translations(file_path, ids):
+    with patch.object(TranslationCache, '_path', return_value=file_path):
+        cache = TranslationCache('test', False)
+    for id in ids:
+        cache.update(id, translation='T%s' % id)
+        cache.set_info('last', id)
+    cache.close()
 
 
 class TestParagraph(unittest.TestCase):
@@ -25,6 +54,23 @@ class TestParagraph(unittest.TestCase):
         self.paragraph.translation = 'A\n\nB\nC\n\n'
         self.assertFalse(self.paragraph.is_alignment('\n\n'))
 
+    def test_slots(self):
+        self.assertFalse(hasattr(self.paragraph, '__dict__'))
+        with self.assertRaises(AttributeError):
+            self.paragraph.unknown = 'test'
+
+    def test_lazy_raw_and_attributes(self):
+        raw = '<p>%s</p>' % ('a' * 200)
+        attributes = '{"class": "%s"}' % ('a' * 200)
+        paragraph = Paragraph(
+            1, 'a', compress(raw), 'a', attributes=compress(attributes))
+        self.assertIsInstance(paragraph._raw, bytes)
+        self.assertEqual(raw, paragraph.raw)
+        self.assertEqual(raw, paragraph._raw)
+        self.assertEqual({'class': 'a' * 200}, paragraph.get_attributes())
+        paragraph.raw = 'test'
+        self.assertEqual('test', paragraph.raw)
+
     def test_is_alignment(self):
         # Test with empty translation.
         self.paragraph.translation = None
@@ -75,3 +121,668 @@ class TestParagraph(unittest.TestCase):
         self.paragraph.translation = 'A\n\nB\nC'
         self.paragraph.do_aligment('\n\n')
         self.assertEqual('A\n\nB\n\nC', self.paragraph.translation)
+
+
+class TestTranslationMemory(unittest.TestCase):
+    def setUp(self):
+        self.memory = TranslationMemory(':memory:')
+
+    def tearDown(self):
+        self.memory.close()
+
+    def test_normalize(self):
+        self.assertEqual(
+            'a b\nc\n\nd', self.memory.normalize(' a \t b \n c\n\n d\n'))
+
+    def test_get_and_add(self):
+        self.assertIsNone(self.memory.get('Chapter 1', 'Google', 'zh'))
+        self.memory.add('Chapter 1', 'Google', 'zh', '第一章')
+        self.assertEqual(
+            '第一章', self.memory.get('  Chapter  1 ', 'Google', 'zh'))
+        self.assertIsNone(self.memory.get('Chapter 1', 'DeepL', 'zh'))
+        self.assertIsNone(self.memory.get('Chapter 1', 'Google', 'ja'))
+
+        self.memory.add('Chapter 1', 'Google', 'zh', '第 1 章')
+        self.assertEqual(
+            '第 1 章', self.memory.get('Chapter 1', 'Google', 'zh'))
+        self.assertEqual(5, self.memory.lookups)
+        self.assertEqual(2, self.memory.hits)
+        self.assertEqual(40.0, self.memory.hit_rate())
+
+    def test_add_paragraphs(self):
+        paragraphs = [
+            Mock(original='a', engine_name='Google', target_lang='zh',
+                 translation='A'),
+            Mock(original='b', engine_name='Google', target_lang='zh',
+                 translation=None)]
+        self.assertEqual(1, self.memory.add_paragraphs(paragraphs))
+        self.assertFalse(self.memory.connection.in_transaction)
+        self.assertEqual('A', self.memory.get('a', 'Google', 'zh'))
+        self.assertIsNone(self.memory.get('b', 'Google', 'zh'))
+        self.assertEqual(0, self.memory.add_paragraphs([]))
+
+
+class TestCompress(unittest.TestCase):
+    def test_compress(self):
+        self.assertIsNone(compress(None))
+        self.assertEqual('<p>a</p>', compress('<p>a</p>'))
+        text = '<p class="test">%s</p>' % ('a' * 200)
+        self.assertIsInstance(compress(text), bytes)
+        self.assertEqual(text, decompress(compress(text)))
+        self.assertEqual('<p>a</p>', decompress('<p>a</p>'))
+
+
+class TestCacheCatalog(unittest.TestCase):
+    def setUp(self):
+        self.catalog = CacheCatalog(':memory:')
+
+    def tearDown(self):
+        self.catalog.close()
+
+    def test_update(self):
+        self.catalog.update('a.db', title='A', size=10, last_used=1.0)
+        self.catalog.update('b.db', title='B', size=20, last_used=2.0)
+        self.catalog.update('a.db', size=30, last_used=3.0)
+        self.assertEqual(
+            [('a.db', 'A', None, None, None, 30, None, None, 3.0, 0, None),
+             ('b.db', 'B', None, None, None, 20, None, None, 2.0, 0, None)],
+            self.catalog.all())
+
+    def test_delete(self):
+        self.catalog.update('a.db', title='A')
+        self.catalog.update('b.db', title='B')
+        self.catalog.delete('a.db')
+        self.assertEqual(['b.db'], self.catalog.names())
+        self.catalog.clear()
+        self.assertEqual([], self.catalog.names())
+
+
+class TestTranslationCacheCatalog(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        cache_path = os.path.join(self.temp_dir.name, 'cache')
+        os.mkdir(cache_path)
+        for name, value in (
+                ('dir_path', self.temp_dir.name),
+                ('cache_path', cache_path)):
+            patcher = patch.object(TranslationCache, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_get_list(self):
+        cache = TranslationCache('test')
+        cache.save([(1, 'a', 'a', 'a'), (2, 'b', 'b', 'b')])
+        cache.set_info('title', 'Test')
+        cache.set_info('engine_name', 'Google')
+        cache.update(1, translation='A')
+        cache.close()
+
+        with patch.object(TranslationCache, '__init__') as mock_init:
+            caches = TranslationCache.get_list()
+        mock_init.assert_not_called()
+        self.assertEqual(1, len(caches))
+        self.assertEqual(
+            ('Test', 'Google', None, 0), caches[0][:4])
+        self.assertEqual((50.0, 'test.db'), (caches[0][5], caches[0][-1]))
+
+    def test_get_list_rebuild(self):
+        cache = TranslationCache('test')
+        cache.set_info('title', 'Test')
+        cache.close()
+        os.remove(os.path.join(self.temp_dir.name, 'catalog.db'))
+        self.assertEqual('Test', TranslationCache.get_list()[0][0])
+
+        TranslationCache._remove_file('test.db')
+        self.assertEqual([], TranslationCache.get_list())
+
+    @patch(module_name + '.get_config')
+    @patch(module_name + '.time')
+    def test_touch(self, mock_time, mock_get_config):
+        mock_get_config().get.return_value = True
+        mock_time.time.return_value = 100.0
+        get_cache('test').cursor.close()
+        catalog = TranslationCache.get_catalog()
+        self.assertEqual(
+            [('test.db', None, 100.0)], catalog.least_recently_used())
+        catalog.close()
+
+    @patch(module_name + '.time')
+    def test_open_and_close_without_touch(self, mock_time):
+        mock_time.time.return_value = 100.0
+        cache = TranslationCache('test')
+        cache.touch()
+        cache.close()
+        mock_time.time.return_value = 200.0
+        # E.g. listed, compacted or exported by the Cache Manager.
+        TranslationCache('test').close()
+        TranslationCache.migrate_all()
+        catalog = TranslationCache.get_catalog()
+        self.assertEqual(
+            [('test.db', 100.0)],
+            [(name, last_used) for name, _, last_used
+             in catalog.least_recently_used()])
+        catalog.close()
+
+    @patch(module_name + '.log')
+    @patch(module_name + '.time')
+    def test_evict(self, mock_time, mock_log):
+        for index, name in enumerate(('a', 'b', 'c', 'd', 'e')):
+            mock_time.time.return_value = float(index)
+            cache = TranslationCache(name)
+            cache.touch()
+            cache.close()
+        catalog = TranslationCache.get_catalog()
+        for name in catalog.names():
+            catalog.update(name, size=100)
+        catalog.close()
+        TranslationCache.pin('a.db')
+
+        self.assertEqual(
+            ['c.db', 'd.db'], TranslationCache.evict(300, keep=['b.db']))
+        self.assertEqual(
+            ['a.db', 'b.db', 'e.db'],
+            sorted(os.listdir(TranslationCache.cache_path)))
+        self.assertEqual(2, mock_log.info.call_count)
+
+    @patch(module_name + '.get_config')
+    def test_evict_caches(self, mock_get_config):
+        mock_get_config().get.return_value = 0
+        self.assertIsNone(evict_caches())
+
+        mock_get_config().get.return_value = 1
+        with patch.object(TranslationCache, 'evict') as mock_evict:
+            mock_evict.return_value = ['a.db']
+            self.assertEqual(['a.db'], evict_caches(['test.db']))
+        mock_evict.assert_called_once_with(1000 ** 2, ['test.db'])
+
+        with patch.object(TranslationCache, 'evict') as mock_evict, \
+                patch(module_name + '.log') as mock_log:
+            mock_evict.side_effect = PermissionError('any error')
+            self.assertIsNone(evict_caches())
+        mock_log.warning.assert_called_once_with(
+            'Failed to evict the caches: any error')
+
+    def test_sync_catalog_read_only(self):
+        file_path = os.path.join(TranslationCache.cache_path, 'legacy.db')
+        connection = sqlite3.connect(file_path)
+        connection.execute(
+            'CREATE TABLE cache(id UNIQUE, md5 UNIQUE, raw, original, '
+            'ignored, attributes, page, translation, engine_name, '
+            'target_lang)')
+        connection.execute(
+            'INSERT INTO cache VALUES (1, "a", "a", "a", 0, NULL, NULL, '
+            '"A", "Google", "zh")')
+        connection.execute('CREATE TABLE info(key UNIQUE, value)')
+        connection.execute('INSERT INTO info VALUES ("title", "Legacy")')
+        connection.commit()
+        connection.close()
+
+        self.assertEqual('Legacy', TranslationCache.get_list()[0][0])
+        # The cache is neither migrated nor switched to the write-ahead log.
+        connection = sqlite3.connect(file_path)
+        self.assertEqual(0, connection.execute(
+            'PRAGMA user_version').fetchone()[0])
+        self.assertEqual('delete', connection.execute(
+            'PRAGMA journal_mode').fetchone()[0])
+        connection.close()
+
+    def test_sync_catalog_remove_orphans(self):
+        TranslationCache('test').close()
+        for suffix in ('-wal', '-shm'):
+            for name in ('test.db', 'orphan.db'):
+                open(os.path.join(
+                    TranslationCache.cache_path, name + suffix), 'w').close()
+        self.assertEqual(1, len(TranslationCache.get_list()))
+        self.assertEqual(
+            ['test.db', 'test.db-shm', 'test.db-wal'],
+            sorted(os.listdir(TranslationCache.cache_path)))
+
+    def test_get_cache_id(self):
+        input_path = os.path.join(self.temp_dir.name, 'test.epub')
+        with open(input_path, 'wb') as file:
+            file.write(b'test')
+        legacy_id = uid(input_path + 'Google' + 'zh' + '2000')
+        cache = TranslationCache(legacy_id)
+        cache.set_info('title', 'Test')
+        cache.close()
+
+        identity = get_cache_id(input_path, 'Google', 'zh', '2000')
+        self.assertEqual(uid(uid('4', 'test') + 'Google' + 'zh' + '2000'),
+                         identity)
+        self.assertEqual(
+            ['%s.db' % identity],
+            [name for name in os.listdir(TranslationCache.cache_path)
+             if name.endswith('.db')])
+        caches = TranslationCache.get_list()
+        self.assertEqual(
+            [('Test', '%s.db' % identity)],
+            [(cache[0], cache[-1]) for cache in caches])
+
+        # The same ebook in another library shares the cache.
+        other_path = os.path.join(self.temp_dir.name, 'other.epub')
+        with open(other_path, 'wb') as file:
+            file.write(b'test')
+        self.assertEqual(
+            identity, get_cache_id(other_path, 'Google', 'zh', '2000'))
+
+    def test_get_cache_id_edited(self):
+        input_path = os.path.join(self.temp_dir.name, 'test.epub')
+        with open(input_path, 'wb') as file:
+            file.write(b'test')
+        identity = get_cache_id(input_path, 'Google', 'zh', '2000')
+        cache = TranslationCache(identity)
+        cache.save([(0, 'm0', 'a', 'a')])
+        cache.close()
+
+        with open(input_path, 'wb') as file:
+            file.write(b'edited')
+        new_identity = get_cache_id(input_path, 'Google', 'zh', '2000')
+        self.assertNotEqual(identity, new_identity)
+        self.assertEqual(
+            ['%s.db' % new_identity],
+            [name for name in os.listdir(TranslationCache.cache_path)
+             if name.endswith('.db')])
+        cache = TranslationCache(new_identity)
+        self.assertFalse(cache.is_fresh())
+        self.assertTrue(cache.is_outdated())
+        cache.close()
+
+    def test_remove(self):
+        TranslationCache('test').close()
+        self.assertTrue(TranslationCache.remove('test.db'))
+        catalog = TranslationCache.get_catalog()
+        self.assertEqual([], catalog.names())
+        catalog.close()
+
+    def test_remove_in_use(self):
+        cache = TranslationCache('test', marked=True)
+        self.assertEqual(['test.db'], TranslationCache.names_in_use())
+        self.assertFalse(TranslationCache.remove('test.db'))
+        self.assertEqual(['test.db'], TranslationCache.clean())
+        self.assertEqual([], TranslationCache.evict(0))
+        self.assertFalse(TranslationCache.move(self.temp_dir.name + '2'))
+        self.assertEqual(1, len(TranslationCache.get_list()))
+
+        cache.close()
+        # The marker is removed once the cache is not in use.
+        self.assertEqual(
+            ['test.db'], os.listdir(TranslationCache.cache_path))
+        self.assertTrue(TranslationCache.remove('test.db'))
+
+    def test_remove_with_stale_marker(self):
+        TranslationCache('test').close()
+        # Left by a crashed job.
+        open(os.path.join(
+            TranslationCache.cache_path, 'test.db.use'), 'w').close()
+        self.assertTrue(TranslationCache.remove('test.db'))
+        self.assertEqual([], os.listdir(TranslationCache.cache_path))
+
+    def test_adopt_in_use(self):
+        cache = TranslationCache('source', marked=True)
+        self.assertFalse(TranslationCache.adopt('source', 'identity'))
+        self.assertFalse(os.path.exists(
+            os.path.join(TranslationCache.cache_path, 'identity.db')))
+        cache.close()
+        self.assertTrue(TranslationCache.adopt('source', 'identity'))
+
+
+class TestTranslationCache(unittest.TestCase):
+    def setUp(self):
+        with patch.object(TranslationCache, '_path', return_value=':memory:'):
+            self.cache = TranslationCache('test', False)
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_update_paragraphs(self):
+        self.cache.save([(1, 'a', 'a', 'a'), (2, 'b', 'b', 'b')])
+        paragraphs = self.cache.all_paragraphs()
+        for paragraph in paragraphs:
+            paragraph.translation = paragraph.original.upper()
+            paragraph.engine_name = 'Google'
+            paragraph.target_lang = 'zh'
+        self.cache.update_paragraphs(paragraphs)
+
+        self.assertEqual(
+            [(1, 'A', 'Google', 'zh'), (2, 'B', 'Google', 'zh')],
+            [(p.id, p.translation, p.engine_name, p.target_lang)
+             for p in self.cache.all_paragraphs()])
+
+    def test_iter_paragraphs(self):
+        self.cache.save([
+            (1, 'a', 'a', 'a'), (2, 'b', 'b', 'b', True), (3, 'c', 'c', 'c')])
+        self.cache.update(3, translation='C')
+        paragraphs = self.cache.iter_paragraphs(size=1)
+        self.assertIsInstance(next(paragraphs), Paragraph)
+        self.assertEqual([3], [p.id for p in paragraphs])
+
+        self.cache.set_cache_only(True)
+        self.assertEqual(
+            [3], [p.id for p in self.cache.iter_paragraphs()])
+
+    def test_iter_paragraphs_while_updating(self):
+        self.cache.save([(1, 'a', 'a', 'a'), (2, 'b', 'b', 'b')])
+        ids = []
+        for paragraph in self.cache.iter_paragraphs(size=1):
+            ids.append(paragraph.id)
+            paragraph.translation = paragraph.original
+            self.cache.update_paragraph(paragraph)
+        self.assertEqual([1, 2], ids)
+
+    def test_fresh(self):
+        self.assertTrue(self.cache.is_fresh())
+        self.cache.save([(1, 'a', 'a', 'a')])
+        # Saved only once if the cache is not outdated.
+        self.cache.fresh = False
+        self.cache.save([(1, 'b', 'b', 'b')])
+        self.assertEqual('a', self.cache.paragraph(1).original)
+
+    @patch(module_name + '.log', Mock())
+    def test_sync(self):
+        self.cache.save([
+            (0, 'm0', 'a', 'a'), (1, 'm1', 'b', 'b'),
+            (2, 'm2', 'c', 'c', True), (3, 'm3', 'd', 'd')])
+        self.cache.update([0, 1], translation='A', engine_name='Google')
+        self.cache.update(3, translation='D', engine_name='Google')
+        self.cache.ignore(1)
+        self.cache.fresh = False
+        self.cache.set_info('outdated', True)
+
+        # A new paragraph inserted in the front, and "d" is changed.
+        self.cache.save([
+            (0, 'm0', 'x', 'x'), (1, 'm1', 'a', 'a'), (2, 'm2', 'b', 'b'),
+            (3, 'm3', 'c', 'c', True), (4, 'm4', 'e', 'e')])
+        self.assertFalse(self.cache.is_outdated())
+        self.assertEqual(
+            [(0, 'x', None, 0), (1, 'a', 'A', 0), (2, 'b', 'A', 1),
+             (3, 'c', None, 1), (4, 'e', None, 0)],
+            [(p.id, p.original, p.translation, p.ignored)
+             for p in self.cache.get_paragraphs(range(5))])
+
+    def test_sync_unchanged(self):
+        self.cache.save([(0, 'm0', 'a', 'a'), (1, 'm1', 'b', 'b')])
+        self.assertEqual(
+            0, self.cache.sync([(0, 'm0', 'a', 'a'), (1, 'm1', 'b', 'b')]))
+
+    def test_commit_one_by_one(self):
+        with patch.object(self.cache, 'connection') as mock_connection:
+            self.cache.set_info('title', 'test')
+            self.cache.set_info('engine_name', 'Google')
+        self.assertEqual(2, mock_connection.commit.call_count)
+
+    def test_update_paragraphs_commit_once(self):
+        self.cache.save([(0, 'm0', 'a', 'a'), (1, 'm1', 'b', 'b')])
+        paragraphs = self.cache.all_paragraphs()
+        for paragraph in paragraphs:
+            paragraph.translation = 'A'
+        with patch.object(self.cache, 'connection') as mock_connection:
+            self.cache.update_paragraphs(paragraphs)
+        mock_connection.commit.assert_called_once_with()
+
+    def test_done(self):
+        self.cache.set_info('title', 'test')
+        with patch.object(self.cache, 'close') as mock_close:
+            self.cache.persistence = True
+            self.cache.done()
+        mock_close.assert_called_once_with()
+        self.cache.persistence = False
+
+    def test_compress_raw_and_attributes(self):
+        raw = '<p>%s</p>' % ('a' * 200)
+        attributes = '{"class": "%s"}' % ('a' * 200)
+        self.cache.save([(1, 'a', raw, 'a' * 200, False, attributes)])
+        stored = self.cache.cursor.execute(
+            'SELECT raw, attributes FROM cache').fetchone()
+        self.assertIsInstance(stored[0], bytes)
+        self.assertIsInstance(stored[1], bytes)
+        paragraph = self.cache.paragraph(1)
+        self.assertEqual(raw, paragraph.raw)
+        self.assertEqual(attributes, paragraph.attributes)
+        self.assertEqual(2, self.cache.get_version())
+
+    def test_search(self):
+        raw = '<p class="note">%s</p>' % ('Hello World ' * 20)
+        self.cache.save([
+            (1, 'a', raw, 'Hello World ' * 20), (2, 'b', '<p>b</p>', 'Bye'),
+            (3, 'c', '<p>c</p>', 'Say "hello"')])
+        self.cache.update(2, translation='再见 World')
+        self.assertEqual({1, 3}, self.cache.search('HELLO'))
+        self.assertEqual({3}, self.cache.search('"hello"'))
+        self.assertEqual({1}, self.cache.search('class="note', 'raw'))
+        self.assertEqual({2}, self.cache.search('再见 w', 'translation'))
+        self.assertIsNone(self.cache.search('he'))
+        self.assertRaises(ValueError, self.cache.search, 'abc', 'md5')
+
+        # Kept in sync with the changes of the cache table.
+        self.cache.update(2, translation='Hello')
+        self.cache.delete([1])
+        self.cache.add(4, 'd', '<p>d</p>', 'hello again')
+        self.assertEqual({2}, self.cache.search('hello', 'translation'))
+        self.assertEqual({3, 4}, self.cache.search('hello'))
+        self.assertEqual(set(), self.cache.search('class="note', 'raw'))
+        self.assertEqual(
+            [], self.cache.cursor.execute(
+                "INSERT INTO search(search, rank) VALUES ('integrity-check', "
+                "0)").fetchall())
+
+    def test_search_unsupported(self):
+        cursor = self.cache.cursor
+
+        def execute(sql, *args):
+            if sql.startswith('CREATE VIRTUAL TABLE'):
+                raise sqlite3.OperationalError('no such module: fts5')
+            return cursor.execute(sql, *args)
+
+        self.cache.save([(1, 'a', '<p>a</p>', 'Hello')])
+        with patch.object(self.cache, 'cursor') as mock_cursor:
+            mock_cursor.execute.side_effect = execute
+            self.assertIsNone(self.cache.search('hello'))
+        self.assertFalse(self.cache.has_index())
+        self.cache.add(2, 'b', '<p>b</p>', 'Hello')
+        self.assertEqual({1, 2}, self.cache.search('hello'))
+
+
+class TestTranslationCacheMigration(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, 'test.db')
+        dir_path = patch.object(
+            TranslationCache, 'dir_path', self.temp_dir.name)
+        dir_path.start()
+        self.addCleanup(dir_path.stop)
+        connection = sqlite3.connect(self.file_path)
+        connection.execute(
+            'CREATE TABLE cache('
+            'id UNIQUE, md5 UNIQUE, raw, original, ignored, '
+            'attributes DEFAULT NULL, page DEFAULT NULL,'
+            'translation DEFAULT NULL, engine_name DEFAULT NULL, '
+            'target_lang DEFAULT NULL)')
+        connection.execute(
+            'INSERT INTO cache VALUES (1, "a", ?, "a", 0, NULL, "p1", "A", '
+            '"Google", "zh")', ('<p>%s</p>' % ('a' * 200),))
+        connection.commit()
+        connection.close()
+        with patch.object(
+                TranslationCache, '_path', return_value=self.file_path):
+            self.cache = TranslationCache('test')
+
+    def tearDown(self):
+        self.cache.close()
+        self.temp_dir.cleanup()
+
+    def test_migrate(self):
+        self.assertEqual(0, self.cache.get_version())
+        self.assertTrue(self.cache.migrate())
+        self.assertEqual(2, self.cache.get_version())
+        self.assertFalse(self.cache.migrate())
+
+        paragraph = self.cache.paragraph(1)
+        self.assertEqual(
+            (1, 'a', '<p>%s</p>' % ('a' * 200), 'a', 0, 'p1', 'A'),
+            (paragraph.id, paragraph.md5, paragraph.raw, paragraph.original,
+             paragraph.ignored, paragraph.page, paragraph.translation))
+        self.assertIn('INTEGER PRIMARY KEY', self.cache.cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE name='cache'").fetchone()[0])
+
+    def test_migrate_interrupted(self):
+        with patch.object(
+                self.cache, '_encode', side_effect=KeyboardInterrupt()):
+            with self.assertRaises(KeyboardInterrupt):
+                self.cache.migrate()
+        self.assertEqual(0, self.cache.get_version())
+        self.assertFalse(self.cache._has_table('cache_legacy'))
+        self.assertEqual('A', self.cache.paragraph(1).translation)
+
+        self.assertTrue(self.cache.migrate())
+        self.assertEqual(2, self.cache.get_version())
+        self.assertEqual('A', self.cache.paragraph(1).translation)
+
+    def test_migrate_recover_legacy_table(self):
+        # Left by an interrupted migration of the previous versions.
+        self.cache.cursor.execute('ALTER TABLE cache RENAME TO cache_legacy')
+        self.cache._create_table()
+        self.cache.connection.commit()
+        self.cache.close()
+        with patch.object(
+                TranslationCache, '_path', return_value=self.file_path):
+            self.cache = TranslationCache('test')
+        self.assertEqual(2, self.cache.get_version())
+        self.assertTrue(self.cache.is_fresh())
+
+        self.assertTrue(self.cache.migrate())
+        self.assertFalse(self.cache._has_table('cache_legacy'))
+        self.assertFalse(self.cache.is_fresh())
+        self.assertEqual('A', self.cache.paragraph(1).translation)
+        self.assertFalse(self.cache.migrate())
+
+    @patch(module_name + '.get_config')
+    def test_get_cache_without_vacuum(self, mock_get_config):
+        mock_get_config().get.return_value = True
+        with patch.object(
+                TranslationCache, '_path', return_value=self.file_path), \
+                patch.object(TranslationCache, 'migrate') as mock_migrate:
+            get_cache('test').close()
+        mock_migrate.assert_called_once_with()
+
+    def test_migrate_all(self):
+        with patch.object(
+                TranslationCache, 'cache_path', self.temp_dir.name):
+            with patch.object(
+                    TranslationCache, '_path', return_value=self.file_path):
+                count, before, after = TranslationCache.migrate_all()
+        self.assertEqual(1, count)
+        self.assertIsInstance(before, float)
+        self.assertIsInstance(after, float)
+        self.assertEqual(2, self.cache.get_version())
+
+
+class TestLockFile(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'test.db')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_lock_file(self):
+        with lock_file(self.path):
+            self.assertTrue(os.path.exists(self.path + '.lock'))
+            with self.assertRaises(TimeoutError):
+                with lock_file(self.path, timeout=0.1):
+                    pass
+        self.assertFalse(os.path.exists(self.path + '.lock'))
+
+    def test_take_over_stale_lock(self):
+        with open(self.path + '.lock', 'w') as file:
+            file.write('0')
+        stale_time = time.time() - 3600
+        os.utime(self.path + '.lock', (stale_time, stale_time))
+        with lock_file(self.path, timeout=0.1):
+            pass
+        self.assertFalse(os.path.exists(self.path + '.lock'))
+
+
+@unittest.skipUnless(
+    'fork' in multiprocessing.get_all_start_methods(),
+    'The processes need to be forked.')
+class TestTranslationCacheProcesses(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, 'test.db')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_concurrent_writers(self):
+        with patch.object(
+                TranslationCache, '_path', return_value=self.file_path):
+            cache = TranslationCache('test', False)
+        count = 400
+        cache.save([(id, 'm%s' % id, 'a', 'a') for id in range(count)])
+
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(
+                target=write_translations,
+                args=(self.file_path, range(index, count, 4)))
+            for index in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+        self.assertEqual(
+            [0, 0, 0, 0], [process.exitcode for process in processes])
+
+        self.assertEqual(
+            ['T%s' % id for id in range(count)],
+            [p.translation for p in cache.all_paragraphs()])
+        cache.close()
+
+    def test_remove_in_use_by_another_process(self):
+        context = multiprocessing.get_context('fork')
+        used, done = context.Event(), context.Event()
+        process = context.Process(
+            target=use_cache, args=(self.file_path, used, done))
+        process.start()
+        self.assertTrue(used.wait(30))
+        self.assertFalse(TranslationCache._remove_path(self.file_path))
+        done.set()
+        process.join(60)
+        self.assertEqual(0, process.exitcode)
+        self.assertTrue(TranslationCache._remove_path(self.file_path))
+        self.assertEqual([], os.listdir(self.temp_dir.name))
+
+    @patch(module_name + '.default_cache_path')
+    def test_journal_mode(self, mock_default_cache_path):
+        mock_default_cache_path.return_value = TranslationCache.dir_path
+        with patch.object(
+                TranslationCache, '_path', return_value=self.file_path):
+            cache = TranslationCache('test', False)
+            self.assertEqual('wal', cache.cursor.execute(
+                'PRAGMA journal_mode').fetchone()[0])
+            cache.close()
+            # Keep the rollback journal on a custom cache path.
+            with patch.object(
+                    TranslationCache, 'dir_path', self.temp_dir.name):
+                cache = TranslationCache('test', False)
+            self.assertEqual('delete', cache.cursor.execute(
+                'PRAGMA journal_mode').fetchone()[0])
+            cache.close()
+
+    def test_update_paragraphs_release_write_lock(self):
+        with patch.object(
+                TranslationCache, '_path', return_value=self.file_path):
+            cache = TranslationCache('test', False)
+        cache.save([(0, 'm0', 'a', 'a')])
+        paragraphs = cache.all_paragraphs()
+        paragraphs[0].translation = 'A'
+        cache.update_paragraphs(paragraphs)
+        # Another writer can take the write lock of the file right away.
+        connection = sqlite3.connect(self.file_path, timeout=0)
+        connection.execute('BEGIN IMMEDIATE')
+        connection.rollback()
+        connection.close()
+        cache.close()
@@ -21,6 +21,8 @@ class TestFunction(unittest.TestCase):
             'proxy_type': 'http',
             'proxy_setting': {},
             'cache_enabled': True,
+            'memory_enabled': True,
+            'cache_size_limit': 0,
             'cache_path': None,
             'log_translation': True,
             'show_notification': True,
@@ -43,6 +45,7 @@ class TestFunction(unittest.TestCase):
             'glossary_path': None,
             'merge_enabled': False,
             'merge_length': 1800,
+            'parallel_extraction': False,
             'ebook_metadata': {},
             'search_paths': [],
         }
@@ -11,8 +11,8 @@ from ...lib.cache import Paragraph
 from ...lib.element import (
     get_string, get_name, Extraction, ElementHandler, ElementHandlerMerge,
     Element, SrtElement, PgnElement, TocElement, PageElement, MetadataElement,
-    get_srt_elements, get_pgn_elements, get_toc_elements,
-    get_metadata_elements)
+    PreparedPageElement, get_srt_elements, get_pgn_elements, get_toc_elements,
+    get_metadata_elements, get_page_elements)
 from ...engines import DeeplFreeTranslate
 from ...engines.base import Base
 
@@ -470,6 +470,25 @@ class TestPageElement(unittest.TestCase):
         self.assertEqual('<sup>[2]</sup>', element.reserve_elements[2])
         self.assertEqual('<sup>[3]</sup>', element.reserve_elements[3])
 
+    def test_get_content_read_only(self):
+        element = PageElement(etree.XML(
+            b'<p xmlns="http://www.w3.org/1999/xhtml">a<!-- c --><code>b<rt>'
+            b'B</rt></code> c<ruby>d<rt>D</rt></ruby> <span>e<img src="x.jpg"'
+            b'/><br/></span>f<sup><a><sup>1</sup></a></sup></p>'), 'p1')
+        element.remove_pattern = create_xpath(('rt',))
+        element.reserve_pattern = create_xpath(('img', 'br', 'code', 'sup'))
+        element.placeholder = Base.placeholder
+        markup = etree.tostring(element.element)
+
+        self.assertEqual(
+            'a{{id_00000}} cd e{{id_00001}}{{id_00002}}f{{id_00003}}',
+            element.get_content())
+        self.assertEqual(
+            ['<code>b</code>', '<img src="x.jpg"></img>', '<br></br>',
+             '<sup><a><sup>1</sup></a></sup>', '<a><sup>1</sup></a>'],
+            element.reserve_elements)
+        self.assertEqual(markup, etree.tostring(element.element))
+
     def test_get_attributes(self):
         self.assertEqual('{"class": "abc"}', self.element.get_attributes())
 
@@ -955,6 +974,53 @@ class TestExtraction(unittest.TestCase):
         self.assertEqual('div', get_name(elements[1].get_name()))
         self.assertEqual('def', elements[1].get_content())
 
+    def test_get_prepared_elements(self):
+        self.page_1.data = etree.XML(
+            b'<html xmlns="http://www.w3.org/1999/xhtml"><body><div><p>a '
+            b'<code>b</code></p><!-- c --><p>1</p><pre>d</pre></div><div>'
+            b'<span>e</span></div></body></html>')
+        self.extraction.load_ignore_patterns()
+        handler = ElementHandler(Base.placeholder, Base.separator, 'below')
+        handler.load_reserve_rules()
+        serial = handler.prepare_original(
+            list(self.extraction.get_elements()))
+
+        self.assertIsNone(self.extraction.get_prepared_elements(handler, 2))
+        with patch.object(self.extraction, 'parallel_threshold', 1), \
+                patch(module_name + '.threading.active_count') as mock_count:
+            mock_count.return_value = 2
+            self.assertIsNone(
+                self.extraction.get_prepared_elements(handler, 2))
+            mock_count.return_value = 1
+            elements = self.extraction.get_prepared_elements(handler, 2)
+        handler = ElementHandler(Base.placeholder, Base.separator, 'below')
+        handler.load_reserve_rules()
+        self.assertEqual(serial, handler.prepare_original(elements))
+        self.assertIsInstance(elements[0], PreparedPageElement)
+        self.assertIs(
+            self.page_1.data.find('.//x:p', namespaces=ns),
+            elements[0].element)
+        self.assertEqual(['<code>b</code>'], elements[0].reserve_elements)
+
+    @patch(module_name + '.get_config')
+    def test_get_page_elements_parallel(self, mock_get_config):
+        config = {
+            'priority_rules': [], 'rule_mode': 'normal',
+            'filter_scope': 'text', 'parallel_extraction': False}
+        mock_get_config().get.side_effect = \
+            lambda key, default=None: config.get(key, default)
+        handler = ElementHandler(Base.placeholder, Base.separator, 'below')
+        pages = [self.page_3, self.page_2, self.page_1]
+        with patch.object(
+                Extraction, 'get_prepared_elements') as mock_prepared:
+            self.assertEqual(2, len(list(get_page_elements(pages, handler))))
+            mock_prepared.assert_not_called()
+
+            config['parallel_extraction'] = True
+            self.assertIs(
+                mock_prepared.return_value, get_page_elements(pages, handler))
+            mock_prepared.assert_called_once_with(handler)
+
     def test_load_priority_patterns(self):
         self.extraction.load_priority_patterns()
         self.assertEqual(9, len(self.extraction.priority_patterns))
@@ -981,6 +1047,20 @@ class TestExtraction(unittest.TestCase):
         self.extraction.load_ignore_patterns()
         self.assertEqual(4, len(self.extraction.ignore_patterns))
 
+    def test_compile_patterns(self):
+        self.assertIsNone(self.extraction.compile_patterns([]))
+
+        matcher = self.extraction.compile_patterns(
+            ['self::x:p', 'self::x:div[@id="a"] | self::x:span'])
+        for item, expected in (
+                ('<p xmlns="http://www.w3.org/1999/xhtml">a</p>', True),
+                ('<div xmlns="http://www.w3.org/1999/xhtml" id="a">a</div>',
+                 True),
+                ('<span xmlns="http://www.w3.org/1999/xhtml">a</span>', True),
+                ('<div xmlns="http://www.w3.org/1999/xhtml">a</div>', False)):
+            with self.subTest(item=item):
+                self.assertIs(expected, matcher(etree.XML(item)))
+
     def test_is_priority(self):
         self.extraction.priority_rules = ['.test']
         self.extraction.load_priority_patterns()
@@ -1007,6 +1087,22 @@ class TestExtraction(unittest.TestCase):
         div = '<div xmlns="http://www.w3.org/1999/xhtml"><div>a</div></div>'
         self.assertFalse(self.extraction.is_inline_only(etree.XML(div)))
 
+    def test_has_inline_content(self):
+        items = [
+            ('<div xmlns="http://www.w3.org/1999/xhtml"><span>a</span>'
+             '<!-- b --><i>c</i></div>', True),
+            ('<div xmlns="http://www.w3.org/1999/xhtml"><p>a</p> b</div>',
+             True),
+            ('<div xmlns="http://www.w3.org/1999/xhtml"><p>a</p>\n<div>b'
+             '</div></div>', False),
+            ('<div xmlns="http://www.w3.org/1999/xhtml"><span>a</span>'
+             '<p>b</p></div>', False)]
+        for item, expected in items:
+            with self.subTest(item=item):
+                self.assertIs(
+                    expected,
+                    self.extraction.has_inline_content(etree.XML(item)))
+
     def test_need_ignore(self):
         self.extraction.ignore_rules = ['table', 'p.a']
         self.extraction.load_ignore_patterns()
@@ -1,10 +1,11 @@
 import io
 import re
 import json
+import asyncio
 import unittest
 from pathlib import Path
 from types import GeneratorType
-from unittest.mock import patch, Mock
+from unittest.mock import patch, Mock, AsyncMock
 
 from mechanize import HTTPError  # type: ignore
 from mechanize._response import (  # type: ignore
@@ -62,18 +63,28 @@ class TestBase(unittest.TestCase):
         self.assertIsNone(Base.using_tip)
 
         self.assertEqual(0, Base.concurrency_limit)
+        self.assertFalse(Base.adaptive_concurrency)
+        self.assertFalse(Base.async_transport)
         self.assertEqual(0.0, Base.request_interval)
         self.assertEqual(3, Base.request_attempt)
         self.assertEqual(10.0, Base.request_timeout)
+        self.assertEqual(0, Base.requests_per_minute)
+        self.assertEqual(0, Base.tokens_per_minute)
         self.assertEqual(10, Base.max_error_count)
+        self.assertEqual(1, Base.batch_size)
+        self.assertEqual(5000, Base.batch_characters)
 
     @patch.dict(Base.config, {
         'api_keys': ['a', 'b', 'c'],
         'concurrency_limit': 5,
+        'adaptive_concurrency': True,
         'request_interval': 10,
         'request_attempt': 3,
         'request_timeout': 10,
-        'max_error_count': 20})
+        'requests_per_minute': 60,
+        'tokens_per_minute': 1000,
+        'max_error_count': 20,
+        'batch_size': 10})
     def test_create_translator(self):
         translator = Base()
 
@@ -91,10 +102,15 @@ class TestBase(unittest.TestCase):
         self.assertEqual('a', translator.api_key)
 
         self.assertEqual(5, translator.concurrency_limit)
+        self.assertTrue(translator.adaptive_concurrency)
         self.assertEqual(10, translator.request_interval)
         self.assertEqual(3, translator.request_attempt)
         self.assertEqual(10, translator.request_timeout)
+        self.assertEqual(60, translator.requests_per_minute)
+        self.assertEqual(1000, translator.tokens_per_minute)
         self.assertEqual(20, translator.max_error_count)
+        # The batch size can not exceed the limit of the engine.
+        self.assertEqual(1, translator.batch_size)
 
     def test_placeholder(self):
         marks = [
@@ -201,7 +217,8 @@ class TestBase(unittest.TestCase):
             url='https://example.com/api', data='{"text": "Hello World"}',
             headers={
                 'Authorization': 'Bearer a', 'Content-Type': 'application/json'
-            }, method='POST', timeout=10.0, proxy_uri=None, raw_object=False)
+            }, method='POST', timeout=10.0, proxy_uri=None, raw_object=False,
+            session=self.translator.session)
 
     @patch(module_name + '.base.request')
     def test_translate_with_stream(self, mock_request):
@@ -215,7 +232,8 @@ class TestBase(unittest.TestCase):
             url='https://example.com/api', data='{"text": "Hello World"}',
             headers={
                 'Authorization': 'Bearer a', 'Content-Type': 'application/json'
-            }, method='POST', timeout=10.0, proxy_uri=None, raw_object=True)
+            }, method='POST', timeout=10.0, proxy_uri=None, raw_object=True,
+            session=self.translator.session)
 
     @patch(module_name + '.base.request')
     def test_translate_with_http_error(self, mock_request):
@@ -344,6 +362,51 @@ class TestBase(unittest.TestCase):
         self.assertRegex(calls[1].args[0], 'any unexpected error')
         self.assertRegex(calls[2].args[0], 'any unexpected error')
 
+    def test_translate_async(self):
+        self.translator.stream = False
+        with patch.object(self.translator, 'session') as mock_session:
+            mock_session.request_async = AsyncMock(
+                return_value='{"text": "你好世界"}')
+            self.assertEqual(
+                '{"text": "你好世界"}',
+                asyncio.run(self.translator.translate_async('Hello World')))
+
+        mock_session.request_async.assert_awaited_once_with(
+            url='https://example.com/api', data='{"text": "Hello World"}',
+            headers={
+                'Authorization': 'Bearer a', 'Content-Type': 'application/json'
+            }, method='POST', timeout=10.0, proxy_uri=None, raw_object=False)
+
+    def test_translate_async_swap_api_keys(self):
+        self.translator.api_keys = ['b']
+        with patch.object(self.translator, 'session') as mock_session:
+            mock_session.request_async = AsyncMock(side_effect=[
+                Exception('HTTP Error 401: Unauthorized'), 'any result'])
+            self.assertEqual(
+                'any result',
+                asyncio.run(self.translator.translate_async('Hello World')))
+        self.assertEqual('b', self.translator.api_key)
+
+    def test_translate_async_with_error(self):
+        with patch.object(self.translator, 'session') as mock_session:
+            mock_session.request_async = AsyncMock(
+                side_effect=Exception('HTTP Error 409: any error'))
+            with self.assertRaises(UnexpectedResult) as cm:
+                asyncio.run(self.translator.translate_async('Hello World'))
+        self.assertRegex(str(cm.exception), 'HTTP Error 409: any error')
+
+    def test_translate_async_with_socks_proxy(self):
+        self.translator.set_proxy('socks5', '127.0.0.1', 1080)
+        with patch.object(self.translator, 'translate') as mock_translate:
+            mock_translate.return_value = 'any result'
+            self.assertEqual(
+                'any result',
+                asyncio.run(self.translator.translate_async('Hello World')))
+        mock_translate.assert_called_once_with('Hello World')
+
+    def test_estimate_tokens(self):
+        self.assertEqual(11, self.translator.estimate_tokens('Hello World'))
+
     def test_allow_raw(self):
         cases = (
             (True, False, True),
@@ -360,6 +423,44 @@ class TestBase(unittest.TestCase):
                 self.assertEqual(expected, self.translator.allow_raw())
 
 
+class TestBatchTranslate(unittest.TestCase):
+    def setUp(self):
+        self.translator = MockEngine()
+        self.translator.batch_size = 2
+        self.translator.get_batch_body = Mock(return_value='body')
+        self.translator.get_batch_result = Mock(return_value=['a', 'b'])
+
+    def test_support_batch(self):
+        self.assertTrue(self.translator.support_batch())
+        self.translator.stream = True
+        self.assertFalse(self.translator.support_batch())
+        self.translator.stream = False
+        self.translator.batch_size = 1
+        self.assertFalse(self.translator.support_batch())
+
+    @patch(module_name + '.base.request')
+    def test_translate_batch(self, mock_request):
+        mock_request.return_value = 'response'
+        self.assertEqual(['a', 'b'], self.translator.translate_batch(
+            ['A', 'B']))
+        self.translator.get_batch_body.assert_called_once_with(['A', 'B'])
+        self.translator.get_batch_result.assert_called_once_with('response')
+
+    @patch(module_name + '.base.request', Mock())
+    def test_translate_batch_mismatched(self):
+        with self.assertRaisesRegex(
+                UnexpectedResult, 'Expected 3 translations, but got 2.'):
+            self.translator.translate_batch(['A', 'B', 'C'])
+
+    def test_translate_batch_async(self):
+        self.translator.session = Mock()
+        self.translator.session.request_async = AsyncMock(
+            return_value='response')
+        self.assertEqual(['a', 'b'], asyncio.run(
+            self.translator.translate_batch_async(['A', 'B'])))
+        self.translator.get_batch_result.assert_called_once_with('response')
+
+
 class TestDeepl(unittest.TestCase):
     def setUp(self):
         DeeplTranslate.set_config({'api_keys': ['a', 'b', 'c']})
@@ -397,6 +498,18 @@ class TestDeepl(unittest.TestCase):
         with self.assertRaisesRegex(Exception, error):
             self.translator.translate('Hello World!')
 
+    @patch(module_name + '.base.request')
+    def test_translate_batch(self, mock_request):
+        mock_request.return_value = '{"translations":[' \
+            '{"text":"你好"},{"text":"世界"}]}'
+
+        self.assertEqual(
+            ['你好', '世界'],
+            self.translator.translate_batch(['Hello', 'World']))
+        self.assertEqual(
+            'text=Hello&text=World&target_lang=ZH&source_lang=EN',
+            mock_request.call_args[1]['data'])
+
 
 class TestChatgptTranslate(unittest.TestCase):
     def setUp(self):
@@ -461,6 +574,11 @@ class TestChatgptTranslate(unittest.TestCase):
             headers=self.translator.get_headers(),
             proxy_uri=self.translator.proxy_uri)
 
+    def test_estimate_tokens(self):
+        self.assertEqual(
+            (len(ChatgptTranslate.prompt) + 22) // 4 + 1,
+            self.translator.estimate_tokens('Hello World'))
+
     def test_get_body(self):
         model = 'gpt-4o'
         self.assertEqual(
@@ -518,7 +636,8 @@ class TestChatgptTranslate(unittest.TestCase):
 
         mock_request.assert_called_with(
             url=url, data=data, headers=headers, method='POST', timeout=60.0,
-            proxy_uri=None, raw_object=True)
+            proxy_uri=None, raw_object=True,
+            session=self.translator.session)
         self.assertIsInstance(result, GeneratorType)
         self.assertEqual('你好世界！', ''.join(result))
 
@@ -866,7 +985,8 @@ class TestAzureChatgptTranslate(unittest.TestCase):
 
         mock_request.assert_called_with(
             url=url, data=data, headers=headers, method='POST', timeout=60.0,
-            proxy_uri=None, raw_object=True)
+            proxy_uri=None, raw_object=True,
+            session=self.translator.session)
         self.assertIsInstance(result, GeneratorType)
         self.assertEqual('你好世界！', ''.join(result))
 
@@ -945,7 +1065,8 @@ class TestClaudeTranslate(unittest.TestCase):
 
         mock_request.assert_called_with(
             url=url, data=data, headers=headers, method='POST', timeout=30.0,
-            proxy_uri=None, raw_object=False)
+            proxy_uri=None, raw_object=False,
+            session=self.translator.session)
         self.assertEqual('你好世界！', result)
 
     @patch(module_name + '.anthropic.EbookTranslator')
@@ -1021,7 +1142,8 @@ data: {"type":"message_stop"}
 
         mock_request.assert_called_with(
             url=url, data=data, headers=headers, method='POST', timeout=30.0,
-            proxy_uri=None, raw_object=True)
+            proxy_uri=None, raw_object=True,
+            session=self.translator.session)
         self.assertIsInstance(result, GeneratorType)
         self.assertEqual('你好世界！', ''.join(result))
 
@@ -1157,7 +1279,8 @@ class TestCustom(unittest.TestCase):
             url='https://example.api', data=b'{"source": "en", "target": "zh",'
             b' "text": "Hello \\"World\\""}',
             headers={'Content-Type': 'application/json'}, method='POST',
-            timeout=10.0, proxy_uri=None, raw_object=False)
+            timeout=10.0, proxy_uri=None, raw_object=False,
+            session=translator.session)
         # XML response
         translator.response = 'response.text'
         mock_request.return_value = '<test>你好世界</test>'
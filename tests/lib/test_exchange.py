@@ -0,0 +1,188 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from ...lib.cache import TranslationCache, TranslationMemory
+from ...lib.exchange import (
+    iter_tmx, iter_jsonl, write_tmx, write_jsonl, export_cache, import_cache,
+    import_memory)
+
+
+class TestExchange(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        with patch.object(TranslationCache, '_path', return_value=':memory:'):
+            self.cache = TranslationCache('test', False)
+        self.cache.save([
+            (0, 'm0', '<p>a</p>', 'a'), (1, 'm1', '<p>b</p>', 'b'),
+            (2, 'm2', '<p>a</p>', 'a'), (3, 'm3', '<p>c</p>', 'c')])
+        self.cache.set_info('engine_name', 'Google')
+        self.cache.set_info('target_lang', 'Chinese')
+
+    def tearDown(self):
+        self.cache.close()
+        self.temp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def test_iter_tmx(self):
+        with open(self.path('test.tmx'), 'w', encoding='utf-8') as file:
+            file.write(
+                '<?xml version="1.0" encoding="UTF-8"?>'
+                '<tmx version="1.4"><header srclang="en-US"/><body>'
+                '<tu><tuv xml:lang="zh-CN"><seg>你好</seg></tuv>'
+                '<tuv xml:lang="en-US"><seg>Hello <bpt i="1">&lt;b&gt;'
+                '</bpt>world</seg></tuv></tu>'
+                '<tu><tuv xml:lang="en-US"><seg>Alone</seg></tuv></tu>'
+                '</body></tmx>')
+        # The native codes of the inline elements are not the text.
+        self.assertEqual(
+            [{'original': 'Hello world', 'translation': '你好'}],
+            list(iter_tmx(self.path('test.tmx'))))
+
+    def test_iter_tmx_target_variant(self):
+        with open(self.path('test.tmx'), 'w', encoding='utf-8') as file:
+            file.write(
+                '<?xml version="1.0" encoding="UTF-8"?>'
+                '<tmx version="1.4"><header srclang="*all*"/><body><tu>'
+                '<tuv xml:lang="en"><seg>Hello <hi>world</hi></seg></tuv>'
+                '<tuv xml:lang="ja"><seg>こんにちは</seg></tuv>'
+                '<tuv xml:lang="zh-TW"><seg>你好</seg></tuv>'
+                '</tu></body></tmx>')
+        for code, translation in (
+                (None, 'こんにちは'), ('zh-tw', '你好'), ('zh', '你好'),
+                ('ko', 'こんにちは')):
+            with self.subTest(code=code):
+                self.assertEqual(
+                    [{'original': 'Hello world', 'translation': translation}],
+                    list(iter_tmx(self.path('test.tmx'), code)))
+
+    def test_write_tmx(self):
+        segments = [
+            {'md5': 'm0', 'original': 'a & b', 'translation': 'A < B',
+             'target_lang': 'zh'},
+            {'original': 'c', 'translation': 'C', 'target_lang': None}]
+        write_tmx(self.path('test.tmx'), segments, source_lang='en')
+        with open(self.path('test.tmx'), encoding='utf-8') as file:
+            content = file.read()
+        self.assertIn('srclang="en"', content)
+        self.assertIn('<tuv xml:lang="zh"><seg>A &lt; B</seg></tuv>', content)
+        self.assertIn('<tuv xml:lang="und"><seg>C</seg></tuv>', content)
+        self.assertEqual(
+            [{'md5': 'm0', 'original': 'a & b', 'translation': 'A < B'},
+             {'original': 'c', 'translation': 'C'}],
+            list(iter_tmx(self.path('test.tmx'))))
+
+        write_tmx(self.path('test.tmx'), segments)
+        with open(self.path('test.tmx'), encoding='utf-8') as file:
+            content = file.read()
+        self.assertIn('srclang="*all*"', content)
+        self.assertIn('<tuv xml:lang="und"><seg>a &amp; b</seg>', content)
+
+    def test_write_jsonl(self):
+        segments = [{'original': 'a', 'translation': '甲'}]
+        write_jsonl(self.path('test.jsonl'), segments)
+        self.assertEqual(segments, list(iter_jsonl(self.path('test.jsonl'))))
+
+    def test_iter_jsonl_skip_malformed_lines(self):
+        with open(self.path('test.jsonl'), 'w', encoding='utf-8') as file:
+            file.write(
+                '{"original": "a", "translation": "A"}\n'
+                '{"original": "b"}\n'
+                '{"original": "c", "translation": null}\n'
+                '["d", "D"]\n'
+                '{"original": "e", \n'
+                '\n'
+                '{"original": "f", "translation": "F"}\n')
+        self.assertEqual(
+            [{'original': 'a', 'translation': 'A'},
+             {'original': 'f', 'translation': 'F'}],
+            list(iter_jsonl(self.path('test.jsonl'))))
+
+    def test_import_cache(self):
+        write_jsonl(self.path('test.jsonl'), [
+            {'original': 'a', 'translation': 'A'},
+            {'md5': 'm1', 'original': 'x', 'translation': 'B',
+             'engine_name': 'Human'},
+            {'original': 'unknown', 'translation': 'U'}])
+        self.assertEqual(3, import_cache(self.cache, self.path('test.jsonl')))
+        self.assertEqual(
+            [('A', 'Google', 'Chinese'), ('B', 'Human', 'Chinese'),
+             ('A', 'Google', 'Chinese'), (None, None, None)],
+            [(p.translation, p.engine_name, p.target_lang)
+             for p in self.cache.all_paragraphs()])
+
+    def test_export_and_import_cache(self):
+        self.cache.set_info('source_lang', 'English')
+        self.cache.update(
+            [0, 2], translation='A', target_lang='Chinese (Simplified)')
+        self.cache.update(3, translation='C', target_lang='Chinese')
+        export_cache(self.cache, self.path('test.tmx'))
+        with open(self.path('test.tmx'), encoding='utf-8') as file:
+            content = file.read()
+        # The language names are written as the codes of the engine.
+        self.assertIn('srclang="en"', content)
+        self.assertEqual(2, content.count('xml:lang="zh-CN"'))
+        self.assertEqual(1, content.count('xml:lang="und"'))
+        self.assertEqual(
+            ['m0', 'm2', 'm3'],
+            [segment['md5'] for segment in iter_tmx(self.path('test.tmx'))])
+
+        self.cache.update([0, 2, 3], translation=None)
+        self.assertEqual(3, import_cache(self.cache, self.path('test.tmx')))
+        self.assertEqual(
+            [('A', 'Chinese'), (None, None), ('A', 'Chinese'),
+             ('C', 'Chinese')],
+            [(p.translation, p.target_lang)
+             for p in self.cache.all_paragraphs()])
+
+    def test_import_memory(self):
+        write_jsonl(self.path('test.jsonl'), [
+            {'original': ' Hello ', 'translation': '你好'}])
+        memory = TranslationMemory(':memory:')
+        self.assertEqual(
+            1, import_memory(
+                memory, self.path('test.jsonl'), 'Google', 'Chinese'))
+        self.assertEqual('你好', memory.get('Hello', 'Google', 'Chinese'))
+        memory.close()
+
+    def test_import_memory_from_tmx(self):
+        with open(self.path('test.tmx'), 'w', encoding='utf-8') as file:
+            file.write(
+                '<?xml version="1.0" encoding="UTF-8"?>'
+                '<tmx version="1.4"><header srclang="en"/><body><tu>'
+                '<tuv xml:lang="en"><seg>Hello</seg></tuv>'
+                '<tuv xml:lang="zh-TW"><seg>你好</seg></tuv>'
+                '<tuv xml:lang="zh-CN"><seg>您好</seg></tuv>'
+                '</tu></body></tmx>')
+        memory = TranslationMemory(':memory:')
+        # Without the engine and the language of the importer.
+        self.assertEqual(0, import_memory(memory, self.path('test.tmx')))
+        self.assertEqual(
+            1, import_memory(
+                memory, self.path('test.tmx'), 'Google',
+                'Chinese (Simplified)'))
+        self.assertEqual(
+            '您好', memory.get('Hello', 'Google', 'Chinese (Simplified)'))
+        memory.close()
+
+    def test_import_memory_with_segment_engine(self):
+        write_jsonl(self.path('test.jsonl'), [
+            {'original': 'a', 'translation': '甲', 'engine_name': 'DeepL',
+             'target_lang': 'Japanese'},
+            {'original': 'b', 'translation': '乙'}])
+        memory = TranslationMemory(':memory:')
+        self.assertEqual(
+            1, import_memory(memory, self.path('test.jsonl')))
+        self.assertEqual(
+            1, import_memory(
+                memory, self.path('test.jsonl'), target_lang='Chinese'))
+        self.assertEqual('甲', memory.get('a', 'DeepL', 'Japanese'))
+        self.assertIsNone(memory.get('b', 'DeepL', 'Chinese'))
+        self.assertEqual(
+            2, import_memory(
+                memory, self.path('test.jsonl'), 'Google', 'Chinese'))
+        self.assertEqual('乙', memory.get('b', 'Google', 'Chinese'))
+        memory.close()
@@ -0,0 +1,257 @@
+import asyncio
+import unittest
+from unittest.mock import patch, Mock
+
+from ...lib.handler import (
+    TokenBucket, RateLimiter, AdaptiveConcurrency, Handler)
+from ...lib.exception import (
+    TranslationRetry, TranslationFailed, TranslationCanceled)
+
+
+module_name = 'calibre_plugins.ebook_translator.lib.handler'
+
+
+def count_processed(process_translations):
+    return sum(
+        len(args[0]) for args, _ in process_translations.call_args_list)
+
+
+class TestTokenBucket(unittest.TestCase):
+    @patch(module_name + '.time')
+    def test_reserve(self, mock_time):
+        mock_time.monotonic.return_value = 100.0
+        bucket = TokenBucket(60)
+        self.assertEqual(1.0, bucket.rate)
+        self.assertEqual(0.0, bucket.reserve(60))
+        self.assertEqual(2.0, bucket.reserve(2))
+        self.assertEqual(3.0, bucket.reserve(1))
+        # Refill the bucket as time goes by.
+        mock_time.monotonic.return_value = 110.0
+        self.assertEqual(0.0, bucket.reserve(1))
+        self.assertEqual(6.0, bucket.tokens)
+
+    @patch(module_name + '.time')
+    def test_reserve_more_than_capacity(self, mock_time):
+        mock_time.monotonic.return_value = 100.0
+        bucket = TokenBucket(60)
+        # The cost is limited to the capacity to be served at all.
+        self.assertEqual(0.0, bucket.reserve(1000))
+        self.assertEqual(0.0, bucket.tokens)
+        self.assertEqual(60.0, bucket.reserve(1000))
+        self.assertEqual(-60.0, bucket.tokens)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_disabled(self):
+        limiter = RateLimiter()
+        self.assertFalse(limiter.is_enabled())
+        self.assertEqual(0.0, limiter.reserve(1000))
+
+    @patch(module_name + '.time')
+    def test_wait(self, mock_time):
+        mock_time.monotonic.return_value = 100.0
+        limiter = RateLimiter(60, 600)
+        self.assertTrue(limiter.is_enabled())
+        self.assertEqual(0.0, limiter.wait(600))
+        mock_time.sleep.assert_not_called()
+        # The token bucket takes longer than the request bucket.
+        self.assertEqual(6.0, limiter.wait(60))
+        mock_time.sleep.assert_called_once_with(6.0)
+
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+    def setUp(self):
+        self.concurrency = AdaptiveConcurrency(10)
+
+    def test_created_concurrency(self):
+        self.assertEqual(10, self.concurrency.max_limit)
+        self.assertEqual(2, self.concurrency.limit)
+        self.assertTrue(self.concurrency.slow_start)
+        self.assertEqual(1, AdaptiveConcurrency(1).limit)
+
+    def test_is_overload(self):
+        self.assertTrue(self.concurrency.is_overload(
+            'HTTP Error 429: Too Many Requests'))
+        self.assertTrue(self.concurrency.is_overload('HTTP Error 503: any'))
+        self.assertTrue(self.concurrency.is_overload('The read timed out'))
+        self.assertFalse(self.concurrency.is_overload('HTTP Error 401: any'))
+
+    def test_adjust_slow_start(self):
+        for limit in range(3, 11):
+            with self.subTest(limit=limit):
+                self.assertTrue(self.concurrency.adjust(1.0))
+                self.assertEqual(limit, self.concurrency.limit)
+        # Never exceed the maximum limit.
+        self.assertFalse(self.concurrency.adjust(1.0))
+        self.assertEqual(10, self.concurrency.limit)
+
+    def test_adjust_overload(self):
+        self.concurrency.window = 8.0
+        self.assertTrue(self.concurrency.adjust(1.0, 'HTTP Error 429: any'))
+        self.assertEqual(4, self.concurrency.limit)
+        self.assertFalse(self.concurrency.slow_start)
+        # Grow linearly after the overload.
+        self.assertFalse(self.concurrency.adjust(1.0))
+        self.assertEqual(4.25, self.concurrency.window)
+        # Other errors do not affect the limit.
+        self.assertFalse(self.concurrency.adjust(1.0, 'any error'))
+        self.assertEqual(4.25, self.concurrency.window)
+
+    def test_adjust_rising_latency(self):
+        self.concurrency.adjust(1.0)
+        window = self.concurrency.window
+        self.assertFalse(self.concurrency.adjust(5.0))
+        self.assertEqual(window, self.concurrency.window)
+        self.assertFalse(self.concurrency.slow_start)
+
+    def test_adjust_base_latency_window(self):
+        concurrency = AdaptiveConcurrency(10, latency_window=3)
+        concurrency.adjust(0.1)
+        self.assertEqual(0.1, concurrency.base_latency)
+        concurrency.adjust(1.0)
+        concurrency.adjust(1.0)
+        self.assertEqual(3.0, concurrency.window)
+        # The fast sample has aged out of the window.
+        concurrency.adjust(1.0)
+        self.assertEqual(1.0, concurrency.base_latency)
+        self.assertGreater(concurrency.window, 3.0)
+
+    def test_acquire_and_release(self):
+        async def run():
+            await self.concurrency.acquire()
+            await self.concurrency.acquire()
+            self.assertEqual(2, self.concurrency.in_flight)
+            waiter = asyncio.create_task(self.concurrency.acquire())
+            await asyncio.sleep(0)
+            self.assertFalse(waiter.done())
+            await self.concurrency.release(1.0)
+            await asyncio.wait_for(waiter, 1)
+            self.assertEqual(2, self.concurrency.in_flight)
+        asyncio.run(run())
+
+
+class TestHandler(unittest.TestCase):
+    @patch(module_name + '.log', Mock())
+    def test_handle_adaptive(self):
+        paragraphs = [
+            Mock(is_cache=False, original='Hello World!') for _ in range(5)]
+        translate_paragraph = Mock()
+        process_translations = Mock()
+        handler = Handler(
+            paragraphs, 3, translate_paragraph, process_translations, 0, True)
+        asyncio.run(handler.process_tasks())
+
+        self.assertEqual(5, translate_paragraph.call_count)
+        self.assertEqual(5, count_processed(process_translations))
+        self.assertIsInstance(handler.concurrency, AdaptiveConcurrency)
+        self.assertEqual(3, handler.concurrency.limit)
+        for paragraph in paragraphs:
+            self.assertIsNone(paragraph.error)
+
+    def test_handle_retry(self):
+        paragraphs = [Mock(is_cache=False) for _ in range(3)]
+        attempts = []
+
+        def translate_paragraph(paragraph):
+            attempts.append(paragraph)
+            if paragraph is paragraphs[0] and attempts.count(paragraph) < 3:
+                raise TranslationRetry('HTTP Error 429: any', 0.01)
+
+        process_translations = Mock()
+        handler = Handler(
+            paragraphs, 1, translate_paragraph, process_translations, 0)
+        asyncio.run(handler.process_tasks())
+
+        # The failed paragraph does not block the others.
+        self.assertEqual(paragraphs[1:], attempts[1:3])
+        self.assertEqual(5, len(attempts))
+        self.assertEqual(3, count_processed(process_translations))
+        self.assertEqual(set(), handler.retries)
+
+    def test_handle_coroutine_function(self):
+        paragraphs = [Mock(is_cache=False) for _ in range(3)]
+        translated = []
+
+        async def translate_paragraph(paragraph):
+            await asyncio.sleep(0)
+            translated.append(paragraph)
+
+        process_translations = Mock()
+        handler = Handler(
+            paragraphs, 0, translate_paragraph, process_translations, 0)
+        asyncio.run(handler.process_tasks())
+
+        self.assertCountEqual(paragraphs, translated)
+        self.assertEqual(3, count_processed(process_translations))
+
+    def test_handle_batch(self):
+        paragraphs = [Mock(is_cache=False) for _ in range(3)]
+        translate_paragraph = Mock()
+        process_translations = Mock()
+        handler = Handler(
+            [paragraphs[:2], paragraphs[2]], 2, translate_paragraph,
+            process_translations, 0)
+        asyncio.run(handler.process_tasks())
+
+        self.assertEqual(2, translate_paragraph.call_count)
+        self.assertEqual(3, count_processed(process_translations))
+        for paragraph in paragraphs:
+            self.assertIsNone(paragraph.error)
+
+    def test_handle_failed_batch(self):
+        paragraphs = [Mock(is_cache=False) for _ in range(2)]
+
+        def translate_paragraph(item):
+            if isinstance(item, list) or item is paragraphs[0]:
+                raise TranslationFailed('any error')
+
+        process_translations = Mock()
+        handler = Handler(
+            [paragraphs], 1, translate_paragraph, process_translations, 0)
+        asyncio.run(handler.process_tasks())
+
+        # The paragraphs of the failed batch are translated one by one.
+        self.assertEqual(2, count_processed(process_translations))
+        self.assertIsNotNone(paragraphs[0].error)
+        self.assertIsNone(paragraphs[1].error)
+        self.assertEqual([0, 0], [p.retry for p in paragraphs])
+
+    def test_process_in_groups(self):
+        paragraphs = [Mock(is_cache=False) for _ in range(5)]
+        process_translations = Mock()
+        handler = Handler(
+            paragraphs, 0, Mock(), process_translations, 0)
+        handler.process_size = 2
+        asyncio.run(handler.process_tasks())
+
+        self.assertEqual(5, count_processed(process_translations))
+        for args, _ in process_translations.call_args_list:
+            self.assertLessEqual(len(args[0]), 2)
+        self.assertLess(process_translations.call_count, 5)
+
+    @patch(module_name + '.log')
+    def test_process_with_error(self, mock_log):
+        paragraphs = [Mock(is_cache=False) for _ in range(2)]
+        process_translations = Mock(side_effect=Exception('any error'))
+        handler = Handler(
+            paragraphs, 0, Mock(), process_translations, 0)
+        asyncio.run(handler.process_tasks())
+
+        # The failure does not stop the handler from finishing.
+        mock_log.error.assert_called()
+        self.assertEqual(2, count_processed(process_translations))
+
+    def test_process_finished_on_cancel(self):
+        paragraphs = [Mock(is_cache=False) for _ in range(3)]
+
+        def translate_paragraph(paragraph):
+            if paragraph is paragraphs[1]:
+                raise TranslationCanceled('canceled')
+
+        process_translations = Mock()
+        handler = Handler(
+            paragraphs, 1, translate_paragraph, process_translations, 0)
+        asyncio.run(handler.process_tasks())
+
+        # The finished paragraph is kept instead of being discarded.
+        process_translations.assert_called_once_with([paragraphs[0]])
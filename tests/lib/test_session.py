@@ -0,0 +1,272 @@
+import ssl
+import gzip
+import zlib
+import asyncio
+import unittest
+from unittest.mock import patch, Mock
+
+from ...lib.session import (
+    ConnectionPool, HTTPSConnection, Session, BufferedResponse,
+    decode_content, get_proxy_headers, get_session)
+from ...lib.exception import HTTPRequestError
+
+
+module_name = 'calibre_plugins.ebook_translator.lib.session'
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool('https', 'example.com', 443)
+
+    @patch(module_name + '.HTTPSConnection')
+    def test_acquire_new_connection(self, mock_connection):
+        connection, reused = self.pool.acquire(10)
+        self.assertIs(mock_connection(), connection)
+        self.assertFalse(reused)
+        self.assertEqual(1, self.pool.requests)
+        self.assertEqual(0, self.pool.reused)
+
+    def test_acquire_released_connection(self):
+        connection = Mock()
+        self.pool.release(connection, Mock(isclosed=Mock(return_value=True)))
+        self.assertEqual((connection, True), self.pool.acquire(10))
+        self.assertEqual(1, self.pool.reused)
+        self.assertEqual([], self.pool.connections)
+
+    @patch(module_name + '.HTTPSConnection')
+    def test_acquire_skip_closed_connection(self, mock_connection):
+        connection = Mock(sock=None)
+        self.pool.release(connection, Mock(isclosed=Mock(return_value=True)))
+        self.assertEqual(
+            (mock_connection(), False), self.pool.acquire(10))
+        self.assertEqual(0, self.pool.reused)
+        self.assertEqual([], self.pool.connections)
+        connection.close.assert_called_once_with()
+
+    @patch(module_name + '.HTTPSConnection')
+    def test_acquire_skip_unfinished_response(self, mock_connection):
+        connection = Mock()
+        self.pool.release(connection, Mock(isclosed=Mock(return_value=False)))
+        self.assertEqual(
+            (mock_connection(), False), self.pool.acquire(10))
+        self.assertEqual(1, len(self.pool.connections))
+
+    def test_release_over_max_size(self):
+        connections = [Mock() for _ in range(self.pool.max_size + 1)]
+        for connection in connections:
+            self.pool.release(connection)
+        self.assertEqual(self.pool.max_size, len(self.pool.connections))
+        connections[0].close.assert_called_once()
+
+    @patch(module_name + '.HTTPSConnection')
+    def test_new_connection_with_proxy_credentials(self, mock_connection):
+        pool = ConnectionPool(
+            'https', 'example.com', 443, 'http://a%40b:c@127.0.0.1:8080')
+        connection = pool._new_connection(10)
+        mock_connection.assert_called_once_with(
+            '127.0.0.1', 8080, timeout=10, context=None, pool=pool)
+        connection.set_tunnel.assert_called_once_with(
+            'example.com', 443,
+            headers={'Proxy-Authorization': 'Basic YUBiOmM='})
+
+
+class TestHTTPSConnection(unittest.TestCase):
+    @patch(module_name + '.http.client.HTTPConnection.connect')
+    def test_connect_close_refused_session(self, mock_connect):
+        pool = Mock(tls_session=Mock())
+        connection = HTTPSConnection('example.com', pool=pool)
+        sockets = [Mock(), Mock()]
+
+        def connect(self):
+            self.sock = sockets[mock_connect.call_count - 1]
+        mock_connect.side_effect = connect
+        connection._context = Mock()
+        connection._context.wrap_socket.side_effect = [
+            ssl.SSLError(), 'secure']
+
+        connection.connect()
+        sockets[0].close.assert_called_once()
+        sockets[1].close.assert_not_called()
+        self.assertEqual('secure', connection.sock)
+        pool.save_tls_session.assert_called_once_with('secure')
+
+
+class TestGetProxyHeaders(unittest.TestCase):
+    def test_get_proxy_headers(self):
+        self.assertEqual({}, get_proxy_headers(None))
+        self.assertEqual({}, get_proxy_headers('http://127.0.0.1:8080'))
+        self.assertEqual(
+            {'Proxy-Authorization': 'Basic dXNlcjo='},
+            get_proxy_headers('http://user@127.0.0.1:8080'))
+
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        self.session = Session('test')
+
+    def test_prepare_get_with_dict(self):
+        self.assertEqual(
+            ('https://example.com/api?a=1&b=2', None, {}),
+            self.session._prepare(
+                'https://example.com/api', {'a': 1, 'b': 2}, {}, 'GET'))
+
+    def test_prepare_post_with_str(self):
+        self.assertEqual(
+            ('https://example.com/api', '你好'.encode('utf-8'),
+             {'Content-Type': 'application/x-www-form-urlencoded'}),
+            self.session._prepare('https://example.com/api', '你好', {}, 'POST'))
+        self.assertEqual(
+            ('https://example.com/api', b'{}',
+             {'content-type': 'application/json'}),
+            self.session._prepare(
+                'https://example.com/api', '{}',
+                {'content-type': 'application/json'}, 'POST'))
+
+    @patch(module_name + '.get_proxies', Mock(return_value={}))
+    def test_request(self):
+        pool = Mock()
+        connection = Mock()
+        response = Mock(status=200)
+        response.getheader.return_value = None
+        response.read.return_value = b' {"text": "\xe4\xbd\xa0\xe5\xa5\xbd"} '
+        connection.getresponse.return_value = response
+        pool.acquire.return_value = (connection, False)
+
+        with patch.object(self.session, 'get_pool', return_value=pool):
+            self.assertEqual(
+                '{"text": "你好"}',
+                self.session.request(
+                    'https://example.com/api?x=1', 'a=1', method='POST'))
+
+        connection.request.assert_called_once_with(
+            'POST', '/api?x=1', body=b'a=1', headers={
+                'Content-Type': 'application/x-www-form-urlencoded'})
+        pool.release.assert_called_once_with(connection, response)
+
+    @patch(module_name + '.get_proxies', Mock(return_value={}))
+    def test_request_http_with_proxy_credentials(self):
+        pool = Mock(scheme='http', proxy_headers={
+            'Proxy-Authorization': 'Basic dXNlcjo='})
+        connection = Mock()
+        response = Mock(status=200)
+        response.getheader.return_value = None
+        response.read.return_value = b'ok'
+        connection.getresponse.return_value = response
+        pool.acquire.return_value = (connection, False)
+
+        with patch.object(self.session, 'get_pool', return_value=pool):
+            self.session.request(
+                'http://example.com/api', proxy_uri='http://user@127.0.0.1')
+        connection.request.assert_called_once_with(
+            'GET', 'http://example.com/api', body=None, headers={
+                'Proxy-Authorization': 'Basic dXNlcjo='})
+
+    @patch(module_name + '.get_proxies', Mock(return_value={}))
+    def test_request_with_http_error(self):
+        pool = Mock()
+        connection = Mock()
+        response = Mock(status=429, reason='Too Many Requests')
+        response.getheader.return_value = None
+        response.read.return_value = b'{"error": "any error"}'
+        connection.getresponse.return_value = response
+        pool.acquire.return_value = (connection, False)
+
+        with patch.object(self.session, 'get_pool', return_value=pool):
+            with self.assertRaises(Exception) as cm:
+                self.session.request('https://example.com/api')
+        self.assertRegex(str(cm.exception), 'HTTP Error 429')
+        self.assertRegex(str(cm.exception), '{"error": "any error"}')
+
+    def test_stats(self):
+        pool = ConnectionPool('https', 'example.com', 443)
+        pool.requests, pool.reused, pool.handshakes = 10, 8, 2
+        self.session.pools[('https', 'example.com', 443)] = pool
+        stats = self.session.stats()
+        self.assertEqual(10, stats['requests'])
+        self.assertEqual(0.8, stats['reuse_ratio'])
+        self.assertEqual(8, stats['handshakes_avoided'])
+
+        self.session.reset_stats()
+        self.assertEqual(0, self.session.stats()['requests'])
+        self.assertEqual(0, pool.handshakes)
+
+    def test_get_session(self):
+        self.assertIs(get_session('test'), get_session('test'))
+        self.assertIsNot(get_session('test'), get_session('other'))
+
+
+class TestBufferedResponse(unittest.TestCase):
+    def test_readline(self):
+        response = BufferedResponse(b'a\nb\n', 200, {})
+        self.assertEqual(200, response.status)
+        self.assertEqual(b'a\n', response.readline())
+        self.assertEqual(b'b\n', response.readline())
+        self.assertRaises(EOFError, response.readline)
+
+
+class TestDecodeContent(unittest.TestCase):
+    def test_decode_content(self):
+        self.assertEqual(b'abc', decode_content(b'abc', None))
+        self.assertEqual(
+            b'abc', decode_content(gzip.compress(b'abc'), 'gzip'))
+        self.assertEqual(
+            b'abc', decode_content(zlib.compress(b'abc'), 'deflate'))
+
+
+class TestAsyncSession(unittest.TestCase):
+    def setUp(self):
+        self.session = Session('test')
+
+    @patch(module_name + '.get_proxies', Mock(return_value={}))
+    def test_request_async(self):
+        async def send(pool, method, target, data, headers, host):
+            self.assertEqual(
+                ('POST', '/api', b'a=1', 'example.com'),
+                (method, target, data, host))
+            return 200, 'OK', {}, b' {"text": "ok"} '
+
+        with patch.object(self.session, '_send_async', side_effect=send):
+            self.assertEqual(
+                '{"text": "ok"}', asyncio.run(self.session.request_async(
+                    'https://example.com/api', {'a': 1}, method='POST')))
+
+    @patch(module_name + '.get_proxies', Mock(return_value={}))
+    def test_request_async_raw_object(self):
+        async def send(*args):
+            return 200, 'OK', {}, b'data: 1\n'
+
+        with patch.object(self.session, '_send_async', side_effect=send):
+            response = asyncio.run(self.session.request_async(
+                'https://example.com/api', raw_object=True))
+        self.assertIsInstance(response, BufferedResponse)
+        self.assertEqual(b'data: 1\n', response.readline())
+
+    @patch(module_name + '.get_proxies', Mock(return_value={}))
+    def test_request_async_with_http_error(self):
+        async def send(*args):
+            return 429, 'Too Many Requests', {'Retry-After': '3'}, b'any'
+
+        with patch.object(self.session, '_send_async', side_effect=send):
+            with self.assertRaises(HTTPRequestError) as cm:
+                asyncio.run(self.session.request_async(
+                    'https://example.com/api'))
+        self.assertRegex(str(cm.exception), 'HTTP Error 429')
+        self.assertEqual({'Retry-After': '3'}, cm.exception.headers)
+
+    @patch(module_name + '.sys', Mock(version_info=(3, 10)))
+    @patch(module_name + '.get_proxies', Mock(return_value={}))
+    def test_request_async_tunnel_before_python_3_11(self):
+        response = Mock(status=200, headers={})
+        response.read.return_value = b'data: 1\n'
+        with patch.object(self.session, 'request', return_value=response) \
+                as mock_request, patch.object(
+                    self.session, '_send_async') as mock_send:
+            result = asyncio.run(self.session.request_async(
+                'https://example.com/api', proxy_uri='http://127.0.0.1:8080',
+                raw_object=True))
+        mock_request.assert_called_once_with(
+            'https://example.com/api', None, {}, 'GET', 30,
+            'http://127.0.0.1:8080', True)
+        mock_send.assert_not_called()
+        self.assertIsInstance(result, BufferedResponse)
+        self.assertEqual(b'data: 1\n', result.readline())
@@ -1,9 +1,15 @@
+import re
+import asyncio
+import sqlite3
 import unittest
-from unittest.mock import patch, Mock, call
+from unittest.mock import patch, Mock, AsyncMock, call
 
 from ...lib.utils import dummy
-from ...lib.translation import Glossary, ProgressBar, Translation
-from ...lib.exception import TranslationCanceled, TranslationFailed
+from ...lib.translation import (
+    Glossary, ProgressBar, Translation, trie_pattern)
+from ...lib.exception import (
+    TranslationCanceled, TranslationFailed, TranslationRetry,
+    HTTPRequestError)
 from ...engines.base import Base
 from ...engines.deepl import DeeplTranslate
 
@@ -56,6 +62,40 @@ class TestGlossary(unittest.TestCase):
         self.assertEqual(
             'a Z c', glossary.restore('<m id=000000 /> <m id=000001 /> c'))
 
+    def test_replace_longest_word_first(self):
+        glossary = Glossary(Base.placeholder)
+        glossary.glossary = [
+            ('New', 'Neu'), ('New York', 'NY'), ('id', 'ID'), ('a+b', 'A')]
+        self.assertEqual(
+            '{{id_000001}}, {{id_000000}} Jersey, {{id_000003}}',
+            glossary.replace('New York, New Jersey, a+b'))
+
+    def test_restore_unknown_placeholder(self):
+        glossary = Glossary(Base.placeholder)
+        glossary.glossary = [('a', 'a')]
+        self.assertEqual(
+            'a {{id_000009}}',
+            glossary.restore('{{ id_000000 }} {{id_000009}}'))
+
+    def test_compile(self):
+        glossary = Glossary(Base.placeholder)
+        glossary.glossary = [('a', 'A'), ('', 'B'), ('a', 'C')]
+        glossary.compile()
+        self.assertEqual({'a': '{{id_000000}}'}, glossary.replacements)
+
+        glossary.glossary = []
+        glossary.compile()
+        self.assertIsNone(glossary.replace_pattern)
+        self.assertEqual('a b', glossary.replace('a b'))
+
+
+class TestTriePattern(unittest.TestCase):
+    def test_trie_pattern(self):
+        pattern = re.compile(trie_pattern(['ab', 'abc', 'b', 'a.c']))
+        self.assertEqual(
+            ['abc', 'ab', 'b', 'a.c'],
+            pattern.findall('abc ab b a.c axc'))
+
 
 class TestProgressBar(unittest.TestCase):
     def test_load(self):
@@ -175,9 +215,11 @@ class TestTranslation(unittest.TestCase):
 
     @patch.object(Translation, 'need_stop', lambda self: False)
     @patch(f'{module_name}.traceback_error')
-    @patch(f'{module_name}.time')
-    def test_translate_text_retry_failed_translation(self, mock_time, mock_te):
+    @patch(f'{module_name}.random')
+    def test_translate_text_retry_failed_translation(
+            self, mock_random, mock_te):
         mock_te.return_value = 'test error trackback'
+        mock_random.uniform.side_effect = lambda a, b: b
         self.translation.translator.match_error.return_value = False
         self.translation.translator.translate.side_effect = Exception(
             'network error')
@@ -185,8 +227,15 @@ class TestTranslation(unittest.TestCase):
         self.translation.cancel_request = self.cancel_request
         self.translator.request_attempt = 5
 
+        for retry, interval in enumerate((5, 10, 20, 40, 80)):
+            with self.subTest(retry=retry):
+                with self.assertRaises(TranslationRetry) as cm:
+                    self.translation.translate_text(0, 'text', retry)
+                self.assertEqual('network error', str(cm.exception))
+                self.assertEqual(interval, cm.exception.delay)
+
         with self.assertRaises(TranslationFailed) as cm:
-            self.translation.translate_text(0, 'text')
+            self.translation.translate_text(0, 'text', 5)
 
         self.assertEqual(
             str(cm.exception),
@@ -198,17 +247,110 @@ class TestTranslation(unittest.TestCase):
             'Row: 0\n'
             'Original: text\n'
             '┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈\n'
-            'Status: Failed 1 times / Sleeping for 5 seconds\n'
+            'Status: Failed 1 times / Will be retried in 5.0 seconds\n'
             '┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈\n'
             'Error: test error trackback')
         self.log.assert_any_call(log_text, True)
-        mock_time.sleep.assert_has_calls([
-            call(5), call(10), call(15), call(20), call(25)])
         self.assertEqual(6, self.translation.abort_count)
 
+    def test_get_retry_interval_with_retry_after(self):
+        error = HTTPRequestError('any error', 429, {'retry-after': '7'})
+        self.assertEqual(7, self.translation.get_retry_interval(1, error))
+
+        # Find the headers from the chained exceptions.
+        try:
+            try:
+                raise error
+            except Exception:
+                raise Exception('any parse error')
+        except Exception as e:
+            self.assertEqual(7, self.translation.get_retry_interval(1, e))
+
+    def test_get_retry_interval_with_long_retry_after(self):
+        error = HTTPRequestError(
+            'any error', 429, {'x-ratelimit-reset-tokens': '6m0s'})
+        self.assertEqual(120, self.translation.get_retry_interval(1, error))
+
+    def test_get_retry_interval_ignore_retry_after(self):
+        # Only the overload responses carry a meaningful delay.
+        error = HTTPRequestError(
+            'any error', 500, {'x-ratelimit-reset-tokens': '6m0s'})
+        self.assertGreaterEqual(
+            5, self.translation.get_retry_interval(1, error))
+
+    def test_get_retry_interval_with_backoff(self):
+        for retry in range(1, 10):
+            with self.subTest(retry=retry):
+                interval = min(120, 5 * 2 ** (retry - 1))
+                self.assertLessEqual(
+                    interval / 2,
+                    self.translation.get_retry_interval(retry, None))
+                self.assertGreaterEqual(
+                    interval,
+                    self.translation.get_retry_interval(retry, None))
+
+    def test_translate_paragraph_retry(self):
+        self.paragraph.translation = None
+        self.paragraph.retry = 1
+        self.glossary.replace.return_value = 'text'
+        with patch.object(self.translation, 'translate_text') as mock_tt:
+            mock_tt.side_effect = TranslationRetry('any error', 10)
+            with self.assertRaises(TranslationRetry):
+                self.translation.translate_paragraph(self.paragraph)
+            mock_tt.assert_called_once_with(self.paragraph.row, 'text', 1)
+        self.assertEqual(2, self.paragraph.retry)
+
+    def test_translate_text_with_rate_limiter(self):
+        self.translator.translate.return_value = 'translation'
+        self.translator.estimate_tokens.return_value = 4
+        self.translation.rate_limiter = Mock()
+        self.translation.rate_limiter.is_enabled.return_value = True
+
+        self.assertEqual(
+            'translation', self.translation.translate_text(0, 'text'))
+        self.translator.estimate_tokens.assert_called_once_with('text')
+        self.translation.rate_limiter.wait.assert_called_once_with(4)
+
     def test_translate_cancel_due_to_fatal_error(self):
         pass
 
+    def test_translate_text_async(self):
+        self.translator.translate_async = AsyncMock(return_value='你好')
+        self.translation.abort_count = 2
+        self.assertEqual(
+            '你好',
+            asyncio.run(self.translation.translate_text_async(0, 'hello')))
+        self.translator.translate_async.assert_awaited_once_with('hello')
+        self.assertEqual(0, self.translation.abort_count)
+
+    @patch.object(Translation, 'need_stop', lambda self: False)
+    def test_translate_text_async_retry(self):
+        self.translator.translate_async = AsyncMock(
+            side_effect=Exception('network error'))
+        self.translator.match_error.return_value = False
+        self.translator.request_attempt = 3
+        with self.assertRaises(TranslationRetry):
+            asyncio.run(self.translation.translate_text_async(0, 'hello'))
+        with self.assertRaises(TranslationFailed):
+            asyncio.run(self.translation.translate_text_async(0, 'hello', 3))
+
+    def test_translate_paragraph_async(self):
+        self.translation.set_fresh(True)
+        self.translator.merge_enabled = False
+        self.translator.translate_async = AsyncMock(return_value='你好世界')
+        self.glossary.replace.return_value = 'Hello World'
+        self.glossary.restore.return_value = '你好世界'
+        self.translator.name = 'Google'
+        self.translator.get_target_lang.return_value = 'zh'
+
+        asyncio.run(self.translation.translate_paragraph_async(self.paragraph))
+
+        self.translator.translate_async.assert_awaited_once_with(
+            'Hello World')
+        self.assertEqual('你好世界', self.paragraph.translation)
+        self.assertEqual('Google', self.paragraph.engine_name)
+        self.assertFalse(self.paragraph.is_cache)
+
     def test_translate_paragraph_cancel(self):
         self.translation.cancel_request = self.cancel_request
         self.cancel_request.return_value = True
@@ -288,3 +430,242 @@ class TestTranslation(unittest.TestCase):
         self.translation.translate_paragraph(self.paragraph)
 
         self.paragraph.do_aligment.assert_called_once_with('\n\n')
+
+    def test_create_batches(self):
+        self.translator.batch_size = 3
+        self.translator.batch_characters = 10
+        paragraphs = [
+            Mock(original=original, translation=translation)
+            for original, translation in (
+                ('a', None), ('bb', None), ('c', 'C'), ('dd', None),
+                ('eeeeeeeeee', None), ('f', None), ('g', None),
+                ('h', None), ('i', None))]
+
+        a, b, c, d, e, f, g, h, i = paragraphs
+        # The cached paragraph does not need to wait for a batch.
+        self.assertEqual(
+            [c, [a, b, d], e, [f, g, h], i],
+            list(self.translation.create_batches(paragraphs)))
+
+        self.translation.set_fresh(True)
+        self.assertEqual(
+            [[a, b, c], d, e, [f, g, h], i],
+            list(self.translation.create_batches(paragraphs)))
+
+    def test_translate_paragraphs(self):
+        self.translation.set_fresh(True)
+        self.translator.merge_enabled = False
+        self.translator.translate_batch.return_value = ['你好', '世界']
+        self.glossary.replace.side_effect = lambda text: text
+        self.glossary.restore.side_effect = lambda text: text
+        paragraphs = [
+            Mock(row=1, original='Hello', retry=0),
+            Mock(row=2, original='World', retry=0)]
+
+        self.translation.translate_paragraph(paragraphs)
+
+        self.translator.translate_batch.assert_called_once_with(
+            ['Hello', 'World'])
+        self.assertEqual(
+            ['你好', '世界'], [p.translation for p in paragraphs])
+
+    def test_translate_paragraphs_retry(self):
+        self.translation.set_fresh(True)
+        self.glossary.replace.side_effect = lambda text: text
+        paragraphs = [
+            Mock(row=1, original='Hello', retry=0),
+            Mock(row=2, original='World', retry=1)]
+        with patch.object(self.translation, 'translate_texts') as mock_tt:
+            mock_tt.side_effect = TranslationRetry('any error', 10)
+            with self.assertRaises(TranslationRetry):
+                self.translation.translate_paragraph(paragraphs)
+            mock_tt.assert_called_once_with(1, ['Hello', 'World'], 1)
+        self.assertEqual([2, 2], [p.retry for p in paragraphs])
+
+    def test_translate_paragraphs_async(self):
+        self.translation.set_fresh(True)
+        self.translator.merge_enabled = False
+        self.translator.translate_batch_async = AsyncMock(
+            return_value=['你好', '世界'])
+        self.glossary.replace.side_effect = lambda text: text
+        self.glossary.restore.side_effect = lambda text: text
+        paragraphs = [
+            Mock(row=1, original='Hello', retry=0),
+            Mock(row=2, original='World', retry=0)]
+
+        asyncio.run(self.translation.translate_paragraph_async(paragraphs))
+
+        self.translator.translate_batch_async.assert_awaited_once_with(
+            ['Hello', 'World'])
+        self.assertEqual(
+            ['你好', '世界'], [p.translation for p in paragraphs])
+
+    def test_translate_paragraph_from_memory(self):
+        self.translator.name = 'Google'
+        self.translator.get_target_lang.return_value = 'zh'
+        self.paragraph.translation = None
+        self.paragraph.original = 'Chapter 1'
+        memory = Mock()
+        memory.get.return_value = '第一章'
+        self.translation.set_memory(memory)
+
+        self.translation.translate_paragraph(self.paragraph)
+
+        memory.get.assert_called_once_with('Chapter 1', 'Google', 'zh')
+        self.translator.translate.assert_not_called()
+        self.assertEqual('第一章', self.paragraph.translation)
+        self.assertTrue(self.paragraph.is_cache)
+
+    def test_translate_paragraph_into_memory(self):
+        self.translator.name = 'Google'
+        self.translator.merge_enabled = False
+        self.translator.get_target_lang.return_value = 'zh'
+        self.translator.translate.return_value = '第一章'
+        self.glossary.restore.return_value = '第一章'
+        self.paragraph.translation = None
+        self.paragraph.original = 'Chapter 1'
+        memory = Mock()
+        memory.get.return_value = None
+        self.translation.set_memory(memory)
+
+        self.translation.translate_paragraph(self.paragraph)
+
+        # The memory is updated with the processed paragraphs in groups.
+        memory.add.assert_not_called()
+        memory.add_paragraphs.assert_not_called()
+        self.assertFalse(self.paragraph.is_cache)
+
+    def test_translate_paragraph_with_memory_error(self):
+        self.translator.translate.return_value = 'translation'
+        self.glossary.restore.return_value = 'translation'
+        self.paragraph.translation = None
+        memory = Mock()
+        memory.get.side_effect = sqlite3.OperationalError('database is locked')
+        self.translation.set_memory(memory)
+        self.translation.set_logging(Mock())
+
+        self.translation.translate_paragraph(self.paragraph)
+
+        self.assertEqual('translation', self.paragraph.translation)
+        self.translation.log.assert_called_once_with(
+            'Failed to look up translation memory: database is locked', True)
+
+    def test_merge_duplicates(self):
+        a, b, c, d = paragraphs = [
+            Mock(original='* * *', translation=None),
+            Mock(original='Hello', translation=None),
+            Mock(original='* * *', translation=None),
+            Mock(original='* * *', translation='* * *')]
+
+        self.assertEqual(
+            [a, b, d], list(self.translation.merge_duplicates(paragraphs)))
+        self.assertEqual({a: [c]}, self.translation.duplicates)
+
+        self.translation.set_fresh(True)
+        self.assertEqual(
+            [a, b], list(self.translation.merge_duplicates(paragraphs)))
+        self.assertEqual({a: [c, d]}, self.translation.duplicates)
+
+    @patch(module_name + '.RateLimiter', Mock())
+    @patch(module_name + '.Handler')
+    def test_handle_stream(self, mock_handler):
+        self.translator.support_batch.return_value = False
+        self.translator.async_transport = False
+        self.translator.session.stats.return_value = {'requests': 0}
+        self.translation.set_logging(Mock())
+        a, b, c = paragraphs = [
+            Mock(original='Hello', translation=None),
+            Mock(original='* * *', translation=None),
+            Mock(original='* * *', translation=None)]
+
+        self.translation.handle(iter(paragraphs))
+
+        self.assertEqual(3, self.translation.total)
+        self.assertEqual([a, b], mock_handler.call_args[0][0])
+        self.assertEqual({b: [c]}, self.translation.duplicates)
+        self.translation.log.assert_any_call('Character count: 15')
+        mock_handler().handle.assert_called_once_with()
+
+    @patch(module_name + '.RateLimiter', Mock())
+    @patch(module_name + '.Handler')
+    def test_handle_close_memory_on_failure(self, mock_handler):
+        self.translator.support_batch.return_value = False
+        self.translator.async_transport = False
+        self.translation.set_logging(Mock())
+        memory = Mock()
+        self.translation.set_memory(memory)
+        mock_handler().handle.side_effect = Exception('any error')
+
+        with self.assertRaises(Exception):
+            self.translation.handle([Mock(original='a', translation=None)])
+        memory.close.assert_called_once_with()
+
+    def test_process_translation_with_duplicates(self):
+        self.translation.set_callback(Mock())
+        self.translation.progress_bar.load(2)
+        paragraph = Mock(
+            original='* * *', translation='※', engine_name='Google',
+            target_lang='zh', is_cache=False, error=None, row=1)
+        duplicate = Mock(original='* * *', translation=None, row=2)
+        self.translation.duplicates = {paragraph: [duplicate]}
+
+        self.translation.process_translation(paragraph)
+
+        self.assertEqual('※', duplicate.translation)
+        self.assertEqual('Google', duplicate.engine_name)
+        self.assertEqual('zh', duplicate.target_lang)
+        self.assertFalse(duplicate.is_cache)
+        self.assertIsNone(duplicate.error)
+        self.translation.callback.assert_has_calls(
+            [call(paragraph), call(duplicate)])
+        self.assertEqual({}, self.translation.duplicates)
+
+    def test_process_translations(self):
+        self.translation.set_progress(Mock())
+        self.translation.set_logging(Mock())
+        self.translation.set_callback(Mock())
+        self.translation.set_bulk_callback(Mock())
+        self.translation.progress_bar.load(3)
+        paragraphs = [
+            Mock(original='a', translation='A', is_cache=False, error=None,
+                 row=row) for row in range(3)]
+
+        self.translation.process_translations(paragraphs)
+
+        self.translation.progress.assert_called_once_with(
+            1.0, 'Translating: 3/3')
+        self.translation.log.assert_called_once()
+        self.assertEqual(3, self.translation.callback.call_count)
+        self.translation.bulk_callback.assert_called_once_with(paragraphs)
+
+    def test_process_translations_into_memory(self):
+        self.translation.progress_bar.load(3)
+        a, b, c = paragraphs = [
+            Mock(original='a', translation='A', is_cache=False, error=None,
+                 row=0),
+            Mock(original='b', translation='B', is_cache=True, error=None,
+                 row=1),
+            Mock(original='c', translation=None, is_cache=False,
+                 error='any error', row=2)]
+        memory = Mock()
+        self.translation.set_memory(memory)
+
+        self.translation.process_translations(paragraphs)
+
+        memory.add_paragraphs.assert_called_once()
+        self.assertEqual([a], list(memory.add_paragraphs.call_args[0][0]))
+
+    def test_process_translations_with_memory_error(self):
+        self.translation.progress_bar.load(1)
+        self.translation.set_logging(Mock())
+        memory = Mock()
+        memory.add_paragraphs.side_effect = sqlite3.OperationalError(
+            'database is locked')
+        self.translation.set_memory(memory)
+
+        self.translation.process_translations([
+            Mock(original='a', translation='A', is_cache=False, error=None,
+                 row=0)])
+
+        self.translation.log.assert_any_call(
+            'Failed to update translation memory: database is locked', True)
@@ -1,3 +1,7 @@
+import re
+import os
+import random
+import tempfile
 import unittest
 from unittest.mock import patch
 from types import GeneratorType
@@ -7,8 +11,8 @@ from lxml import etree  # type: ignore
 from ...vendor.cssselect import SelectorError
 
 from ...lib.utils import (
-    ns, css, css_to_xpath, create_xpath, uid, trim, chunk, group, open_file,
-    request)
+    ns, css, css_to_xpath, create_xpath, uid, fingerprint, trim, chunk, group,
+    open_file, request, parse_duration, retry_after)
 
 
 module_name = 'calibre_plugins.ebook_translator.lib.utils'
@@ -73,6 +77,26 @@ class TestUtils(unittest.TestCase):
         self.assertEqual('202cb962ac59075b964b07152d234b70', uid(b'123'))
         self.assertEqual('e10adc3949ba59abbe56e057f20f883e', uid('123', '456'))
 
+    def test_fingerprint(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'test.epub')
+            with open(path, 'wb') as file:
+                file.write(b'123')
+            self.assertEqual(uid('3', '123'), fingerprint(path))
+
+            with open(path, 'wb') as file:
+                file.write(bytes(range(256)) * 100)
+            identity = fingerprint(path, 10, 4)
+            # The bytes between the sampled blocks are not read.
+            with open(path, 'r+b') as file:
+                file.seek(20)
+                file.write(b'x')
+            self.assertEqual(identity, fingerprint(path, 10, 4))
+            with open(path, 'r+b') as file:
+                file.seek(25600 - 5)
+                file.write(b'x')
+            self.assertNotEqual(identity, fingerprint(path, 10, 4))
+
     def test_trim(self):
         self.assertEqual('abc', trim('   abc   '))
         self.assertEqual('a b c', trim(' a b c '))
@@ -83,6 +107,29 @@ class TestUtils(unittest.TestCase):
             '\xa0', '\x1a', u'\u3000')
         self.assertEqual('a b c', trim(content))
 
+    def test_trim_same_as_previous(self):
+        def previous_trim(text):
+            text = re.sub(u'\u00a0|\u3000', ' ', text)
+            text = re.sub(u'\u200b|\ufeff', '', text)
+            text = re.sub(r'\s+', ' ', text)
+            text = re.sub(r'(?![\n\r\t])[\x00-\x1f\x7f-\xa0\xad]', '', text)
+            return text.strip()
+
+        # Every character up to \u3100 between spaces, and random strings
+        # mixing the white spaces, controls and zero-width characters.
+        corpus = [' a%s b ' % chr(code) for code in range(0x3100)]
+        characters = [
+            'a', '\u4e2d', '\xe9', ' ', '\n', '\r', '\t', '\x0b', '\x0c',
+            '\x1c', '\x85', '\xa0', '\u2003', '\u3000', '\u200b', '\ufeff',
+            '\u200c', '\x00', '\x07', '\x1a', '\x7f', '\x9f', '\xad']
+        generator = random.Random(0)
+        for _ in range(20000):
+            corpus.append(''.join(
+                generator.choice(characters)
+                for _ in range(generator.randint(0, 20))))
+        for text in corpus:
+            self.assertEqual(previous_trim(text), trim(text), repr(text))
+
     def test_chunk(self):
         data = [1, 2, 3, 4, 5, 6, 7, 8, 9, 0]
         self.assertIsInstance(chunk(data, 3), GeneratorType)
@@ -112,6 +159,33 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(
             [(1, 3), (5, 7), (9, 9)], group([1, 2, 3, 5, 6, 7, 9]))
 
+    @patch(module_name + '.time')
+    def test_parse_duration(self, mock_time):
+        mock_time.time.return_value = 1700000000.0
+        self.assertEqual(20.0, parse_duration('20'))
+        self.assertEqual(1.5, parse_duration(' 1.5 '))
+        self.assertEqual(0.02, parse_duration('20ms'))
+        self.assertEqual(360.0, parse_duration('6m0s'))
+        self.assertEqual(3661.0, parse_duration('1h1m1s'))
+        self.assertEqual(30.0, parse_duration('1700000030'))
+        self.assertEqual(
+            60.0, parse_duration('Tue, 14 Nov 2023 22:14:20 GMT'))
+        self.assertIsNone(parse_duration('6m0x'))
+        self.assertIsNone(parse_duration('any'))
+
+    def test_retry_after(self):
+        self.assertIsNone(retry_after(None))
+        self.assertIsNone(retry_after({}))
+        self.assertEqual(0.5, retry_after({'retry-after-ms': '500'}))
+        self.assertEqual(
+            7.0, retry_after({
+                'retry-after': '7', 'x-ratelimit-reset-tokens': '1m'}))
+        self.assertEqual(
+            60.0, retry_after({
+                'x-ratelimit-reset-requests': '1s',
+                'x-ratelimit-reset-tokens': '1m'}))
+        self.assertEqual(0.0, retry_after({'retry-after': '-1'}))
+
     @patch(module_name + '.open')
     def test_open_file(self, mock_open):
         mock_open.return_value.__enter__.return_value.read.return_value = 'a'